@@ -0,0 +1,227 @@
+"""
+依賴服務斷路器
+每個外部依賴（嵌入、Pinecone、各MCP服務）各有一個斷路器，統計最近BREAKER_WINDOW_SECONDS秒的呼叫：
+失敗或超過BREAKER_SLOW_CALL_SECONDS的慢呼叫比例達BREAKER_FAILURE_RATE（且至少BREAKER_MIN_CALLS次）時開啟，
+開啟期間呼叫立即失敗（CircuitOpenError），由呼叫端改用備援（略過RAG、使用快取結果）；
+BREAKER_OPEN_SECONDS秒後進入半開狀態，只放行一個探測呼叫，成功則關閉、失敗則再次開啟
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, Optional, Tuple
+
+from langchain_core.tools import BaseTool, ToolException
+
+from .monitoring.metrics import registry
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+from config import config
+
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_STATE = registry.gauge(
+    "astro_circuit_state", "Circuit breaker state per dependency (0 closed, 1 half-open, 2 open)", ("dependency",))
+CIRCUIT_TRANSITIONS = registry.counter(
+    "astro_circuit_transitions_total", "Circuit breaker state changes by dependency and new state",
+    ("dependency", "state"))
+CIRCUIT_REJECTED = registry.counter(
+    "astro_circuit_rejected_total", "Calls failed fast because the dependency's circuit was open", ("dependency",))
+DEPENDENCY_CALLS = registry.counter(
+    "astro_dependency_calls_total", "Guarded dependency calls by outcome (ok, slow, error)", ("dependency", "outcome"))
+
+
+class CircuitOpenError(Exception):
+    """依賴的斷路器開啟中，呼叫未執行"""
+
+    def __init__(self, dependency: str, retry_in: float):
+        super().__init__(f"{dependency} circuit open, retry in {retry_in:.1f}s")
+        self.dependency = dependency
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """以滾動時間視窗統計失敗率與慢呼叫的斷路器（執行緒安全，同步與非同步呼叫共用）"""
+
+    def __init__(self, dependency: str, window: float = 30.0, min_calls: int = 5, failure_rate: float = 0.5,
+                 slow_call_seconds: float = 5.0, open_seconds: float = 15.0, enabled: bool = True):
+        self.dependency = dependency
+        self.window = window
+        self.min_calls = max(1, min_calls)
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.enabled = enabled
+        self.state = CLOSED
+        self._calls: Deque[Tuple[float, bool, float]] = deque()
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(0, dependency=dependency)
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        print(f"🔌 斷路器 {self.dependency}: {self.state} → {state}")
+        self.state = state
+        CIRCUIT_STATE.set(_STATE_VALUES[state], dependency=self.dependency)
+        CIRCUIT_TRANSITIONS.inc(dependency=self.dependency, state=state)
+
+    def _trim(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def _admit(self) -> Tuple[bool, bool]:
+        """
+        是否放行這次呼叫，以及這次呼叫是否為探測呼叫
+        半開狀態只放行一個探測呼叫，探測結果只能由該呼叫回報或釋放
+        """
+        if not self.enabled:
+            return True, False
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+            if self.state == CLOSED:
+                return True, False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True, True
+        CIRCUIT_REJECTED.inc(dependency=self.dependency)
+        return False, False
+
+    def record(self, ok: bool, latency: float, probe: bool = False) -> None:
+        slow = ok and latency > self.slow_call_seconds
+        DEPENDENCY_CALLS.inc(dependency=self.dependency, outcome="error" if not ok else "slow" if slow else "ok")
+        if not self.enabled:
+            return
+        failed = not ok or slow
+        now = time.monotonic()
+        with self._lock:
+            if probe:
+                self._probing = False
+                if failed:
+                    self._opened_at = now
+                    self._transition(OPEN)
+                else:
+                    self._calls.clear()
+                    self._transition(CLOSED)
+                return
+            # 開啟前已放行、在半開期間才結束的呼叫只計入統計，不決定探測結果
+            self._calls.append((now, failed, latency))
+            self._trim(now)
+            failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+            if (self.state == CLOSED and len(self._calls) >= self.min_calls
+                    and failures / len(self._calls) >= self.failure_rate):
+                self._opened_at = now
+                self._transition(OPEN)
+
+    def _release_probe(self) -> None:
+        with self._lock:
+            self._probing = False
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """
+        包住一次依賴呼叫：斷路器開啟時拋出CircuitOpenError，否則記錄結果與耗時
+        呼叫被取消（CancelledError）時不計入統計
+        """
+        allowed, probe = self._admit()
+        if not allowed:
+            raise CircuitOpenError(self.dependency, self.retry_in())
+        started = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.record(False, time.monotonic() - started, probe)
+            raise
+        except BaseException:
+            if probe:
+                self._release_probe()
+            raise
+        self.record(True, time.monotonic() - started, probe)
+
+    def retry_in(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            self._trim(time.monotonic())
+            calls = list(self._calls)
+        latencies = sorted(latency for _, _, latency in calls)
+        failures = sum(1 for _, failed, _ in calls if failed)
+        return {
+            "state": self.state if self.enabled else "disabled",
+            "calls": len(calls),
+            "failure_rate": round(failures / len(calls), 3) if calls else 0.0,
+            "p95_seconds": round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else None,
+            "retry_in": round(self.retry_in(), 1),
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(dependency: str) -> CircuitBreaker:
+    """獲取（必要時建立）依賴的斷路器"""
+    with _breakers_lock:
+        breaker = _breakers.get(dependency)
+        if breaker is None:
+            breaker = _breakers[dependency] = CircuitBreaker(
+                dependency,
+                window=config.BREAKER_WINDOW_SECONDS,
+                min_calls=config.BREAKER_MIN_CALLS,
+                failure_rate=config.BREAKER_FAILURE_RATE,
+                slow_call_seconds=config.BREAKER_SLOW_CALL_SECONDS,
+                open_seconds=config.BREAKER_OPEN_SECONDS,
+                enabled=config.BREAKER_ENABLED,
+            )
+        return breaker
+
+
+def breakers_info() -> Dict[str, Dict[str, Any]]:
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {name: breaker.info() for name, breaker in sorted(breakers.items())}
+
+
+def guard_tool(tool: BaseTool, dependency: Optional[str] = None, timeout: Optional[float] = None) -> BaseTool:
+    """
+    以斷路器與逾時包裝非同步工具（MCP工具）
+    斷路器開啟或呼叫失敗時回傳錯誤訊息給模型（handle_tool_error），讓Agent改用其他工具或直接回答
+    """
+    coroutine = getattr(tool, "coroutine", None)
+    if coroutine is None:
+        return tool
+    breaker = get_breaker(dependency or f"mcp:{tool.name}")
+
+    async def guarded(*args: Any, **kwargs: Any) -> Any:
+        try:
+            with breaker.guard():
+                try:
+                    return await asyncio.wait_for(coroutine(*args, **kwargs), timeout)
+                except ToolException as e:
+                    # 服務有回應（例如參數錯誤），不計為依賴失敗
+                    tool_error = e
+            raise tool_error
+        except CircuitOpenError:
+            raise ToolException(f"{tool.name} 暫時無法使用，請改用其他工具或根據已有資料回答") from None
+        except asyncio.TimeoutError:
+            raise ToolException(f"{tool.name} 逾時（{timeout:g} 秒），請改用其他工具或根據已有資料回答") from None
+        except ToolException:
+            raise
+        except Exception as e:
+            # 連線中斷等錯誤同樣以工具結果回報，不中止整個Agent執行
+            raise ToolException(f"{tool.name} 執行失敗（{e}），請改用其他工具或根據已有資料回答") from e
+
+    tool.coroutine = guarded
+    tool.handle_tool_error = True
+    return tool
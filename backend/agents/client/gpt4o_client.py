@@ -8,6 +8,8 @@ from typing import AsyncGenerator, List, Dict, Optional
 from .fixed.fixed_openai_clients import AsyncAzureOpenAI
 from openai.types.chat import ChatCompletion, ChatCompletionChunk
 
+from ..monitoring.usage import record_llm_usage
+
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
@@ -60,7 +62,8 @@ class GPT4oClient:
         
         return messages
 
-    def _format_rag_context(self, rag_context: List[Dict]) -> str:
+    @staticmethod
+    def _format_rag_context(rag_context: List[Dict]) -> str:
         """
         Format RAG context into readable text.
         
@@ -86,7 +89,8 @@ class GPT4oClient:
                                         user_input: str, 
                                         rag_context: List[Dict] = None,
                                         temperature: float = 0.7,
-                                        max_tokens: int = 4096) -> AsyncGenerator[str, None]:
+                                        max_tokens: int = 4096,
+                                        raise_errors: bool = False) -> AsyncGenerator[str, None]:
         """
         Generate streaming response from GPT-4o with optional RAG context.
         
@@ -96,6 +100,7 @@ class GPT4oClient:
             rag_context (List[Dict]): Optional RAG context
             temperature (float): Generation temperature
             max_tokens (int): Maximum tokens to generate
+            raise_errors (bool): Re-raise API errors instead of yielding an error message
             
         Yields:
             str: Generated text chunks
@@ -108,14 +113,20 @@ class GPT4oClient:
                 messages=messages,
                 temperature=temperature,
                 max_tokens=max_tokens,
-                stream=True
+                stream=True,
+                stream_options={"include_usage": True}
             )
             
             async for chunk in response:
                 if chunk.choices and chunk.choices[0].delta.content:
                     yield chunk.choices[0].delta.content
+                if chunk.usage:
+                    # 最後一個chunk只帶用量（choices為空）
+                    record_llm_usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
                     
         except Exception as e:
+            if raise_errors:
+                raise
             yield f"Error generating response: {str(e)}"
 
     async def generate_response(self, 
@@ -148,6 +159,8 @@ class GPT4oClient:
                 stream=False
             )
             
+            if response.usage:
+                record_llm_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
             return response.choices[0].message.content
             
         except Exception as e:
@@ -5,19 +5,73 @@ Enhanced version based on the existing pinecone_example.py with RAG functionalit
 
 import os
 import asyncio
-from typing import List, Dict, Optional
-from concurrent.futures import ThreadPoolExecutor
+import inspect
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, List, Dict, Iterator, Optional
 import json
 
 from .fixed.fixed_openai_clients import AzureOpenAI, AsyncAzureOpenAI
 from pinecone import Pinecone
 
+from ..circuit_breaker import CircuitOpenError, get_breaker
+from ..monitoring.metrics import EMBEDDING_LATENCY, PINECONE_QUERY_LATENCY, RAG_FALLBACKS, timed
+from ..monitoring.usage import record_embedding_usage
+
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
 from config import config
 
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSION = 512  # 匹配Pinecone索引維度
+
+# 同一查詢常在短時間內嵌入多次（回應快取查找與RAG檢索），保留最近的查詢向量
+_EMBEDDING_MEMO_SIZE = 256
+
+# 最近成功的RAG結果；嵌入或Pinecone斷路器開啟（或查詢失敗）時作為備援，沒有時略過RAG
+_RAG_FALLBACK_SIZE = 256
+
+# 估算upsert請求大小：JSON中每個浮點數約20位元組
+_FLOAT_BYTES = 20
+
+
+@lru_cache(maxsize=None)
+def _timeout_kwarg(index_type: type) -> str:
+    """Name of Index.query's per-request timeout argument (``timeout`` in current SDKs, ``_request_timeout`` in older ones)."""
+    parameters = inspect.signature(index_type.query).parameters
+    return "timeout" if "timeout" in parameters else "_request_timeout"
+
+
+def estimate_vector_bytes(vector: Dict[str, Any]) -> int:
+    """Approximate serialized size of one vector in an upsert request."""
+    metadata = json.dumps(vector.get("metadata") or {}, ensure_ascii=False)
+    return len(vector["id"]) + len(vector["values"]) * _FLOAT_BYTES + len(metadata.encode("utf-8")) + 64
+
+
+def iter_upsert_batches(vectors: List[Dict[str, Any]], max_vectors: int, max_bytes: int) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Split vectors into upsert batches bounded by vector count and estimated request size.
+
+    Args:
+        vectors (List[Dict]): Vectors with id, values and metadata
+        max_vectors (int): Maximum vectors per request
+        max_bytes (int): Maximum estimated request size in bytes
+    """
+    batch, batch_bytes = [], 0
+    for vector in vectors:
+        size = estimate_vector_bytes(vector)
+        if batch and (len(batch) >= max_vectors or batch_bytes + size > max_bytes):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(vector)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
 class PineconeClient:
     """
     Enhanced Pinecone client for vector database operations and RAG functionality.
@@ -52,6 +106,24 @@ class PineconeClient:
         else:
             print("Warning: Pinecone API key not configured, RAG functionality disabled")
 
+        self._embedding_memo: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._memo_lock = threading.Lock()
+        self._recent_context: "OrderedDict[tuple, List[Dict]]" = OrderedDict()
+
+    def _memoized(self, query: str) -> Optional[List[float]]:
+        with self._memo_lock:
+            embedding = self._embedding_memo.get(query)
+            if embedding is not None:
+                self._embedding_memo.move_to_end(query)
+            return embedding
+
+    def _remember(self, query: str, embedding: List[float]) -> List[float]:
+        with self._memo_lock:
+            self._embedding_memo[query] = embedding
+            while len(self._embedding_memo) > _EMBEDDING_MEMO_SIZE:
+                self._embedding_memo.popitem(last=False)
+        return embedding
+
     def embedder(self, query: str) -> List[float]:
         """
         Generate embeddings using Azure OpenAI.
@@ -62,12 +134,18 @@ class PineconeClient:
         Returns:
             List[float]: Embedding vector
         """
-        response = self._embed_client.embeddings.create(
-            model="text-embedding-3-small",
-            input=query,
-            dimensions=512  # 匹配Pinecone索引維度
-        )
-        return response.data[0].embedding
+        memoized = self._memoized(query)
+        if memoized is not None:
+            return memoized
+        with get_breaker("embeddings").guard(), timed(EMBEDDING_LATENCY, "embed", mode="sync"):
+            response = self._embed_client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=query,
+                dimensions=EMBEDDING_DIMENSION,
+                timeout=config.EMBEDDING_TIMEOUT_SECONDS
+            )
+        record_embedding_usage(response.usage, [query])
+        return self._remember(query, response.data[0].embedding)
 
     async def async_embedder(self, query: str) -> List[float]:
         """
@@ -79,12 +157,51 @@ class PineconeClient:
         Returns:
             List[float]: Embedding vector
         """
-        response = await self._async_embed_client.embeddings.create(
-            model="text-embedding-3-small",
-            input=query,
-            dimensions=512  # 匹配Pinecone索引維度
-        )
-        return response.data[0].embedding
+        memoized = self._memoized(query)
+        if memoized is not None:
+            return memoized
+        with get_breaker("embeddings").guard(), timed(EMBEDDING_LATENCY, "embed", mode="async"):
+            response = await self._async_embed_client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=query,
+                dimensions=EMBEDDING_DIMENSION,
+                timeout=config.EMBEDDING_TIMEOUT_SECONDS
+            )
+        record_embedding_usage(response.usage, [query])
+        return self._remember(query, response.data[0].embedding)
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generate embeddings for several texts in a single request.
+
+        Args:
+            texts (List[str]): Texts to embed
+
+        Returns:
+            List[List[float]]: Embedding vectors in input order
+        """
+        with timed(EMBEDDING_LATENCY, "embed", mode="batch"):
+            response = self._embed_client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=texts,
+                dimensions=EMBEDDING_DIMENSION
+            )
+        record_embedding_usage(response.usage, texts)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    async def async_embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generate embeddings for several texts in a single request (async version).
+        Errors such as rate limits propagate to the caller.
+        """
+        with timed(EMBEDDING_LATENCY, "embed", mode="async_batch"):
+            response = await self._async_embed_client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=texts,
+                dimensions=EMBEDDING_DIMENSION
+            )
+        record_embedding_usage(response.usage, texts)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
 
     def check_existing_ids(self, index_name: str, namespace: str, ids: List[str]) -> set:
         """Check if vector IDs already exist in Pinecone index."""
@@ -105,38 +222,56 @@ class PineconeClient:
             namespace (str): Pinecone namespace
             embedded_data (List[Dict]): Data to upload, each dict contains id, metadata, and value
         """
-        index = self._pc.Index(index_name, pool_threads=50)
-        
         if not embedded_data:
             return
-            
+
+        # Texts are embedded in batched requests instead of one request per record
+        texts = [data["value"] for data in embedded_data if isinstance(data.get("value"), str)]
+        embeddings = []
+        for start in range(0, len(texts), config.INGEST_EMBED_BATCH_SIZE):
+            embeddings.extend(self.embed_batch(texts[start:start + config.INGEST_EMBED_BATCH_SIZE]))
+        embeddings = iter(embeddings)
+
         vectors = []
         for data in embedded_data:
-            # Generate embedding if value is provided as string
-            if isinstance(data.get("value"), str):
-                vector = self.embedder(data["value"])
-            else:
-                vector = data.get("values", [])
-                
+            vector = next(embeddings) if isinstance(data.get("value"), str) else data.get("values", [])
             vectors.append({
                 "id": data["id"],
                 "values": vector,
                 "metadata": data["metadata"]
             })
-            
-        if vectors:
+
+        # Pinecone rejects oversized requests, so upload in size-bounded batches
+        for batch in iter_upsert_batches(vectors, config.INGEST_UPSERT_BATCH_SIZE, config.INGEST_MAX_REQUEST_BYTES):
             try:
-                index.upsert(vectors=vectors, namespace=namespace)
-                print(f"Successfully uploaded {len(vectors)} vectors to {index_name}/{namespace}")
+                self.upsert_batch(index_name, namespace, batch)
+                print(f"Successfully uploaded {len(batch)} vectors to {index_name}/{namespace}")
             except Exception as e:
                 print(f"Error uploading vectors: {str(e)}")
 
+    def upsert_batch(self, index_name: str, namespace: str, vectors: List[Dict]) -> None:
+        """
+        Upload already-embedded vectors in a single request.
+        Errors such as rate limits propagate to the caller.
+        """
+        index = self._pc.Index(index_name, pool_threads=50)
+        index.upsert(vectors=vectors, namespace=namespace)
+
+    def delete_batch(self, index_name: str, namespace: str, ids: List[str]) -> None:
+        """
+        Delete vectors by ID in a single request (at most 1000 IDs).
+        Errors such as rate limits propagate to the caller.
+        """
+        index = self._pc.Index(index_name, pool_threads=50)
+        index.delete(ids=ids, namespace=namespace)
+
     def query_vectors(self,
                      query: str,
                      index_name: str = None,
                      namespace: str = None,
                      metadata_filter: dict = None,
-                     top_k: int = None) -> List[Dict]:
+                     top_k: int = None,
+                     vector: Optional[List[float]] = None) -> List[Dict]:
         """
         Query Pinecone index for similar vectors.
 
@@ -146,6 +281,7 @@ class PineconeClient:
             namespace (str): Namespace (defaults to config value)
             metadata_filter (dict): Metadata filter conditions
             top_k (int): Number of results to return (defaults to config value)
+            vector (List[float]): Precomputed query embedding (skips embedding the query)
 
         Returns:
             List[Dict]: Search results
@@ -160,19 +296,21 @@ class PineconeClient:
 
         index = self._pc.Index(index_name, pool_threads=50)
 
-        if query:
+        if vector is None and query:
             vector = self.embedder(query)
-        else:
+        elif vector is None:
             vector = [0] * 512  # Default embedding dimension (匹配Pinecone索引)
 
-        results = index.query(
-            namespace=namespace,
-            vector=vector,
-            top_k=top_k,
-            filter=metadata_filter,
-            include_values=False,
-            include_metadata=True,
-        )
+        with get_breaker("pinecone").guard(), timed(PINECONE_QUERY_LATENCY, "pinecone", mode="sync"):
+            results = index.query(
+                namespace=namespace,
+                vector=vector,
+                top_k=top_k,
+                filter=metadata_filter,
+                include_values=False,
+                include_metadata=True,
+                **{_timeout_kwarg(type(index)): config.PINECONE_TIMEOUT_SECONDS},
+            )
 
         return results["matches"]
 
@@ -181,10 +319,14 @@ class PineconeClient:
                                  index_name: str = None,
                                  namespace: str = None,
                                  metadata_filter: dict = None,
-                                 top_k: int = None) -> List[Dict]:
+                                 top_k: int = None,
+                                 vector: Optional[List[float]] = None) -> List[Dict]:
         """
         Asynchronous version of query_vectors.
         """
+        if not self._pinecone_available:
+            return []
+
         index_name = index_name or config.PINECONE_INDEX_NAME
         namespace = namespace or config.PINECONE_NAMESPACE
         top_k = top_k or config.RAG_TOP_K
@@ -192,25 +334,24 @@ class PineconeClient:
 
         index = self._pc.Index(index_name, pool_threads=50)
 
-        if query:
+        if vector is None and query:
             vector = await self.async_embedder(query)
-        else:
+        elif vector is None:
             vector = [0] * 512  # Default embedding dimension (匹配Pinecone索引)
 
-        # Run the query in a thread pool since Pinecone client is sync
-        loop = asyncio.get_event_loop()
-        with ThreadPoolExecutor() as executor:
-            results = await loop.run_in_executor(
-                executor,
-                lambda: index.query(
-                    namespace=namespace,
-                    vector=vector,
-                    top_k=top_k,
-                    filter=metadata_filter,
-                    include_values=False,
-                    include_metadata=True,
-                )
-            )
+        # The Pinecone query is sync; run it on the default executor instead of a per-call pool
+        with get_breaker("pinecone").guard(), timed(PINECONE_QUERY_LATENCY, "pinecone", mode="async"):
+            results = await asyncio.wait_for(asyncio.to_thread(
+                index.query,
+                namespace=namespace,
+                vector=vector,
+                top_k=top_k,
+                filter=metadata_filter,
+                include_values=False,
+                include_metadata=True,
+                # 請求本身也設逾時，逾時後執行緒不會繼續佔用
+                **{_timeout_kwarg(type(index)): config.PINECONE_TIMEOUT_SECONDS},
+            ), config.PINECONE_TIMEOUT_SECONDS)
 
         return results["matches"]
 
@@ -218,7 +359,8 @@ class PineconeClient:
                           user_query: str,
                           index_name: str = None,
                           namespace: str = None,
-                          top_k: int = None) -> List[Dict]:
+                          top_k: int = None,
+                          vector: Optional[List[float]] = None) -> List[Dict]:
         """
         Search for RAG context based on user query.
 
@@ -227,6 +369,7 @@ class PineconeClient:
             index_name (str): Index name (defaults to config value)
             namespace (str): Namespace (defaults to config value)
             top_k (int): Number of results to return (defaults to config value)
+            vector (List[float]): Precomputed query embedding (skips embedding the query)
 
         Returns:
             List[Dict]: Relevant context from vector database
@@ -235,47 +378,80 @@ class PineconeClient:
             print("Warning: Pinecone not available, returning empty RAG context")
             return []
 
+        key = (user_query, index_name, namespace, top_k)
         try:
             matches = self.query_vectors(
                 query=user_query,
                 index_name=index_name,
                 namespace=namespace,
-                top_k=top_k
+                top_k=top_k,
+                vector=vector
             )
-
-            # Format results for RAG context
-            context_results = []
-            for match in matches:
-                context_results.append({
-                    "score": match.get("score", 0.0),
-                    "question": match["metadata"].get("question", ""),
-                    "answer": match["metadata"].get("answer", ""),
-                    "metadata": match["metadata"]
-                })
-
-            return context_results
-
+        except CircuitOpenError:
+            return self._fallback_context(key, "circuit_open")
         except Exception as e:
-            print(f"Error searching RAG context: {str(e)}")
-            return []
+            print(f"Error searching RAG context: {str(e) or type(e).__name__}")
+            return self._fallback_context(key, "error")
+
+        return self._remember_context(key, self._format_matches(matches))
 
     async def search_rag_context_async(self,
                                       user_query: str,
                                       index_name: str = None,
                                       namespace: str = None,
-                                      top_k: int = None) -> List[Dict]:
+                                      top_k: int = None,
+                                      vector: Optional[List[float]] = None) -> List[Dict]:
         """
-        Asynchronous version of search_rag_context.
+        Asynchronous version of search_rag_context (async embedding, Pinecone query off the event loop).
         """
         if not self._pinecone_available:
             print("Warning: Pinecone not available, returning empty RAG context")
             return []
 
-        loop = asyncio.get_event_loop()
-        with ThreadPoolExecutor() as executor:
-            result = await loop.run_in_executor(
-                executor,
-                self.search_rag_context,
-                user_query, index_name, namespace, top_k
+        key = (user_query, index_name, namespace, top_k)
+        try:
+            matches = await self.query_vectors_async(
+                query=user_query,
+                index_name=index_name,
+                namespace=namespace,
+                top_k=top_k,
+                vector=vector
             )
-        return result
+        except CircuitOpenError:
+            return self._fallback_context(key, "circuit_open")
+        except Exception as e:
+            print(f"Error searching RAG context: {str(e) or type(e).__name__}")
+            return self._fallback_context(key, "error")
+
+        return self._remember_context(key, self._format_matches(matches))
+
+    def _remember_context(self, key: tuple, results: List[Dict]) -> List[Dict]:
+        with self._memo_lock:
+            self._recent_context[key] = results
+            self._recent_context.move_to_end(key)
+            while len(self._recent_context) > _RAG_FALLBACK_SIZE:
+                self._recent_context.popitem(last=False)
+        return results
+
+    def _fallback_context(self, key: tuple, reason: str) -> List[Dict]:
+        """
+        RAG context when embeddings or Pinecone are unavailable: the last successful
+        results for the same query if still remembered, otherwise no context (skip RAG).
+        """
+        with self._memo_lock:
+            results = self._recent_context.get(key)
+        RAG_FALLBACKS.inc(reason=reason, result="stale" if results is not None else "empty")
+        return list(results) if results is not None else []
+
+    @staticmethod
+    def _format_matches(matches: List[Dict]) -> List[Dict]:
+        """Format Pinecone matches as RAG context entries."""
+        context_results = []
+        for match in matches:
+            context_results.append({
+                "score": match.get("score", 0.0),
+                "question": match["metadata"].get("question", ""),
+                "answer": match["metadata"].get("answer", ""),
+                "metadata": match["metadata"]
+            })
+        return context_results
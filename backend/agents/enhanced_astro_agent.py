@@ -6,14 +6,15 @@ Enhanced Astro Agent - 整合LangGraph ReActAgent + MCP工具 + RAG檢索
 import json
 import asyncio
 import os
-from typing import List, Dict, Any, AsyncGenerator
+import time
+from typing import List, Dict, Any, AsyncGenerator, Optional
 from pathlib import Path
 
 # LangGraph and LangChain imports
+from langgraph.errors import GraphRecursionError
 from langgraph.prebuilt import create_react_agent
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
 from langchain_openai import AzureChatOpenAI
-from langchain.callbacks.tracers import LangChainTracer 
 # MCP adapter imports
 try:
     from langchain_mcp_adapters.client import MultiServerMCPClient
@@ -24,7 +25,56 @@ except ImportError:
 # Local imports
 from .tools.rag_tool import get_rag_tools
 from .client.pinecone_client import PineconeClient
-from .tools.natal_tool import natal_figure
+from .tools.natal_tool import natal_figure, precompute_from_message
+from .tools.chart_assets import RenderWatch
+from .query_router import (
+    FAST_PATH_NOTE,
+    ROUTE_DECISIONS,
+    ROUTE_FIRST_TOKEN,
+    ROUTE_LATENCY,
+    ChatModelCompletion,
+    RouteDecision,
+    get_query_router,
+)
+from .run_budget import (
+    AGENT_RUN_ITERATIONS,
+    AGENT_RUNS,
+    BUDGET_EXHAUSTED,
+    FINAL_ANSWER_NOTE,
+    BudgetCallbackHandler,
+    BudgetExceeded,
+    RunBudget,
+    within_deadline,
+)
+from .client.gpt4o_client import initialize_gpt4o_client
+from .response_cache import (
+    RESPONSE_CACHE_EVENTS,
+    ResponseRecorder,
+    cache_version,
+    get_response_cache,
+    is_personal_query,
+)
+from .tools.transit_tool import natal_transits
+from .tools.synastry_tool import synastry
+from .tools.geocode_tool import resolve_birth_data
+from .monitoring.metrics import RAG_CONTEXT_LATENCY, timed
+from .monitoring.callbacks import MetricsCallbackHandler
+from .monitoring.usage import RequestUsage, UsageCallbackHandler, get_usage_store
+from .monitoring.tracing import get_tracing_backend
+from .monitoring.cassettes import (
+    CassetteChatModel,
+    CassetteLibrary,
+    CassetteRecorder,
+    RecordingVectorClient,
+    ReplayVectorClient,
+    build_replay_tools,
+)
+from .circuit_breaker import breakers_info, guard_tool
+from .tools import rag_tool
+
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+from config import config
 
 
 class EnhancedAstroAgent:
@@ -33,15 +83,30 @@ class EnhancedAstroAgent:
     整合LangGraph ReActAgent、MCP工具和RAG檢索功能
     """
     
-    def __init__(self):
-        """初始化Enhanced Astro Agent"""
+    def __init__(self, llm=None, pinecone_client=None, enable_mcp: bool = True, extra_tools: List = None):
+        """
+        初始化Enhanced Astro Agent
+        
+        Args:
+            llm: 自訂聊天模型（預設使用Azure OpenAI，測試與壓測時可注入假模型）
+            pinecone_client: 自訂向量庫客戶端（預設使用PineconeClient）
+            enable_mcp (bool): 是否載入MCP工具
+            extra_tools (List): 額外加入Agent的工具（例如重播的MCP工具）
+        """
         self.agent = None
-        self.llm = None
+        self.llm = llm
+        self.llm_injected = llm is not None
+        self.router = None
+        self.completion_client = None
         self.mcp_client = None
+        self.enable_mcp = enable_mcp
+        self.extra_tools = list(extra_tools or [])
+        self.cassette_mode = config.CASSETTE_MODE
+        self.stream_mode = config.AGENT_STREAM_MODE
         self.rag_tools = []
         self.system_prompt = ""
-        self.pinecone_client = PineconeClient()
-        self.tracer = LangChainTracer(project_name="test")
+        self.pinecone_client = pinecone_client or PineconeClient()
+        self.tracing = get_tracing_backend()
         # 載入系統提示
         self._load_system_prompt()
         
@@ -61,6 +126,9 @@ class EnhancedAstroAgent:
         """初始化Agent和所有工具"""
         print("🚀 正在初始化Enhanced Astro Agent...")
         
+        # 0. 錄製/重播模式
+        self._apply_cassette_mode()
+        
         # 1. 初始化LLM
         await self._initialize_llm()
         
@@ -73,10 +141,38 @@ class EnhancedAstroAgent:
         # 4. 創建ReActAgent
         await self._create_react_agent()
         
+        # 5. 系統提示或模型改變時，語意回應快取失效
+        model_name = getattr(self.llm, "deployment_name", None) or type(self.llm).__name__
+        get_response_cache().set_version(cache_version(self.system_prompt, model_name, config.KNOWLEDGE_BASE_VERSION))
+        
+        # 6. 查詢分流（錄製/重播時所有查詢都走Agent，才能對上錄製的對話）
+        self._initialize_router()
+        
         print("✅ Enhanced Astro Agent 初始化完成！")
     
+    def _apply_cassette_mode(self):
+        """依CASSETTE_MODE包裝或替換模型、向量庫與MCP工具"""
+        if self.cassette_mode == "record":
+            self.pinecone_client = RecordingVectorClient(self.pinecone_client)
+            rag_tool._rag_tool_instance.client = RecordingVectorClient(rag_tool._rag_tool_instance.client)
+            print(f"🎙️ 錄製模式：對話將寫入 {config.CASSETTE_DIR}")
+        elif self.cassette_mode == "replay":
+            library = CassetteLibrary.load(config.CASSETTE_DIR)
+            scale = config.CASSETTE_TIME_SCALE
+            self.llm = CassetteChatModel(library=library, time_scale=scale)
+            self.pinecone_client = ReplayVectorClient(library, time_scale=scale)
+            rag_tool._rag_tool_instance.client = self.pinecone_client
+            local_tools = [t.name for t in rag_tool.get_rag_tools()] + [
+                resolve_birth_data.name, natal_figure.name, natal_transits.name, synastry.name]
+            self.extra_tools.extend(build_replay_tools(library, exclude=local_tools, time_scale=scale))
+            self.enable_mcp = False
+            print(f"📼 重播模式：載入 {len(library.conversations)} 段對話 (時間倍率 {scale})")
+    
     async def _initialize_llm(self):
         """初始化語言模型"""
+        if self.llm is not None:
+            print("✅ 使用注入的LLM")
+            return
         try:
             # 使用Azure OpenAI作為LangGraph的LLM
             self.llm = AzureChatOpenAI(
@@ -84,16 +180,35 @@ class EnhancedAstroAgent:
                 api_key=os.getenv("AZURE_API_KEY"),
                 api_version="2025-01-01-preview",
                 azure_deployment="gpt-4.1",
-                temperature=0.7,
-                max_tokens=4096
+                temperature=config.AGENT_TEMPERATURE,
+                max_tokens=config.AGENT_MAX_TOKENS,
+                # 串流時也回報token用量，供每個請求的token預算使用
+                stream_usage=True
             )
             print("✅ LLM 初始化成功")
         except Exception as e:
             print(f"❌ LLM 初始化失敗: {e}")
             raise
     
+    def _initialize_router(self):
+        """初始化查詢分流器與快速路徑使用的單次完成客戶端"""
+        if not config.ROUTER_ENABLED or self.cassette_mode != "off":
+            print("⚠️ 查詢分流已停用，所有查詢由ReActAgent處理")
+            return
+        try:
+            # 注入的模型（測試與壓測）也用於快速路徑，否則使用GPT4oClient
+            self.completion_client = ChatModelCompletion(self.llm) if self.llm_injected else initialize_gpt4o_client()
+            self.router = get_query_router()
+            print(f"✅ 查詢分流已啟用: {', '.join(sorted(self.router.routes))}")
+        except Exception as e:
+            print(f"⚠️ 查詢分流初始化失敗，所有查詢由ReActAgent處理: {e}")
+            self.router = None
+    
     async def _initialize_mcp_tools(self):
         """初始化MCP工具"""
+        if not self.enable_mcp:
+            print("⚠️ MCP工具已停用，跳過MCP初始化")
+            return
         if MultiServerMCPClient is None:
             print("⚠️ MCP工具不可用，跳過MCP初始化")
             return
@@ -167,8 +282,11 @@ class EnhancedAstroAgent:
             # 載入RAG工具
             self.rag_tools = get_rag_tools()
 
-            # 添加natal chart工具
+            # 添加出生資料解析、natal chart、行運與合盤工具
+            self.rag_tools.append(resolve_birth_data)
             self.rag_tools.append(natal_figure)
+            self.rag_tools.append(natal_transits)
+            self.rag_tools.append(synastry)
 
             # 載入星圖生成工具
             # self.rag_tools.extend(chart_tools)
@@ -186,15 +304,20 @@ class EnhancedAstroAgent:
             
             # 添加RAG工具
             all_tools.extend(self.rag_tools)
+            all_tools.extend(self.extra_tools)
             
             # 添加MCP工具（如果可用）
             if self.mcp_client:
-                try:
-                    mcp_tools = await self.mcp_client.get_tools()
-                    all_tools.extend(mcp_tools)
-                    print(f"✅ 載入 {len(mcp_tools)} 個MCP工具")
-                except Exception as e:
-                    print(f"⚠️ 無法載入MCP工具: {e}")
+                for server_name in self.mcp_client.connections:
+                    try:
+                        mcp_tools = await self.mcp_client.get_tools(server_name=server_name)
+                    except Exception as e:
+                        print(f"⚠️ 無法載入MCP工具 {server_name}: {e}")
+                        continue
+                    # 同一MCP服務的工具共用斷路器：服務故障時立即回報工具不可用，不必每次等到逾時
+                    all_tools.extend(guard_tool(tool, f"mcp:{server_name}", config.MCP_TOOL_TIMEOUT_SECONDS)
+                                     for tool in mcp_tools)
+                    print(f"✅ 載入 {len(mcp_tools)} 個MCP工具（{server_name}）")
             
             # 創建ReActAgent
             if all_tools:
@@ -216,13 +339,16 @@ class EnhancedAstroAgent:
             print(f"❌ ReActAgent創建失敗: {e}")
             raise
     
-    async def astream(self, user_input: str, include_rag: bool = True) -> AsyncGenerator[str, None]:
+    async def astream(self, user_input: str, include_rag: bool = True, session_id: Optional[str] = None,
+                      user_id: Optional[str] = None) -> AsyncGenerator[str, None]:
         """
         流式處理用戶查詢
         
         Args:
             user_input (str): 用戶輸入
             include_rag (bool): 是否包含RAG檢索
+            session_id (str): 對話session，用於累計token用量
+            user_id (str): 使用者，用於累計token用量
             
         Yields:
             str: SSE格式的流式回應
@@ -231,63 +357,329 @@ class EnhancedAstroAgent:
             yield f"data: {json.dumps({'type': 'error', 'message': 'Agent未初始化'}, ensure_ascii=False)}\n\n"
             return
             
+        trace = self.tracing.start_trace("astream", {"query": user_input, "include_rag": include_rag})
+        trace_status, trace_error = "ok", None
+        started = time.perf_counter()
+        route = None
+        recorder = None
+        if self.cassette_mode == "record":
+            recorder = CassetteRecorder(config.CASSETTE_DIR, user_input)
+            recorder.activate()
+        # natal_figure在背景繪製SVG，完成時以chart_ready事件通知前端
+        render_watch = RenderWatch().activate()
+        # 本請求所有模型與嵌入呼叫的token用量，結束時以usage事件送出
+        usage = RequestUsage(user_input, session_id, user_id).activate()
+        cache = get_response_cache() if config.RESPONSE_CACHE_ENABLED else None
+        response_recorder = None
         try:
+            # 知識型問題先查語意回應快取，命中時直接重播
+            cache_embedding = None
+            if cache is not None and is_personal_query(user_input):
+                RESPONSE_CACHE_EVENTS.inc(result="bypass")
+            elif cache is not None:
+                cache_embedding = await self._cache_embedding(user_input)
+                cached = cache.lookup(cache_embedding) if cache_embedding is not None else None
+                if cached is not None:
+                    entry, similarity = cached
+                    print(f"⚡ 回應快取命中 (相似度 {similarity:.3f}): {entry.query}")
+                    yield f"data: {json.dumps({'type': 'cache_hit', 'similarity': round(similarity, 4)}, ensure_ascii=False)}\n\n"
+                    for frame in entry.frames:
+                        yield frame
+                    yield await self._finish_usage(usage, "cache")
+                    return
+                response_recorder = ResponseRecorder() if cache_embedding is not None else None
+            
+            # 訊息含出生資料時先在背景計算星盤，與RAG和模型回合並行
+            if config.CHART_PRECOMPUTE_ENABLED:
+                precomputed = precompute_from_message(user_input)
+                if precomputed:
+                    print(f"🔮 預先計算星盤: {precomputed}")
+            
+            # 查詢分流：閒聊不需要檢索，知識問題以單次模型呼叫回答
+            decision = self.router.classify(user_input) if self.router is not None else None
+            route = decision.route if decision is not None else "agent"
+            
             # 可選的RAG檢索
             rag_context = []
-            if include_rag:
-                rag_context = await self._get_rag_context(user_input)
+            if include_rag and route != "direct":
+                with trace.span("rag_context", "retrieval", top_k=5):
+                    rag_context = await self._get_rag_context(user_input)
                 if rag_context:
-                    yield f"data: {json.dumps({'type': 'rag_context', 'context': rag_context}, ensure_ascii=False)}\n\n"
+                    frame = f"data: {json.dumps({'type': 'rag_context', 'context': rag_context}, ensure_ascii=False)}\n\n"
+                    if response_recorder is not None:
+                        response_recorder.observe(frame)
+                    yield frame
             
-            # 使用ReActAgent流式處理查詢
-            message = HumanMessage(content=user_input)
+            if decision is not None:
+                if route == "rag" and len(rag_context) < config.MIN_CONTEXT_CHUNKS:
+                    # 知識庫沒有相關內容時交給Agent（可改用其他工具）
+                    decision = RouteDecision("agent", "no_context", decision.scores)
+                    route = "agent"
+                ROUTE_DECISIONS.inc(route=route, reason=decision.reason)
+                yield f"data: {json.dumps({'type': 'route', 'route': route, 'reason': decision.reason}, ensure_ascii=False)}\n\n"
             
-            async for event in self.agent.astream_events(
-                {"messages": [message]},
-                config={"callbacks": [self.tracer]},
-                version="v1",
-            ):
-                kind = event["event"]
-                if kind == "on_chat_model_stream":
-                    chunk_data = event["data"].get("chunk")
-                    if chunk_data and hasattr(chunk_data, "content"):
-                        content = chunk_data.content or ""
-                        if content:
-                            yield f"data: {json.dumps({'chunk': content}, ensure_ascii=False)}\n\n"
-                            
-                elif kind == "on_chat_model_start":
-                    # 開始新的回應
-                    if not hasattr(self, "_first_model_start_skipped"):
-                        self._first_model_start_skipped = True
-                    else:
-                        yield f"data: {json.dumps({'type': 'start_response', 'content': ''}, ensure_ascii=False)}\n\n"
-                        
-                elif kind == "on_tool_start":
-                    tool_id = event["run_id"]
-                    tool_name = event["name"]
-                    tool_args = event["data"].get("input")
-                    yield f"data: {json.dumps({'role': 'ai', 'type': 'tool_use', 'tool_id': tool_id, 'tool_name': tool_name, 'tool_args': tool_args, 'content': f'正在使用工具 {tool_name}...'}, ensure_ascii=False)}\n\n"
-                    
-                elif kind == "on_tool_end":
-                    tool_id = event["run_id"]  
-                    tool_name = event["name"]
-                    tool_result = event["data"].get("output")
-                    result_content = tool_result.content if hasattr(tool_result, 'content') else str(tool_result)
-                    yield f"data: {json.dumps({'role': 'ai', 'type': 'tool_result', 'tool_name': tool_name, 'tool_id': tool_id, 'tool_result': result_content}, ensure_ascii=False)}\n\n"
+            first_token = True
+            if route != "agent":
+                try:
+                    with trace.span("completion", "llm", route=route):
+                        async for frame in self._stream_completion(user_input, rag_context):
+                            if first_token:
+                                ROUTE_FIRST_TOKEN.observe(time.perf_counter() - started, route=route)
+                                first_token = False
+                            if response_recorder is not None:
+                                response_recorder.observe(frame)
+                            yield frame
+                except Exception as e:
+                    if not first_token:
+                        raise
+                    # 尚未輸出任何內容時改由Agent回答
+                    print(f"⚠️ 快速路徑失敗，改由ReActAgent處理: {e}")
+                    ROUTE_DECISIONS.inc(route="agent", reason="fallback")
+                    route = "agent"
+            
+            if route == "agent":
+                callbacks = [*trace.callbacks, *(recorder.callbacks if recorder else []), MetricsCallbackHandler(),
+                             UsageCallbackHandler()]
+                async for frame in self._stream_agent(user_input, rag_context, callbacks):
+                    if first_token and frame.startswith('data: {"chunk"'):
+                        ROUTE_FIRST_TOKEN.observe(time.perf_counter() - started, route=route)
+                        first_token = False
+                    if response_recorder is not None:
+                        response_recorder.observe(frame)
+                    yield frame
+                    for chart in render_watch.ready():
+                        yield self._chart_ready_frame(chart)
+            
+            # 回答結束時仍在繪製的星盤圖片，再等待一段時間後通知
+            for chart in await render_watch.wait(config.CHART_RENDER_WAIT):
+                yield self._chart_ready_frame(chart)
+            
+            if response_recorder is not None:
+                if response_recorder.cacheable and response_recorder.has_answer:
+                    cache.store(user_input, cache_embedding, response_recorder.frames)
+                else:
+                    RESPONSE_CACHE_EVENTS.inc(result="skip")
+            
+            yield await self._finish_usage(usage, route)
                     
         except Exception as e:
+            trace_status, trace_error = "error", str(e)
             print(f"❌ 流式查詢處理失敗: {e}")
             yield f"data: {json.dumps({'type': 'error', 'message': f'處理查詢時發生錯誤：{str(e)}'}, ensure_ascii=False)}\n\n"
+        finally:
+            render_watch.close()
+            usage.close()
+            if not usage.finished:
+                # 錯誤或用戶中斷：仍記錄已消耗的用量（單筆寫入，不等待累計查詢）
+                usage.finish(route, "error" if trace_status == "error" else "incomplete")
+                self._store_usage(usage)
+            if route is not None:
+                ROUTE_LATENCY.observe(time.perf_counter() - started, route=route)
+            trace.finish(trace_status, trace_error)
+            if recorder is not None:
+                recorder.save()
+    
+    async def _stream_agent(self, user_input: str, rag_context: List[Dict], callbacks: List) -> AsyncGenerator[str, None]:
+        """
+        使用ReActAgent流式處理查詢，並套用回合、工具呼叫、token與時間預算
+        
+        預算用盡時送出budget_exhausted事件，再以已取得的工具結果產生最終回答。
+        """
+        budget = RunBudget.from_config()
+        budget_handler = BudgetCallbackHandler(budget)
+        stream = self._stream_lean if self.stream_mode == "lean" else self._stream_events_v1
+        exhausted = None
+        streamed = False
+        try:
+            async for frame in within_deadline(
+                stream(HumanMessage(content=user_input), [*callbacks, budget_handler], budget.recursion_limit),
+                budget.deadline,
+            ):
+                streamed = True
+                yield frame
+        except BudgetExceeded as e:
+            exhausted = e.budget
+        except GraphRecursionError:
+            exhausted = "iterations"
+        except Exception:
+            AGENT_RUNS.inc(outcome="error")
+            raise
+        AGENT_RUN_ITERATIONS.observe(budget.iterations)
+        
+        if exhausted is None:
+            AGENT_RUNS.inc(outcome="completed")
+            return
+        AGENT_RUNS.inc(outcome="budget_exhausted")
+        BUDGET_EXHAUSTED.inc(budget=exhausted)
+        usage = budget.usage()
+        print(f"⏱️ Agent預算用盡 ({exhausted}): {usage}")
+        yield f"data: {json.dumps({'type': 'budget_exhausted', 'budget': exhausted, 'limits': budget.limits, 'usage': usage}, ensure_ascii=False)}\n\n"
+        if streamed:
+            yield f"data: {json.dumps({'type': 'start_response', 'content': ''}, ensure_ascii=False)}\n\n"
+        async for frame in self._stream_final_answer(user_input, rag_context, budget_handler.observations_text()):
+            yield frame
+    
+    async def _stream_final_answer(self, user_input: str, rag_context: List[Dict], observations: str) -> AsyncGenerator[str, None]:
+        """預算用盡後不帶工具的單次回答（本身也有token與時間上限）"""
+        system_prompt = f"{self.system_prompt}\n\n{FINAL_ANSWER_NOTE}"
+        if observations:
+            system_prompt += f"\n\n已取得的工具結果：\n{observations}"
+        completion = ChatModelCompletion(self.llm).generate_streaming_response(
+            system_prompt=system_prompt,
+            user_input=user_input,
+            rag_context=rag_context or None,
+            temperature=config.AGENT_TEMPERATURE,
+            max_tokens=config.AGENT_FINAL_ANSWER_TOKENS,
+        )
+        try:
+            async for text in within_deadline(completion, time.monotonic() + config.AGENT_FINAL_ANSWER_SECONDS):
+                yield f"data: {json.dumps({'chunk': text}, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            print(f"⚠️ 預算用盡後的最終回答失敗: {e}")
+            yield f"data: {json.dumps({'chunk': '（這個問題超出單次處理的上限，請縮小範圍或分次詢問。）'}, ensure_ascii=False)}\n\n"
+    
+    async def _stream_completion(self, user_input: str, rag_context: List[Dict]) -> AsyncGenerator[str, None]:
+        """快速路徑：單次串流完成（rag路徑附上RAG上下文），輸出與Agent相同的chunk幀"""
+        async for text in self.completion_client.generate_streaming_response(
+            system_prompt=f"{self.system_prompt}\n\n{FAST_PATH_NOTE}",
+            user_input=user_input,
+            rag_context=rag_context or None,
+            temperature=config.AGENT_TEMPERATURE,
+            max_tokens=config.ROUTER_FAST_MAX_TOKENS,
+            raise_errors=True,
+        ):
+            yield f"data: {json.dumps({'chunk': text}, ensure_ascii=False)}\n\n"
+    
+    async def _finish_usage(self, usage: RequestUsage, route: str) -> str:
+        """結束token用量統計並寫入資料庫，回傳usage事件（含session與使用者的累計用量）"""
+        usage.finish(route)
+        payload = {"type": "usage", "request": usage.as_dict(), "session": None, "user": None}
+        if config.USAGE_STORE_ENABLED:
+            try:
+                payload.update(await asyncio.to_thread(get_usage_store().record_and_totals, usage))
+            except Exception as e:
+                print(f"⚠️ token用量寫入失敗: {e}")
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    
+    @staticmethod
+    def _store_usage(usage: RequestUsage) -> None:
+        if not config.USAGE_STORE_ENABLED:
+            return
+        try:
+            get_usage_store().record(usage)
+        except Exception as e:
+            print(f"⚠️ token用量寫入失敗: {e}")
+    
+    async def _cache_embedding(self, query: str):
+        """回應快取用的查詢向量（與RAG檢索共用嵌入結果）；失敗時略過快取"""
+        try:
+            return await self.pinecone_client.async_embedder(query)
+        except Exception as e:
+            print(f"⚠️ 回應快取嵌入失敗，略過快取: {e}")
+            return None
+    
+    @staticmethod
+    def _chart_ready_frame(chart: Dict[str, str]) -> str:
+        return f"data: {json.dumps({'type': 'chart_ready', **chart}, ensure_ascii=False)}\n\n"
+    
+    @staticmethod
+    def _run_config(callbacks: List, recursion_limit: int) -> Dict[str, Any]:
+        # 模型在同一步驟發出的多個工具呼叫是LangGraph中並行的任務，max_concurrency限制同時執行的數量
+        return {"callbacks": callbacks, "recursion_limit": recursion_limit,
+                "max_concurrency": max(1, config.AGENT_MAX_PARALLEL_TOOLS)}
+    
+    async def _stream_events_v1(self, message: HumanMessage, callbacks: List, recursion_limit: int) -> AsyncGenerator[str, None]:
+        """
+        舊版串流：訂閱astream_events v1的全部事件，只保留模型token與工具起訖
+        
+        v1會為每個步驟產生並序列化大量未使用的chain事件，僅在AGENT_STREAM_MODE=events時使用。
+        """
+        async for event in self.agent.astream_events(
+            {"messages": [message]},
+            config=self._run_config(callbacks, recursion_limit),
+            version="v1",
+        ):
+            kind = event["event"]
+            if kind == "on_chat_model_stream":
+                chunk_data = event["data"].get("chunk")
+                if chunk_data and hasattr(chunk_data, "content"):
+                    content = chunk_data.content or ""
+                    if content:
+                        yield f"data: {json.dumps({'chunk': content}, ensure_ascii=False)}\n\n"
+                        
+            elif kind == "on_chat_model_start":
+                # 開始新的回應
+                if not hasattr(self, "_first_model_start_skipped"):
+                    self._first_model_start_skipped = True
+                else:
+                    yield f"data: {json.dumps({'type': 'start_response', 'content': ''}, ensure_ascii=False)}\n\n"
+                    
+            elif kind == "on_tool_start":
+                tool_id = event["run_id"]
+                tool_name = event["name"]
+                tool_args = event["data"].get("input")
+                yield f"data: {json.dumps({'role': 'ai', 'type': 'tool_use', 'tool_id': tool_id, 'tool_name': tool_name, 'tool_args': tool_args, 'content': f'正在使用工具 {tool_name}...'}, ensure_ascii=False)}\n\n"
+                
+            elif kind == "on_tool_end":
+                tool_id = event["run_id"]  
+                tool_name = event["name"]
+                tool_result = event["data"].get("output")
+                result_content = tool_result.content if hasattr(tool_result, 'content') else str(tool_result)
+                yield f"data: {json.dumps({'role': 'ai', 'type': 'tool_result', 'tool_name': tool_name, 'tool_id': tool_id, 'tool_result': result_content}, ensure_ascii=False)}\n\n"
+
+    async def _stream_lean(self, message: HumanMessage, callbacks: List, recursion_limit: int) -> AsyncGenerator[str, None]:
+        """
+        精簡串流：只訂閱LangGraph原生的messages與updates串流模式
+        
+        messages提供模型token，updates在agent節點完成時提供工具呼叫、在tools節點完成時提供工具結果，
+        輸出的SSE事件格式與舊版相同。
+        """
+        model_step = None
+        model_calls = 0
+        
+        async for mode, payload in self.agent.astream(
+            {"messages": [message]},
+            config=self._run_config(callbacks, recursion_limit),
+            stream_mode=["messages", "updates"],
+        ):
+            if mode == "messages":
+                chunk, metadata = payload
+                if not isinstance(chunk, AIMessageChunk):
+                    continue
+                step = metadata.get("langgraph_step")
+                if step != model_step:
+                    # 開始新的回應（每個請求的第一次模型呼叫不發送）
+                    model_step = step
+                    model_calls += 1
+                    if model_calls > 1:
+                        yield f"data: {json.dumps({'type': 'start_response', 'content': ''}, ensure_ascii=False)}\n\n"
+                content = chunk.content if isinstance(chunk.content, str) else ""
+                if content:
+                    yield f"data: {json.dumps({'chunk': content}, ensure_ascii=False)}\n\n"
+                    
+            elif mode == "updates":
+                for update in payload.values():
+                    if not isinstance(update, dict):
+                        continue
+                    for msg in update.get("messages", []):
+                        if isinstance(msg, AIMessage) and msg.tool_calls:
+                            for call in msg.tool_calls:
+                                tool_name = call["name"]
+                                yield f"data: {json.dumps({'role': 'ai', 'type': 'tool_use', 'tool_id': call['id'], 'tool_name': tool_name, 'tool_args': call['args'], 'content': f'正在使用工具 {tool_name}...'}, ensure_ascii=False)}\n\n"
+                        elif isinstance(msg, ToolMessage):
+                            result_content = msg.content if isinstance(msg.content, str) else json.dumps(msg.content, ensure_ascii=False)
+                            yield f"data: {json.dumps({'role': 'ai', 'type': 'tool_result', 'tool_name': msg.name, 'tool_id': msg.tool_call_id, 'tool_result': result_content}, ensure_ascii=False)}\n\n"
     
     async def _get_rag_context(self, query: str) -> List[Dict]:
         """獲取RAG上下文"""
         try:
-            return self.pinecone_client.search_rag_context(
-                user_query=query,
-                index_name="astrology-text",
-                namespace="hierarchy_chunking_strategy",
-                top_k=5
-            )
+            with timed(RAG_CONTEXT_LATENCY, "rag"):
+                return await self.pinecone_client.search_rag_context_async(
+                    user_query=query,
+                    index_name="astrology-text",
+                    namespace="hierarchy_chunking_strategy",
+                    top_k=5
+                )
         except Exception as e:
             print(f"⚠️ RAG檢索失敗: {e}")
             return []
@@ -301,7 +693,17 @@ class EnhancedAstroAgent:
             "llm_available": self.llm is not None,
             "mcp_available": self.mcp_client is not None,
             "rag_tools_count": len(self.rag_tools),
-            "system_prompt_loaded": bool(self.system_prompt)
+            "system_prompt_loaded": bool(self.system_prompt),
+            "tracing": self.tracing.info(),
+            "cassette_mode": self.cassette_mode,
+            "stream_mode": self.stream_mode,
+            "response_cache": get_response_cache().info(),
+            "circuit_breakers": breakers_info(),
+            "router": {
+                "enabled": self.router is not None,
+                "routes": sorted(self.router.routes) if self.router is not None else ["agent"],
+                "default_route": self.router.default_route if self.router is not None else "agent",
+            }
         }
 
 
@@ -0,0 +1,296 @@
+"""
+背景工作佇列
+長時間的分析（完整星盤解讀、網路搜尋、多次工具呼叫）以工作提交：立即取得job_id，
+之後輪詢或訂閱事件，Agent執行與客戶端連線完全分離。
+固定數量的worker依優先順序（high → normal → low，同優先依提交順序）取出工作執行，
+完成的工作保留JOB_RESULT_TTL秒（最多JOB_MAX_RETAINED筆）供查詢；
+執行中只保留最近JOB_MAX_EVENTS個事件供接續，結束後只保留彙整結果
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from .monitoring.metrics import registry
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+from config import config
+
+
+JOB_PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+JOB_QUEUE_DEPTH = registry.gauge(
+    "astro_job_queue_depth", "Background jobs waiting for a worker", ("priority",))
+JOBS_RUNNING = registry.gauge(
+    "astro_jobs_running", "Background jobs currently executing")
+JOBS = registry.counter(
+    "astro_jobs_total", "Background jobs by final status (completed, failed, cancelled) or rejected", ("status",))
+JOB_WAIT = registry.histogram(
+    "astro_job_wait_seconds", "Time a background job waited in the queue", ("priority",),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+JOB_RUN = registry.histogram(
+    "astro_job_run_seconds", "Execution time of a background job",
+    buckets=(1, 2.5, 5, 10, 20, 30, 60, 90, 120, 300))
+
+
+class JobQueueFull(Exception):
+    """等待中的工作已達JOB_QUEUE_MAX"""
+
+
+class Job:
+    """一次背景Agent執行：狀態、依序編號的事件（序號從1開始）與訂閱"""
+
+    def __init__(self, query: str, priority: str, params: Dict[str, Any], max_events: int = 1000):
+        self.job_id = uuid.uuid4().hex[:16]
+        self.query = query
+        self.priority = priority
+        self.params = params
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.events: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=max(1, max_events))
+        self.last_seq = 0
+        self.result: Optional[Dict[str, Any]] = None
+        # 完整事件紀錄（相鄰的token幀合併），結束時彙整為result後清除
+        self._transcript: List[Dict[str, Any]] = []
+        self._cond = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    async def _append(self, event: Dict[str, Any]) -> None:
+        async with self._cond:
+            self.last_seq += 1
+            self.events.append((self.last_seq, event))
+            previous = self._transcript[-1] if self._transcript else None
+            if previous is not None and previous.keys() == event.keys() == {"chunk"}:
+                self._transcript[-1] = {"chunk": previous["chunk"] + event["chunk"]}
+            else:
+                self._transcript.append(event)
+            self._cond.notify_all()
+
+    async def _finish(self, status: str,
+                      summarize: Optional[Callable[[List[Dict[str, Any]]], Dict[str, Any]]] = None) -> None:
+        async with self._cond:
+            self.status = status
+            self.finished = time.time()
+            self.result = summarize(self._transcript) if summarize else None
+            self.events.clear()
+            self._transcript = []
+            self._cond.notify_all()
+
+    @property
+    def first_seq(self) -> int:
+        """仍保留的最舊事件序號（沒有保留事件時為下一個序號）"""
+        return self.events[0][0] if self.events else self.last_seq + 1
+
+    def events_after(self, after: int) -> List[Tuple[int, Dict[str, Any]]]:
+        return [(seq, event) for seq, event in self.events if seq > after]
+
+    async def subscribe(self, after: int = 0) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """
+        送出序號大於after的事件，直到工作結束
+        需要的事件已不在保留範圍內（訂閱者落後或工作已結束）時先送出replay_gap，序號為跳過的最後一個
+        """
+        cursor = max(0, after)
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: self.last_seq > cursor or self.done)
+                oldest = self.first_seq
+                gap = (oldest - 1, {"type": "replay_gap", "missed": oldest - 1 - cursor}) if cursor + 1 < oldest else None
+                pending = self.events_after(cursor)
+                cursor = self.last_seq
+                finished = self.done
+            if gap:
+                yield gap
+            for item in pending:
+                yield item
+            if finished:
+                return
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "priority": self.priority,
+            "query": self.query,
+            "error": self.error,
+            "event_count": self.last_seq,
+            "created": self.created,
+            "wait_seconds": round((self.started or self.finished or time.time()) - self.created, 3),
+            "run_seconds": round((self.finished or time.time()) - self.started, 3) if self.started else None,
+        }
+
+
+class JobQueue:
+    """有上限的優先佇列加上固定數量的Agent worker"""
+
+    def __init__(self, workers: int = 2, max_queued: int = 100, ttl: float = 3600.0, max_retained: int = 500,
+                 max_events: int = 1000):
+        self.workers = max(1, workers)
+        self.max_queued = max(1, max_queued)
+        self.ttl = ttl
+        self.max_retained = max(1, max_retained)
+        self.max_events = max(1, max_events)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._order = itertools.count()
+        self._queued = {priority: 0 for priority in JOB_PRIORITIES}
+        self._workers: List[asyncio.Task] = []
+        self._runner: Optional[Callable[..., AsyncIterator[str]]] = None
+        self._summarize: Optional[Callable[[List[Dict[str, Any]]], Dict[str, Any]]] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self, runner: Callable[..., AsyncIterator[str]],
+              summarize: Optional[Callable[[List[Dict[str, Any]]], Dict[str, Any]]] = None) -> None:
+        """
+        啟動worker；runner(query, **params)產生與/chat/stream相同的SSE幀，
+        summarize(events)在工作結束時把事件彙整為result
+        """
+        if self._workers:
+            return
+        self._runner = runner
+        self._summarize = summarize
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._worker(), name=f"job-worker-{index}")
+                         for index in range(self.workers)]
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def _depth_changed(self, priority: str, delta: int) -> None:
+        self._queued[priority] += delta
+        JOB_QUEUE_DEPTH.set(self._queued[priority], priority=priority)
+
+    def _prune(self) -> None:
+        """移除過期的已完成工作；超過保留上限時先移除最舊的已完成工作"""
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.done]
+        excess = len(self._jobs) - self.max_retained
+        for job in finished:
+            if now - job.finished > self.ttl or excess > 0:
+                del self._jobs[job.job_id]
+                excess -= 1
+
+    def submit(self, query: str, priority: str = "normal", **params: Any) -> Job:
+        if self._queue is None:
+            raise RuntimeError("工作佇列尚未啟動")
+        if priority not in JOB_PRIORITIES:
+            raise ValueError(f"priority must be one of {list(JOB_PRIORITIES)}")
+        if sum(self._queued.values()) >= self.max_queued:
+            JOBS.inc(status="rejected")
+            raise JobQueueFull(f"等待中的工作已達上限 {self.max_queued}")
+        self._prune()
+        job = Job(query, priority, params, self.max_events)
+        self._jobs[job.job_id] = job
+        self._queue.put_nowait((JOB_PRIORITIES[priority], next(self._order), job))
+        self._depth_changed(priority, 1)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._prune()
+        return self._jobs.get(job_id)
+
+    def position(self, job: Job) -> Optional[int]:
+        """等待中的工作前面還有幾個工作（不含執行中的）"""
+        if job.status != "queued":
+            return None
+        key = JOB_PRIORITIES[job.priority]
+        return sum(1 for other in self._jobs.values()
+                   if other.status == "queued" and other is not job
+                   and (JOB_PRIORITIES[other.priority], other.created) < (key, job.created))
+
+    async def cancel(self, job: Job) -> bool:
+        """取消等待中或執行中的工作；已結束的工作返回False"""
+        if job.done:
+            return False
+        if job.status == "queued":
+            self._depth_changed(job.priority, -1)
+            JOBS.inc(status="cancelled")
+            await job._finish("cancelled", self._summarize)
+        elif job._task is not None:
+            job._task.cancel()
+            # 等待Agent執行的清理完成，回傳時狀態已是cancelled
+            await asyncio.wait({job._task}, timeout=5)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job = await self._queue.get()
+            if job.status != "queued":
+                # 等待中就被取消
+                continue
+            self._depth_changed(job.priority, -1)
+            job.status = "running"
+            job.started = time.time()
+            job._task = asyncio.create_task(self._run(job))
+            # 等待工作本身；取消工作不會中止worker，停止worker時一併取消工作
+            try:
+                await asyncio.wait({job._task})
+            except asyncio.CancelledError:
+                job._task.cancel()
+                raise
+
+    async def _run(self, job: Job) -> None:
+        JOB_WAIT.observe(job.started - job.created, priority=job.priority)
+        JOBS_RUNNING.inc()
+        status = "completed"
+        events = self._runner(job.query, **job.params)
+        try:
+            async for frame in events:
+                if not frame.startswith("data: "):
+                    continue
+                try:
+                    event = json.loads(frame[6:])
+                except json.JSONDecodeError:
+                    continue
+                if event.get("type") == "error":
+                    status = "failed"
+                    job.error = event.get("message")
+                await job._append(event)
+        except asyncio.CancelledError:
+            status = "cancelled"
+        except Exception as e:
+            status, job.error = "failed", str(e)
+            print(f"❌ 背景工作 {job.job_id} 失敗: {e}")
+        finally:
+            await events.aclose()
+            JOBS_RUNNING.dec()
+            JOBS.inc(status=status)
+            JOB_RUN.observe(time.time() - job.started)
+            await job._finish(status, self._summarize)
+
+    def info(self) -> Dict[str, Any]:
+        running = sum(1 for job in self._jobs.values() if job.status == "running")
+        return {"workers": self.workers if self._workers else 0, "running": running,
+                "queued": dict(self._queued), "max_queued": self.max_queued,
+                "retained": len(self._jobs), "ttl": self.ttl, "max_events": self.max_events}
+
+
+_job_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """獲取全局背景工作佇列"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue(config.JOB_WORKERS, config.JOB_QUEUE_MAX, config.JOB_RESULT_TTL,
+                              config.JOB_MAX_RETAINED, config.JOB_MAX_EVENTS)
+    return _job_queue
@@ -0,0 +1,97 @@
+"""
+LangChain callback handler that feeds model and tool timings into the metrics registry.
+"""
+
+import time
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .metrics import (
+    LLM_GENERATION_LATENCY,
+    LLM_TIME_TO_FIRST_TOKEN,
+    TOOL_DURATION,
+    TOOL_ERRORS,
+    TOOLS_IN_FLIGHT,
+    record_stage,
+)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Per-request handler recording LLM time-to-first-token, generation time and tool durations.
+
+    Create one instance per request so the first-token bookkeeping stays request-local.
+    """
+
+    # Handlers only touch in-memory counters, so run them inline instead of on a worker thread
+    run_inline = True
+
+    def __init__(self):
+        self._model_started: Dict[UUID, float] = {}
+        self._first_token_seen: set = set()
+        self._tool_started: Dict[UUID, tuple] = {}
+        self._ttft_recorded = False
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *,
+                            run_id: UUID, **kwargs: Any) -> None:
+        self._model_started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *,
+                     run_id: UUID, **kwargs: Any) -> None:
+        self._model_started[run_id] = time.perf_counter()
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        if run_id in self._first_token_seen:
+            return
+        started = self._model_started.get(run_id)
+        if started is None:
+            return
+        self._first_token_seen.add(run_id)
+        elapsed = time.perf_counter() - started
+        LLM_TIME_TO_FIRST_TOKEN.observe(elapsed)
+        if not self._ttft_recorded:
+            # Server-Timing 只記錄第一次模型呼叫的首字延遲
+            record_stage("ttft", elapsed)
+            self._ttft_recorded = True
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish_model(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish_model(run_id)
+
+    def _finish_model(self, run_id: UUID) -> None:
+        started = self._model_started.pop(run_id, None)
+        self._first_token_seen.discard(run_id)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        LLM_GENERATION_LATENCY.observe(elapsed)
+        record_stage("llm", elapsed)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *,
+                      run_id: UUID, **kwargs: Any) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name") or "unknown"
+        self._tool_started[run_id] = (name, time.perf_counter())
+        TOOLS_IN_FLIGHT.inc()
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish_tool(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        name = self._finish_tool(run_id)
+        if name:
+            TOOL_ERRORS.inc(tool=name)
+
+    def _finish_tool(self, run_id: UUID) -> Optional[str]:
+        entry = self._tool_started.pop(run_id, None)
+        if entry is None:
+            return None
+        TOOLS_IN_FLIGHT.dec()
+        name, started = entry
+        elapsed = time.perf_counter() - started
+        TOOL_DURATION.observe(elapsed, tool=name)
+        record_stage("tool", elapsed)
+        return name
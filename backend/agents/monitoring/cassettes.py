@@ -0,0 +1,454 @@
+"""
+Record/replay cassettes for deterministic end-to-end performance runs.
+
+In ``record`` mode every EnhancedAstroAgent.astream call writes one conversation cassette
+(LLM streams with token timing, embeddings, Pinecone matches and tool results) to
+CASSETTE_DIR. In ``replay`` mode the agent is rebuilt on top of those cassettes: the chat
+model, the vector client and MCP tools serve recorded data back with the recorded timing
+multiplied by CASSETTE_TIME_SCALE (0 disables delays), fully offline.
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    BaseCallbackHandler,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import StructuredTool
+
+
+CASSETTE_VERSION = 1
+
+_active_recorder: ContextVar[Optional["CassetteRecorder"]] = ContextVar("astro_cassette_recorder", default=None)
+
+
+def _canonical(value: Any) -> str:
+    """Stable string key for tool inputs."""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return value
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+
+
+def _jsonable(value: Any) -> Any:
+    if hasattr(value, "content"):
+        return value.content
+    try:
+        json.dumps(value, ensure_ascii=False)
+        return value
+    except (TypeError, ValueError):
+        return str(value)
+
+
+# ---------------------------------------------------------------------------
+# Recording
+# ---------------------------------------------------------------------------
+
+class CassetteRecorder(BaseCallbackHandler):
+    """Collects the interactions of one astream conversation and writes them to disk."""
+
+    run_inline = True
+
+    def __init__(self, directory: str, query: str):
+        self.directory = Path(directory)
+        self.query = query
+        self.interactions: List[Dict[str, Any]] = []
+        self._llm_runs: Dict[UUID, Dict[str, Any]] = {}
+        self._tool_runs: Dict[UUID, Dict[str, Any]] = {}
+        self._token = None
+
+    @property
+    def callbacks(self) -> List[BaseCallbackHandler]:
+        return [self]
+
+    def activate(self) -> None:
+        self._token = _active_recorder.set(self)
+
+    def record(self, kind: str, **payload: Any) -> None:
+        self.interactions.append({"kind": kind, **payload})
+
+    # LLM callbacks
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *,
+                            run_id: UUID, **kwargs: Any) -> None:
+        self._llm_runs[run_id] = {"start": time.perf_counter(), "tokens": []}
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._llm_runs.get(run_id)
+        if run is not None and token:
+            run["tokens"].append([round(time.perf_counter() - run["start"], 4), token])
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._llm_runs.pop(run_id, None)
+        if run is None:
+            return
+        message = response.generations[0][0].message if response.generations and response.generations[0] else None
+        tool_calls = [
+            {"name": call["name"], "args": call["args"], "id": call.get("id")}
+            for call in (getattr(message, "tool_calls", None) or [])
+        ]
+        self.record(
+            "llm",
+            step=sum(1 for item in self.interactions if item["kind"] == "llm"),
+            content=message.content if message is not None and isinstance(message.content, str) else "",
+            tool_calls=tool_calls,
+            usage=getattr(message, "usage_metadata", None),
+            tokens=run["tokens"],
+            duration=round(time.perf_counter() - run["start"], 4),
+        )
+
+    # Tool callbacks
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *,
+                      run_id: UUID, inputs: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name") or "unknown"
+        self._tool_runs[run_id] = {"name": name, "input": inputs if inputs is not None else input_str,
+                                   "description": (serialized or {}).get("description", ""),
+                                   "start": time.perf_counter()}
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish_tool(run_id, output=_jsonable(output))
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish_tool(run_id, error=repr(error))
+
+    def _finish_tool(self, run_id: UUID, **result: Any) -> None:
+        run = self._tool_runs.pop(run_id, None)
+        if run is None:
+            return
+        self.record("tool", name=run["name"], input=run["input"], description=run["description"],
+                    duration=round(time.perf_counter() - run["start"], 4), **result)
+
+    def save(self) -> Optional[Path]:
+        """Write the conversation cassette; returns its path."""
+        if self._token is not None:
+            try:
+                _active_recorder.reset(self._token)
+            except ValueError:
+                # 產生器在其他context中被關閉時無法還原，直接清除即可
+                _active_recorder.set(None)
+            self._token = None
+        if not self.interactions:
+            return None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"conv_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.json"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": CASSETTE_VERSION,
+                "recorded_at": datetime.now().isoformat(),
+                "query": self.query,
+                "interactions": self.interactions,
+            }, f, ensure_ascii=False)
+        return path
+
+
+def _record(kind: str, **payload: Any) -> None:
+    recorder = _active_recorder.get()
+    if recorder is not None:
+        recorder.record(kind, **payload)
+
+
+class RecordingVectorClient:
+    """Proxy around PineconeClient that records embeddings and RAG matches into the active cassette."""
+
+    def __init__(self, target: Any):
+        self._target = target
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._target, name)
+
+    def embedder(self, query: str) -> List[float]:
+        start = time.perf_counter()
+        vector = self._target.embedder(query)
+        _record("embedding", input=query, vector=[round(v, 6) for v in vector],
+                duration=round(time.perf_counter() - start, 4))
+        return vector
+
+    async def async_embedder(self, query: str) -> List[float]:
+        start = time.perf_counter()
+        vector = await self._target.async_embedder(query)
+        _record("embedding", input=query, vector=[round(v, 6) for v in vector],
+                duration=round(time.perf_counter() - start, 4))
+        return vector
+
+    def search_rag_context(self, user_query: str, index_name: str = None,
+                           namespace: str = None, top_k: int = None) -> List[Dict]:
+        start = time.perf_counter()
+        try:
+            # 先經由本代理嵌入（寫入卡帶），再以向量查詢，避免目標以自己的嵌入器繞過錄製
+            vector = self.embedder(user_query) if user_query else None
+        except Exception:
+            # 嵌入失敗時交由目標處理（改用備援結果）
+            vector = None
+        matches = self._target.search_rag_context(user_query, index_name, namespace, top_k, vector=vector)
+        _record("rag_search", query=user_query, top_k=top_k, matches=_jsonable(matches),
+                duration=round(time.perf_counter() - start, 4))
+        return matches
+
+    async def search_rag_context_async(self, user_query: str, index_name: str = None,
+                                       namespace: str = None, top_k: int = None) -> List[Dict]:
+        start = time.perf_counter()
+        try:
+            vector = await self.async_embedder(user_query) if user_query else None
+        except Exception:
+            vector = None
+        matches = await self._target.search_rag_context_async(user_query, index_name, namespace, top_k,
+                                                             vector=vector)
+        _record("rag_search", query=user_query, top_k=top_k, matches=_jsonable(matches),
+                duration=round(time.perf_counter() - start, 4))
+        return matches
+
+
+# ---------------------------------------------------------------------------
+# Replay
+# ---------------------------------------------------------------------------
+
+class CassetteLibrary:
+    """Indexes a directory of conversation cassettes for replay lookups."""
+
+    def __init__(self, conversations: List[Dict[str, Any]]):
+        self.conversations = conversations
+        self.llm_by_query: Dict[str, List[Dict[str, Any]]] = {}
+        self.embeddings: Dict[str, Dict[str, Any]] = {}
+        self.rag_searches: Dict[str, Dict[str, Any]] = {}
+        self.tools: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.tools_by_name: Dict[str, Dict[str, Any]] = {}
+
+        for conversation in conversations:
+            llm_calls = []
+            for item in conversation["interactions"]:
+                kind = item["kind"]
+                if kind == "llm":
+                    llm_calls.append(item)
+                elif kind == "embedding":
+                    self.embeddings.setdefault(item["input"], item)
+                elif kind == "rag_search":
+                    self.rag_searches.setdefault(item["query"], item)
+                elif kind == "tool":
+                    self.tools.setdefault((item["name"], _canonical(item["input"])), item)
+                    self.tools_by_name.setdefault(item["name"], item)
+            self.llm_by_query.setdefault(conversation["query"], llm_calls)
+
+    @classmethod
+    def load(cls, directory: str) -> "CassetteLibrary":
+        conversations = []
+        for path in sorted(Path(directory).glob("*.json")):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == CASSETTE_VERSION:
+                conversations.append(data)
+        if not conversations:
+            raise FileNotFoundError(f"No cassettes found in {directory}")
+        return cls(conversations)
+
+    @property
+    def queries(self) -> List[str]:
+        return list(self.llm_by_query)
+
+    def llm_call(self, query: str, step: int) -> Optional[Dict[str, Any]]:
+        calls = self.llm_by_query.get(query)
+        if calls is None:
+            # 未錄製的查詢：退回第一段對話，讓壓測仍能得到真實形狀的回應
+            calls = next(iter(self.llm_by_query.values()))
+        return calls[step] if step < len(calls) else (calls[-1] if calls else None)
+
+    def tool_result(self, name: str, tool_input: Any) -> Optional[Dict[str, Any]]:
+        return self.tools.get((name, _canonical(tool_input))) or self.tools_by_name.get(name)
+
+
+def _scaled_sleep_plan(tokens: List[List[Any]], scale: float) -> Iterator[Tuple[float, str]]:
+    previous = 0.0
+    for offset, token in tokens:
+        yield max(offset - previous, 0.0) * scale, token
+        previous = offset
+
+
+class CassetteChatModel(BaseChatModel):
+    """Chat model that replays recorded LLM streams, keyed by the conversation's query and step."""
+
+    library: Any
+    time_scale: float = 1.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette-replay-chat"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "CassetteChatModel":
+        return self
+
+    def _lookup(self, messages: List[BaseMessage]) -> Dict[str, Any]:
+        step, query = 0, ""
+        for message in reversed(messages):
+            if isinstance(message, HumanMessage):
+                query = message.content if isinstance(message.content, str) else str(message.content)
+                break
+            if isinstance(message, AIMessage):
+                step += 1
+        return self.library.llm_call(query, step) or {"content": "", "tool_calls": [], "tokens": [], "duration": 0.0}
+
+    @staticmethod
+    def _tool_calls(call: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [
+            {"name": item["name"], "args": item["args"], "id": item.get("id") or f"replay_{i}", "type": "tool_call"}
+            for i, item in enumerate(call.get("tool_calls") or [])
+        ]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        call = self._lookup(messages)
+        time.sleep(call.get("duration", 0.0) * self.time_scale)
+        message = AIMessage(content=call.get("content", ""), tool_calls=self._tool_calls(call))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        call = self._lookup(messages)
+        for delay, token in _scaled_sleep_plan(call.get("tokens") or [], self.time_scale):
+            time.sleep(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        tail = self._tail(call)
+        if tail is not None:
+            time.sleep(self._tail_delay(call))
+            yield tail
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        call = self._lookup(messages)
+        for delay, token in _scaled_sleep_plan(call.get("tokens") or [], self.time_scale):
+            await asyncio.sleep(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        tail = self._tail(call)
+        if tail is not None:
+            await asyncio.sleep(self._tail_delay(call))
+            yield tail
+
+    def _tail_delay(self, call: Dict[str, Any]) -> float:
+        tokens = call.get("tokens") or []
+        last = tokens[-1][0] if tokens else 0.0
+        return max(call.get("duration", 0.0) - last, 0.0) * self.time_scale
+
+    def _tail(self, call: Dict[str, Any]) -> Optional[ChatGenerationChunk]:
+        """Final chunk carrying tool calls (or the whole content if no tokens were recorded)."""
+        tool_calls = self._tool_calls(call)
+        content = "" if call.get("tokens") else call.get("content", "")
+        if not tool_calls and not content:
+            return None
+        return ChatGenerationChunk(message=AIMessageChunk(
+            content=content,
+            tool_call_chunks=[
+                {"name": c["name"], "args": json.dumps(c["args"], ensure_ascii=False), "id": c["id"],
+                 "index": i, "type": "tool_call_chunk"}
+                for i, c in enumerate(tool_calls)
+            ],
+        ))
+
+
+class ReplayVectorClient:
+    """Serves recorded embeddings and RAG matches with recorded (scaled) latency."""
+
+    _pinecone_available = True
+
+    def __init__(self, library: CassetteLibrary, time_scale: float = 1.0, dimension: int = 512):
+        self.library = library
+        self.time_scale = time_scale
+        self.dimension = dimension
+
+    def _embedding(self, query: str) -> Tuple[List[float], float]:
+        item = self.library.embeddings.get(query)
+        if item is None:
+            return [0.0] * self.dimension, 0.0
+        return item["vector"], item.get("duration", 0.0) * self.time_scale
+
+    def embedder(self, query: str) -> List[float]:
+        vector, delay = self._embedding(query)
+        time.sleep(delay)
+        return vector
+
+    async def async_embedder(self, query: str) -> List[float]:
+        vector, delay = self._embedding(query)
+        await asyncio.sleep(delay)
+        return vector
+
+    def _search(self, user_query: str) -> Tuple[List[Dict], float]:
+        item = self.library.rag_searches.get(user_query)
+        if item is None:
+            return [], 0.0
+        return item["matches"], item.get("duration", 0.0) * self.time_scale
+
+    def search_rag_context(self, user_query: str, index_name: str = None,
+                           namespace: str = None, top_k: int = None) -> List[Dict]:
+        matches, delay = self._search(user_query)
+        time.sleep(delay)
+        return matches[:top_k] if top_k else matches
+
+    async def search_rag_context_async(self, user_query: str, index_name: str = None,
+                                       namespace: str = None, top_k: int = None) -> List[Dict]:
+        matches, delay = self._search(user_query)
+        await asyncio.sleep(delay)
+        return matches[:top_k] if top_k else matches
+
+
+def build_replay_tools(library: CassetteLibrary, exclude: List[str], time_scale: float = 1.0) -> List[StructuredTool]:
+    """
+    Create stand-in tools for recorded tools that are not local (i.e. MCP tools).
+
+    Args:
+        library (CassetteLibrary): Loaded cassettes
+        exclude (List[str]): Names of tools the agent provides itself
+        time_scale (float): Multiplier for the recorded tool duration
+
+    Returns:
+        List[StructuredTool]: Replay tools returning the recorded output
+    """
+    tools = []
+    for name, sample in library.tools_by_name.items():
+        if name in exclude:
+            continue
+
+        def make(tool_name: str):
+            async def replay(**kwargs: Any) -> Any:
+                item = library.tool_result(tool_name, kwargs) or {}
+                await asyncio.sleep(item.get("duration", 0.0) * time_scale)
+                if "error" in item:
+                    raise RuntimeError(item["error"])
+                return item.get("output", "")
+
+            def replay_sync(**kwargs: Any) -> Any:
+                item = library.tool_result(tool_name, kwargs) or {}
+                time.sleep(item.get("duration", 0.0) * time_scale)
+                if "error" in item:
+                    raise RuntimeError(item["error"])
+                return item.get("output", "")
+
+            return replay, replay_sync
+
+        replay, replay_sync = make(name)
+        sample_input = sample.get("input")
+        properties = {key: {} for key in sample_input} if isinstance(sample_input, dict) else {}
+        tools.append(StructuredTool(
+            name=name,
+            description=sample.get("description") or f"Replayed tool {name}",
+            args_schema={"type": "object", "properties": properties},
+            coroutine=replay,
+            func=replay_sync,
+        ))
+    return tools
@@ -0,0 +1,191 @@
+"""
+Event-loop stall detector.
+
+A probe coroutine measures scheduling delay continuously (how late ``asyncio.sleep`` wakes up)
+and feeds it into the metrics registry. A watchdog thread notices when the probe stops ticking;
+while the loop is blocked it captures the loop thread's stack, so the coroutine or callback
+doing blocking work (sync embeddings, sync Pinecone queries, chart rendering, ...) is attributed
+by name instead of silently degrading every concurrent stream.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .metrics import registry
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+from config import config
+
+
+LOOP_LAG = registry.histogram(
+    "astro_event_loop_lag_seconds", "Event-loop scheduling delay measured by the lag probe",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+LOOP_STALLS = registry.counter(
+    "astro_event_loop_stalls_total", "Event-loop stalls longer than the lag threshold")
+
+_BACKEND_ROOT = str(Path(__file__).resolve().parents[2])
+
+
+def _label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    filename = os.path.relpath(filename, _BACKEND_ROOT) if filename.startswith(_BACKEND_ROOT) else os.path.basename(filename)
+    return f"{code.co_qualname} ({filename}:{frame.f_lineno})"
+
+
+def _capture(frame) -> Dict[str, Any]:
+    """Summarize a blocked loop-thread stack: full stack, leaf frame and innermost project frame."""
+    stack = []
+    project_frame = None
+    while frame is not None:
+        label = _label(frame)
+        stack.append(label)
+        if project_frame is None and frame.f_code.co_filename.startswith(_BACKEND_ROOT) \
+                and frame.f_code.co_filename != __file__:
+            project_frame = label
+        frame = frame.f_back
+    stack.reverse()
+    leaf = stack[-1] if stack else "unknown"
+    return {"stack": stack, "leaf": leaf, "project_frame": project_frame or leaf}
+
+
+class LoopLagMonitor:
+    """Measures loop lag and attributes stalls to the code that blocked the loop."""
+
+    def __init__(self, interval_ms: float = 100.0, threshold_ms: float = 100.0, history: int = 600, top_n: int = 20):
+        self.interval = max(interval_ms, 1.0) / 1000.0
+        self.threshold = max(threshold_ms, 1.0) / 1000.0
+        self.top_n = top_n
+        self.recent_lags: deque = deque(maxlen=history)
+        self.recent_stalls: deque = deque(maxlen=50)
+        self.offenders: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._probe_task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._last_tick = time.monotonic()
+        self._pending_capture: Optional[Dict[str, Any]] = None
+
+    @property
+    def running(self) -> bool:
+        return self._probe_task is not None and not self._probe_task.done()
+
+    def start(self) -> None:
+        """Start the probe on the running loop and the watchdog thread."""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._last_tick = time.monotonic()
+        self._probe_task = self._loop.create_task(self._probe(), name="loop-lag-probe")
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _probe(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0.0)
+            self._last_tick = time.monotonic()
+            LOOP_LAG.observe(lag)
+            self.recent_lags.append(lag)
+            if lag >= self.threshold:
+                self._record_stall(lag)
+
+    def _watch(self) -> None:
+        """Watchdog thread: capture the loop stack while a stall is in progress."""
+        poll = min(self.threshold / 2, 0.05)
+        while not self._stop.wait(poll):
+            overdue = time.monotonic() - self._last_tick - self.interval
+            if overdue < self.threshold or self._pending_capture is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            capture = _capture(frame)
+            task = asyncio.current_task(self._loop) if self._loop is not None else None
+            capture["task"] = task.get_name() if task is not None else None
+            self._pending_capture = capture
+
+    def _record_stall(self, lag: float) -> None:
+        capture, self._pending_capture = self._pending_capture, None
+        LOOP_STALLS.inc()
+        if capture is None:
+            # 阻塞時間介於門檻與看門狗輪詢間隔之間，未能擷取堆疊
+            capture = {"stack": [], "leaf": "unknown", "project_frame": "unknown (not captured)", "task": None}
+        key = f"{capture['project_frame']} -> {capture['leaf']}"
+        now = time.time()
+        with self._lock:
+            entry = self.offenders.get(key)
+            if entry is None:
+                entry = {"offender": key, "count": 0, "total_lag_ms": 0.0, "max_lag_ms": 0.0,
+                         "task": capture.get("task"), "stack": capture["stack"]}
+                self.offenders[key] = entry
+            entry["count"] += 1
+            entry["total_lag_ms"] = round(entry["total_lag_ms"] + lag * 1000, 2)
+            entry["max_lag_ms"] = round(max(entry["max_lag_ms"], lag * 1000), 2)
+            entry["last_seen"] = now
+            self.recent_stalls.append({"offender": key, "lag_ms": round(lag * 1000, 2), "at": now,
+                                       "task": capture.get("task")})
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Lag percentiles over the recent window plus the top offenders."""
+        lags = sorted(self.recent_lags)
+
+        def pct(p: float) -> float:
+            if not lags:
+                return 0.0
+            return round(lags[min(len(lags) - 1, int(p / 100.0 * len(lags)))] * 1000, 2)
+
+        with self._lock:
+            offenders = sorted(self.offenders.values(), key=lambda e: e["total_lag_ms"], reverse=True)[:self.top_n]
+            stalls = list(self.recent_stalls)
+        return {
+            "running": self.running,
+            "interval_ms": round(self.interval * 1000, 2),
+            "threshold_ms": round(self.threshold * 1000, 2),
+            "lag_ms": {"samples": len(lags), "p50": pct(50), "p99": pct(99), "max": pct(100)},
+            "stalls_total": LOOP_STALLS.value(),
+            "top_offenders": offenders,
+            "recent_stalls": stalls[-10:],
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.offenders.clear()
+            self.recent_stalls.clear()
+        self.recent_lags.clear()
+
+
+_loop_monitor: Optional[LoopLagMonitor] = None
+
+
+def get_loop_monitor() -> LoopLagMonitor:
+    """Get (and lazily create) the global loop-lag monitor."""
+    global _loop_monitor
+    if _loop_monitor is None:
+        _loop_monitor = LoopLagMonitor(config.LOOP_MONITOR_INTERVAL_MS, config.LOOP_LAG_THRESHOLD_MS)
+    return _loop_monitor
@@ -0,0 +1,312 @@
+"""
+Lightweight in-process metrics registry with Prometheus text exposition.
+Collects per-stage latency for chat requests (embedding, Pinecone, LLM, tools, SSE)
+and renders it for the /metrics endpoint and the Server-Timing response header.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class for labelled metrics."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Cumulative histogram with fixed upper bounds."""
+
+    kind = "histogram"
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [0.0] * (len(self.buckets) + 2)
+                self._values[key] = state
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self, **labels) -> Dict[str, float]:
+        """Return count and sum for one label set."""
+        state = self._values.get(self._key(labels))
+        if state is None:
+            return {"count": 0, "sum": 0.0}
+        return {"count": state[-1], "sum": state[-2]}
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, inf)} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(state[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    """Registry that owns all metrics and renders the exposition format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self,
+                  name: str,
+                  documentation: str,
+                  labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Render all metrics in Prometheus text format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+EMBEDDING_LATENCY = registry.histogram(
+    "astro_embedding_seconds", "Latency of embedding requests", ("mode",))
+PINECONE_QUERY_LATENCY = registry.histogram(
+    "astro_pinecone_query_seconds", "Latency of Pinecone vector queries", ("mode",))
+RAG_CONTEXT_LATENCY = registry.histogram(
+    "astro_rag_context_seconds", "End-to-end RAG context retrieval latency")
+RAG_FALLBACKS = registry.counter(
+    "astro_rag_fallbacks_total",
+    "RAG searches answered without Pinecone by reason (circuit_open, error) and result (stale, empty)",
+    ("reason", "result"))
+LLM_TIME_TO_FIRST_TOKEN = registry.histogram(
+    "astro_llm_time_to_first_token_seconds", "Time from model start to first streamed token")
+LLM_GENERATION_LATENCY = registry.histogram(
+    "astro_llm_generation_seconds", "Total time of a single model call")
+TOOL_DURATION = registry.histogram(
+    "astro_tool_duration_seconds", "Duration of agent tool calls", ("tool",))
+TOOL_ERRORS = registry.counter(
+    "astro_tool_errors_total", "Agent tool calls that raised", ("tool",))
+TOOLS_IN_FLIGHT = registry.gauge(
+    "astro_tools_in_flight", "Agent tool calls currently executing")
+REQUEST_LATENCY = registry.histogram(
+    "astro_request_seconds", "Total request handling time", ("endpoint",))
+SSE_BYTES = registry.counter(
+    "astro_sse_bytes_total", "Bytes sent over SSE streams", ("endpoint",))
+SSE_FRAMES = registry.counter(
+    "astro_sse_frames_total", "SSE frames sent", ("endpoint",))
+SSE_STREAM_BYTES = registry.histogram(
+    "astro_sse_stream_bytes", "Bytes sent per SSE stream", ("endpoint",), BYTES_BUCKETS)
+ACTIVE_STREAMS = registry.gauge(
+    "astro_active_streams", "Chat streams currently open (SSE or multiplexed over WebSocket)", ("endpoint",))
+WS_CONNECTIONS = registry.gauge(
+    "astro_ws_connections", "WebSocket chat connections currently open")
+WS_MESSAGES = registry.counter(
+    "astro_ws_messages_total", "WebSocket chat messages by direction (in, out)", ("direction",))
+WS_SEND_WAIT = registry.histogram(
+    "astro_ws_send_wait_seconds", "Time a stream waited for room in its connection's send queue (backpressure)")
+WS_CONTROL_DROPPED = registry.counter(
+    "astro_ws_control_dropped_total", "WebSocket control replies (error, pong) dropped because the send queue was full")
+
+
+class ServerTiming:
+    """Per-request stage durations, rendered as a Server-Timing header."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._stages: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        return dict(self._stages)
+
+    def header(self, total: bool = True) -> str:
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self._stages.items()]
+        if total:
+            entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current_timing: ContextVar[Optional[ServerTiming]] = ContextVar("astro_server_timing", default=None)
+
+
+def start_server_timing() -> ServerTiming:
+    """Attach a fresh ServerTiming to the current context."""
+    timing = ServerTiming()
+    _current_timing.set(timing)
+    return timing
+
+
+def current_server_timing() -> Optional[ServerTiming]:
+    return _current_timing.get()
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Add a stage duration to the current request's Server-Timing, if any."""
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.add(stage, seconds)
+
+
+@contextmanager
+def timed(histogram: Histogram, stage: Optional[str] = None, **labels):
+    """
+    Time a block into a histogram and, optionally, a Server-Timing stage.
+
+    Args:
+        histogram (Histogram): Target histogram
+        stage (str): Server-Timing stage name (skipped if None)
+        **labels: Histogram labels
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, **labels)
+        if stage:
+            record_stage(stage, elapsed)
+
+
+def render_metrics() -> str:
+    """Render the global registry."""
+    return registry.render()
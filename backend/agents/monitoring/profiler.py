@@ -0,0 +1,288 @@
+"""
+Opt-in sampling profiler for single requests.
+
+A background thread samples, at a fixed interval:
+- the event-loop thread's Python stack (shows what is executing, including blocking calls)
+- the await chains of asyncio tasks spawned by the profiled request (tagged via a ContextVar)
+- worker threads currently running project code (sync tools, executors)
+
+Samples are aggregated into folded stacks (flamegraph format) and stored under PROFILE_DIR
+with a JSON summary, keyed by a profile ID returned to the client.
+"""
+
+import asyncio
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as CounterDict
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from types import FrameType
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+from config import config
+
+
+_BACKEND_ROOT = str(Path(__file__).resolve().parents[2])
+_IDLE_PREFIXES = ("EpollSelector.select", "KqueueSelector.select", "SelectSelector.select", "_ProactorReadPipeTransport")
+_profile_marker: ContextVar[Optional[str]] = ContextVar("astro_profile_id", default=None)
+# 預留的名額若在此秒數內沒有開始取樣（例如串流回應的產生器從未執行）即自動釋放
+_RESERVATION_SECONDS = 10.0
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(_BACKEND_ROOT):
+        filename = os.path.relpath(filename, _BACKEND_ROOT)
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_qualname} ({filename}:{frame.f_lineno})"
+
+
+def _thread_stack(frame: Optional[FrameType]) -> List[str]:
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _runs_project_code(frame: Optional[FrameType]) -> bool:
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_BACKEND_ROOT) and filename != __file__:
+            return True
+        frame = frame.f_back
+    return False
+
+
+def _coroutine_stack(coro: Any) -> List[str]:
+    """Follow a coroutine's await chain from the outermost to the innermost frame."""
+    stack = []
+    depth = 0
+    while coro is not None and depth < 200:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is not None:
+            stack.append(_frame_label(frame))
+        coro = (getattr(coro, "cr_await", None) or getattr(coro, "ag_await", None)
+                or getattr(coro, "gi_yieldfrom", None))
+        depth += 1
+    return stack
+
+
+class RequestProfile:
+    """Sampling profile for one request."""
+
+    def __init__(self, manager: "ProfilerManager", endpoint: str, interval: float):
+        self.profile_id = uuid.uuid4().hex[:16]
+        self.endpoint = endpoint
+        self.interval = interval
+        self.started_at = datetime.now().isoformat()
+        self.samples: CounterDict = CounterDict()
+        self.sample_count = 0
+        self._manager = manager
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._marker_token = None
+        self._start = 0.0
+        self._released = False
+        self._reservation: Optional[asyncio.TimerHandle] = None
+        self.duration = 0.0
+
+    def start(self) -> "RequestProfile":
+        """Start sampling; must be called from the request's task on the event loop."""
+        self._cancel_reservation()
+        if self._released:
+            # 預留已逾時釋放，不再取樣
+            return self
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._marker_token = _profile_marker.set(self.profile_id)
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{self.profile_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except RuntimeError:
+                # 任務集合在取樣時變動，跳過這次取樣
+                continue
+
+    def _sample(self) -> None:
+        frames = sys._current_frames()
+        self.sample_count += 1
+
+        loop_frame = frames.get(self._loop_thread_id)
+        if loop_frame is not None:
+            stack = _thread_stack(loop_frame)
+            # 事件迴圈閒置（等待selector）時不計入
+            if not stack[-1].startswith(_IDLE_PREFIXES):
+                self.samples[";".join(["loop"] + stack)] += 1
+
+        for task in list(asyncio.all_tasks(self._loop)):
+            try:
+                if task.get_context().get(_profile_marker) != self.profile_id:
+                    continue
+            except AttributeError:
+                continue
+            stack = _coroutine_stack(task.get_coro())
+            if stack:
+                self.samples[";".join([f"task:{task.get_name()}"] + stack)] += 1
+
+        own_id = threading.get_ident()
+        for thread_id, frame in frames.items():
+            if thread_id in (own_id, self._loop_thread_id):
+                continue
+            # 只保留執行專案程式碼的工作執行緒（工具、executor）
+            if _runs_project_code(frame):
+                self.samples[";".join([f"thread:{thread_id}"] + _thread_stack(frame))] += 1
+
+    def stop(self) -> str:
+        """Stop sampling, write the profile to disk and release the concurrency slot."""
+        if self._released:
+            return self.profile_id
+        if self._thread is None:
+            # 從未開始取樣（例如串流尚未開始即中斷），只釋放名額
+            self._release()
+            return self.profile_id
+        self._stop.set()
+        self._thread.join(timeout=2)
+        self._thread = None
+        self.duration = time.perf_counter() - self._start
+        if self._marker_token is not None:
+            try:
+                _profile_marker.reset(self._marker_token)
+            except ValueError:
+                _profile_marker.set(None)
+            self._marker_token = None
+        try:
+            self._manager.save(self)
+        finally:
+            self._release()
+        return self.profile_id
+
+    def _cancel_reservation(self) -> None:
+        if self._reservation is not None:
+            self._reservation.cancel()
+            self._reservation = None
+
+    def _expire_reservation(self) -> None:
+        self._reservation = None
+        if self._thread is None and not self._released:
+            print(f"⚠️ 剖析 {self.profile_id} 預留後未開始取樣，釋放名額")
+            self._release()
+
+    def _release(self) -> None:
+        self._cancel_reservation()
+        if not self._released:
+            self._released = True
+            self._manager.release()
+
+    def summary(self, top: int = 25) -> Dict[str, Any]:
+        self_time: CounterDict = CounterDict()
+        total_time: CounterDict = CounterDict()
+        for stack, count in self.samples.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            self_time[frames[-1]] += count
+            for frame in set(frames):
+                total_time[frame] += count
+        return {
+            "profile_id": self.profile_id,
+            "endpoint": self.endpoint,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2),
+            "interval_ms": round(self.interval * 1000, 2),
+            "samples": self.sample_count,
+            "top_self": [{"frame": frame, "samples": count} for frame, count in self_time.most_common(top)],
+            "top_total": [{"frame": frame, "samples": count} for frame, count in total_time.most_common(top)],
+        }
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(self.samples.items())) + "\n"
+
+
+class ProfilerManager:
+    """Gates profiling by config and caps the number of concurrently profiled requests."""
+
+    def __init__(self, directory: str, max_concurrent: int, interval_ms: float):
+        self.directory = Path(directory)
+        self.interval = max(interval_ms, 1.0) / 1000.0
+        self.max_concurrent = max(1, max_concurrent)
+        self._slots = threading.Semaphore(self.max_concurrent)
+
+    def requested(self, headers: Any, args: Any) -> bool:
+        """Whether a request asks for profiling and is allowed to."""
+        if not config.PROFILING_ENABLED:
+            return False
+        flag = headers.get("X-Profile") or args.get("profile")
+        if str(flag).lower() not in ("1", "true", "yes"):
+            return False
+        if config.PROFILING_TOKEN and not hmac.compare_digest(headers.get("X-Profile-Token", "").encode(),
+                                                              config.PROFILING_TOKEN.encode()):
+            return False
+        return True
+
+    def reserve(self, endpoint: str) -> Optional[RequestProfile]:
+        """
+        Reserve a profiling slot without starting to sample.
+
+        Returns None when all slots are busy. The caller must call ``start()`` from the task
+        that runs the request and ``stop()`` when it finishes (stop also frees the slot).
+        A reservation that is never started (e.g. a streaming body the server never iterates)
+        frees its slot after a short timeout.
+        """
+        if not self._slots.acquire(blocking=False):
+            return None
+        profile = RequestProfile(self, endpoint, self.interval)
+        profile._reservation = asyncio.get_running_loop().call_later(
+            _RESERVATION_SECONDS, profile._expire_reservation)
+        return profile
+
+    def release(self) -> None:
+        self._slots.release()
+
+    def save(self, profile: RequestProfile) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / f"{profile.profile_id}.json", "w", encoding="utf-8") as f:
+            json.dump(profile.summary(), f, ensure_ascii=False, indent=2)
+        with open(self.directory / f"{profile.profile_id}.folded", "w", encoding="utf-8") as f:
+            f.write(profile.folded())
+
+    def load(self, profile_id: str, fmt: str = "json") -> Optional[str]:
+        """Read a stored profile (``json`` summary or ``folded`` stacks)."""
+        if not profile_id.isalnum():
+            return None
+        path = self.directory / f"{profile_id}.{'folded' if fmt == 'folded' else 'json'}"
+        if not path.exists():
+            return None
+        return path.read_text(encoding="utf-8")
+
+
+_profiler_manager: Optional[ProfilerManager] = None
+
+
+def get_profiler_manager() -> ProfilerManager:
+    """Get (and lazily create) the global profiler manager."""
+    global _profiler_manager
+    if _profiler_manager is None:
+        _profiler_manager = ProfilerManager(
+            config.PROFILE_DIR,
+            config.PROFILE_MAX_CONCURRENT,
+            config.PROFILE_SAMPLE_INTERVAL_MS,
+        )
+    return _profiler_manager
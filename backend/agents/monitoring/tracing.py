@@ -0,0 +1,349 @@
+"""
+Pluggable tracing backends for agent runs.
+
+The default ``local`` backend keeps a ring buffer of recent runs with span timings
+for model calls, tool calls and retrieval, so slow requests can be inspected through
+/debug/traces without shipping anything to an external service.
+"""
+
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+from config import config
+
+
+_MAX_ATTR_CHARS = 500
+
+
+def _truncate(value: Any, limit: int = _MAX_ATTR_CHARS) -> str:
+    text = value if isinstance(value, str) else str(value)
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+class Span:
+    """A single timed operation inside a trace."""
+
+    __slots__ = ("span_id", "name", "kind", "parent_id", "start", "end", "error", "attributes")
+
+    def __init__(self, span_id: str, name: str, kind: str, parent_id: Optional[str], start: float):
+        self.span_id = span_id
+        self.name = name
+        self.kind = kind
+        self.parent_id = parent_id
+        self.start = start
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+        self.attributes: Dict[str, Any] = {}
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "span_id": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "parent_id": self.parent_id,
+            "start_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round((end - self.start) * 1000, 2),
+            "finished": self.end is not None,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class TraceStore:
+    """Thread-safe ring buffer of finished traces."""
+
+    def __init__(self, capacity: int = 200):
+        self._traces: deque = deque(maxlen=max(1, capacity))
+        self._lock = threading.Lock()
+
+    def add(self, trace: Dict[str, Any]) -> None:
+        with self._lock:
+            self._traces.append(trace)
+
+    def list(self, limit: int = 50, min_duration_ms: float = 0.0) -> List[Dict[str, Any]]:
+        """Return summaries of recent traces, newest first."""
+        with self._lock:
+            traces = list(self._traces)
+        summaries = []
+        for trace in reversed(traces):
+            if trace["duration_ms"] < min_duration_ms:
+                continue
+            summaries.append({key: value for key, value in trace.items() if key != "spans"}
+                             | {"span_count": len(trace["spans"])})
+            if len(summaries) >= limit:
+                break
+        return summaries
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            for trace in self._traces:
+                if trace["trace_id"] == trace_id:
+                    return trace
+        return None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._traces.clear()
+
+    def __len__(self) -> int:
+        return len(self._traces)
+
+
+class ActiveTrace:
+    """Handle for one traced run. The base class is a no-op used when a run is not sampled."""
+
+    trace_id: Optional[str] = None
+
+    @property
+    def callbacks(self) -> List[BaseCallbackHandler]:
+        return []
+
+    @contextmanager
+    def span(self, name: str, kind: str = "internal", **attributes):
+        yield None
+
+    def finish(self, status: str = "ok", error: Optional[str] = None) -> None:
+        pass
+
+
+NOOP_TRACE = ActiveTrace()
+
+
+class _LocalCallbackHandler(BaseCallbackHandler):
+    """Turns LangChain callbacks into spans of a LocalTrace."""
+
+    run_inline = True
+
+    def __init__(self, trace: "LocalTrace"):
+        self._trace = trace
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *,
+                            run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        params = kwargs.get("invocation_params") or {}
+        span = self._trace.open_span(str(run_id), kwargs.get("name") or "chat_model", "llm", parent_run_id)
+        span.attributes["model"] = params.get("model") or params.get("deployment_name") or params.get("model_name")
+        span.attributes["message_count"] = sum(len(batch) for batch in messages)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *,
+                     run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._trace.open_span(str(run_id), kwargs.get("name") or "llm", "llm", parent_run_id)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._trace.spans.get(str(run_id))
+        if span is not None and "first_token_ms" not in span.attributes:
+            span.attributes["first_token_ms"] = round((time.perf_counter() - span.start) * 1000, 2)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._trace.close_span(str(run_id))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._trace.close_span(str(run_id), error=repr(error))
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *,
+                      run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        span = self._trace.open_span(str(run_id), name, "tool", parent_run_id)
+        span.attributes["input"] = _truncate(input_str)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._trace.close_span(str(run_id))
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._trace.close_span(str(run_id), error=repr(error))
+
+    def on_retriever_start(self, serialized: Dict[str, Any], query: str, *,
+                           run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        span = self._trace.open_span(str(run_id), kwargs.get("name") or "retriever", "retrieval", parent_run_id)
+        span.attributes["query"] = _truncate(query)
+
+    def on_retriever_end(self, documents: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._trace.close_span(str(run_id))
+
+    def on_retriever_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._trace.close_span(str(run_id), error=repr(error))
+
+
+class LocalTrace(ActiveTrace):
+    """Collects spans for one run and hands the result to a TraceStore when finished."""
+
+    def __init__(self, store: TraceStore, name: str, metadata: Dict[str, Any], min_duration_ms: float):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.metadata = {key: _truncate(value) for key, value in metadata.items()}
+        self.started_at = datetime.now().isoformat()
+        self.origin = time.perf_counter()
+        self.spans: Dict[str, Span] = {}
+        self._store = store
+        self._min_duration_ms = min_duration_ms
+        self._handler = _LocalCallbackHandler(self)
+        self._finished = False
+
+    @property
+    def callbacks(self) -> List[BaseCallbackHandler]:
+        return [self._handler]
+
+    def open_span(self, span_id: str, name: str, kind: str, parent_id: Optional[Any] = None) -> Span:
+        parent = str(parent_id) if parent_id is not None and str(parent_id) in self.spans else None
+        span = Span(span_id, name, kind, parent, time.perf_counter())
+        self.spans[span_id] = span
+        return span
+
+    def close_span(self, span_id: str, error: Optional[str] = None) -> None:
+        span = self.spans.get(span_id)
+        if span is not None:
+            span.end = time.perf_counter()
+            span.error = error
+
+    @contextmanager
+    def span(self, name: str, kind: str = "internal", **attributes):
+        span = self.open_span(uuid.uuid4().hex, name, kind)
+        span.attributes.update(attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.end = time.perf_counter()
+
+    def finish(self, status: str = "ok", error: Optional[str] = None) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        duration_ms = (time.perf_counter() - self.origin) * 1000
+        if duration_ms < self._min_duration_ms:
+            return
+        self._store.add({
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(duration_ms, 2),
+            "status": status,
+            "error": error,
+            "metadata": self.metadata,
+            "spans": [span.to_dict(self.origin) for span in sorted(self.spans.values(), key=lambda s: s.start)],
+        })
+
+
+class _CallbackTrace(ActiveTrace):
+    """Wraps an external LangChain tracer (e.g. LangSmith) as an ActiveTrace."""
+
+    def __init__(self, handler: BaseCallbackHandler):
+        self._handler = handler
+
+    @property
+    def callbacks(self) -> List[BaseCallbackHandler]:
+        return [self._handler]
+
+
+class TracingBackend:
+    """Base backend: traces nothing."""
+
+    name = "none"
+
+    def start_trace(self, name: str, metadata: Optional[Dict[str, Any]] = None) -> ActiveTrace:
+        return NOOP_TRACE
+
+    def info(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class LocalTracingBackend(TracingBackend):
+    """In-process ring-buffer backend with head sampling and a minimum-duration filter."""
+
+    name = "local"
+
+    def __init__(self, capacity: int = 200, sample_rate: float = 1.0, min_duration_ms: float = 0.0):
+        self.store = TraceStore(capacity)
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.min_duration_ms = min_duration_ms
+
+    def start_trace(self, name: str, metadata: Optional[Dict[str, Any]] = None) -> ActiveTrace:
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return NOOP_TRACE
+        return LocalTrace(self.store, name, metadata or {}, self.min_duration_ms)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "sample_rate": self.sample_rate,
+            "min_duration_ms": self.min_duration_ms,
+            "buffered_traces": len(self.store),
+        }
+
+
+class LangSmithTracingBackend(TracingBackend):
+    """Ships runs to LangSmith through LangChainTracer (requires network access)."""
+
+    name = "langsmith"
+
+    def __init__(self, project_name: str, sample_rate: float = 1.0):
+        from langchain_core.tracers import LangChainTracer
+        self._tracer_cls = LangChainTracer
+        self.project_name = project_name
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+
+    def start_trace(self, name: str, metadata: Optional[Dict[str, Any]] = None) -> ActiveTrace:
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return NOOP_TRACE
+        return _CallbackTrace(self._tracer_cls(project_name=self.project_name))
+
+    def info(self) -> Dict[str, Any]:
+        return {"backend": self.name, "project": self.project_name, "sample_rate": self.sample_rate}
+
+
+def create_tracing_backend(backend: Optional[str] = None) -> TracingBackend:
+    """
+    Build a tracing backend from configuration.
+
+    Args:
+        backend (str): "local", "langsmith" or "none" (defaults to config.TRACING_BACKEND)
+
+    Returns:
+        TracingBackend: The configured backend
+    """
+    backend = (backend or config.TRACING_BACKEND or "none").lower()
+    if backend == "local":
+        return LocalTracingBackend(
+            capacity=config.TRACE_BUFFER_SIZE,
+            sample_rate=config.TRACE_SAMPLE_RATE,
+            min_duration_ms=config.TRACE_MIN_DURATION_MS,
+        )
+    if backend == "langsmith":
+        try:
+            return LangSmithTracingBackend(config.TRACING_PROJECT, config.TRACE_SAMPLE_RATE)
+        except ImportError as e:
+            print(f"⚠️ LangSmith追蹤不可用，改用本地追蹤: {e}")
+            return create_tracing_backend("local")
+    return TracingBackend()
+
+
+# 全局追蹤後端
+_tracing_backend: Optional[TracingBackend] = None
+
+
+def get_tracing_backend() -> TracingBackend:
+    """Get (and lazily create) the global tracing backend."""
+    global _tracing_backend
+    if _tracing_backend is None:
+        _tracing_backend = create_tracing_backend()
+    return _tracing_backend
+
+
+def set_tracing_backend(backend: TracingBackend) -> None:
+    """Replace the global tracing backend."""
+    global _tracing_backend
+    _tracing_backend = backend
@@ -0,0 +1,317 @@
+"""
+Token usage accounting for model and embedding calls.
+
+Each astream request activates a RequestUsage (tracked through a ContextVar):
+- LangChain model calls report through UsageCallbackHandler (streamed usage metadata)
+- direct OpenAI calls (GPT4oClient completions, PineconeClient embeddings) call
+  record_llm_usage / record_embedding_usage
+When a model does not report usage (e.g. the offline fakes) tokens are estimated from the
+character count and the request is flagged as estimated.
+
+Finished requests are written to a local SQLite database (USAGE_DB_PATH) and aggregated per
+request, session and user; token totals also go to the metrics registry.
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .metrics import registry
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+from config import config
+
+
+TOKENS = registry.counter(
+    "astro_tokens_total", "Tokens consumed by kind (prompt, completion, embedding) and route", ("kind", "route"))
+LLM_PROMPT_TOKENS = registry.histogram(
+    "astro_llm_prompt_tokens", "Prompt tokens per model call",
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000))
+REQUEST_TOKENS = registry.histogram(
+    "astro_request_tokens", "Total tokens (model and embedding) per request", ("route",),
+    buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000))
+
+# 查詢範圍：group_by參數 → SQL欄位
+_GROUP_COLUMNS = {"request": "request_id", "session": "session_id", "user": "user_id", "query": "query"}
+_QUERY_CHARS = 500
+
+
+def estimate_tokens(chars: int) -> int:
+    """Rough token count for text of the given length (about 3 characters per token, rounded up)."""
+    return (chars + 2) // 3
+
+
+def llm_usage(response: Any) -> Optional[Tuple[int, int]]:
+    """(prompt_tokens, completion_tokens) reported in an LLMResult, or None when absent."""
+    usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+    if usage.get("total_tokens"):
+        return int(usage.get("prompt_tokens", 0)), int(usage.get("completion_tokens", 0))
+    for generations in getattr(response, "generations", None) or []:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata and metadata.get("total_tokens"):
+                return int(metadata.get("input_tokens", 0)), int(metadata.get("output_tokens", 0))
+    return None
+
+
+_current_usage: ContextVar[Optional["RequestUsage"]] = ContextVar("astro_request_usage", default=None)
+
+
+class RequestUsage:
+    """Token totals of one request; embedding calls may report from worker threads."""
+
+    def __init__(self, query: str = "", session_id: Optional[str] = None, user_id: Optional[str] = None):
+        self.request_id = uuid.uuid4().hex[:16]
+        self.query = query[:_QUERY_CHARS]
+        self.session_id = session_id
+        self.user_id = user_id
+        self.created = time.time()
+        self.route = ""
+        self.status = "ok"
+        self.duration_ms = 0.0
+        self.model_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.largest_prompt = 0
+        self.embedding_calls = 0
+        self.embedding_tokens = 0
+        self.estimated = False
+        self.finished = False
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._token = None
+
+    def activate(self) -> "RequestUsage":
+        self._token = _current_usage.set(self)
+        return self
+
+    def close(self) -> None:
+        if self._token is None:
+            return
+        try:
+            _current_usage.reset(self._token)
+        except ValueError:
+            # 在不同的context結束（例如async generator被其他task關閉）
+            _current_usage.set(None)
+        self._token = None
+
+    def add_llm(self, prompt_tokens: int, completion_tokens: int, estimated: bool = False) -> None:
+        with self._lock:
+            self.model_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.largest_prompt = max(self.largest_prompt, prompt_tokens)
+            self.estimated = self.estimated or estimated
+
+    def add_embedding(self, tokens: int, estimated: bool = False) -> None:
+        with self._lock:
+            self.embedding_calls += 1
+            self.embedding_tokens += tokens
+            self.estimated = self.estimated or estimated
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens + self.embedding_tokens
+
+    def finish(self, route: str, status: str = "ok") -> None:
+        """Close the accounting and add the totals to the metrics (once)."""
+        if self.finished:
+            return
+        self.finished = True
+        self.route = route or "unknown"
+        self.status = status
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 1)
+        TOKENS.inc(self.prompt_tokens, kind="prompt", route=self.route)
+        TOKENS.inc(self.completion_tokens, kind="completion", route=self.route)
+        TOKENS.inc(self.embedding_tokens, kind="embedding", route=self.route)
+        REQUEST_TOKENS.observe(self.total_tokens, route=self.route)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "session_id": self.session_id,
+            "user_id": self.user_id,
+            "route": self.route,
+            "model_calls": self.model_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "embedding_tokens": self.embedding_tokens,
+            "total_tokens": self.total_tokens,
+            "largest_prompt": self.largest_prompt,
+            "estimated": self.estimated,
+            "duration_ms": self.duration_ms,
+        }
+
+
+def current_usage() -> Optional[RequestUsage]:
+    return _current_usage.get()
+
+
+def record_llm_usage(prompt_tokens: int, completion_tokens: int, estimated: bool = False) -> None:
+    """Charge one model call to the current request (model calls outside a request only update metrics)."""
+    LLM_PROMPT_TOKENS.observe(prompt_tokens)
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add_llm(prompt_tokens, completion_tokens, estimated)
+    else:
+        TOKENS.inc(prompt_tokens, kind="prompt", route="background")
+        TOKENS.inc(completion_tokens, kind="completion", route="background")
+
+
+def record_embedding_usage(reported: Any, texts: List[str]) -> None:
+    """Charge one embedding request; ``reported`` is the response's usage object (None to estimate)."""
+    tokens = getattr(reported, "total_tokens", None) or getattr(reported, "prompt_tokens", None)
+    estimated = not tokens
+    if estimated:
+        tokens = sum(estimate_tokens(len(text)) for text in texts)
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add_embedding(int(tokens), estimated)
+    else:
+        # 匯入等背景工作
+        TOKENS.inc(int(tokens), kind="embedding", route="background")
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """
+    Records the usage of every LangChain model call in the current request.
+
+    Uses the streamed usage metadata when the model reports it, otherwise estimates the prompt
+    from its character count and the completion from the number of streamed tokens.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._prompt_chars: Dict[UUID, int] = {}
+        self._streamed: Dict[UUID, int] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *,
+                            run_id: UUID, **kwargs: Any) -> None:
+        self._prompt_chars[run_id] = sum(len(str(message.content)) for batch in messages for message in batch)
+        self._streamed[run_id] = 0
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        if run_id in self._streamed:
+            self._streamed[run_id] += 1
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        prompt_chars = self._prompt_chars.pop(run_id, 0)
+        streamed = self._streamed.pop(run_id, 0)
+        reported = llm_usage(response)
+        if reported is not None:
+            record_llm_usage(*reported)
+        else:
+            record_llm_usage(estimate_tokens(prompt_chars), streamed, estimated=True)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._prompt_chars.pop(run_id, None)
+        self._streamed.pop(run_id, None)
+
+
+class UsageStore:
+    """SQLite table of finished requests with per-session, per-user and top-N aggregation."""
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS usage (
+            request_id TEXT PRIMARY KEY,
+            created REAL NOT NULL,
+            session_id TEXT,
+            user_id TEXT,
+            route TEXT,
+            status TEXT,
+            query TEXT,
+            model_calls INTEGER,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            embedding_tokens INTEGER,
+            total_tokens INTEGER,
+            largest_prompt INTEGER,
+            estimated INTEGER,
+            duration_ms REAL
+        );
+        CREATE INDEX IF NOT EXISTS usage_session ON usage (session_id);
+        CREATE INDEX IF NOT EXISTS usage_user ON usage (user_id);
+        CREATE INDEX IF NOT EXISTS usage_created ON usage (created);
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(self._SCHEMA)
+        return self._conn
+
+    def record(self, usage: RequestUsage) -> None:
+        row = usage.as_dict()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (row["request_id"], usage.created, row["session_id"], row["user_id"], row["route"], usage.status,
+                 usage.query, row["model_calls"], row["prompt_tokens"], row["completion_tokens"],
+                 row["embedding_tokens"], row["total_tokens"], row["largest_prompt"], int(row["estimated"]),
+                 row["duration_ms"]))
+            conn.commit()
+
+    def _totals(self, column: str, value: str) -> Dict[str, Any]:
+        cursor = self._connection().execute(
+            f"SELECT COUNT(*), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0), "
+            f"COALESCE(SUM(embedding_tokens), 0), COALESCE(SUM(total_tokens), 0) FROM usage WHERE {column} = ?",
+            (value,))
+        requests, prompt, completion, embedding, total = cursor.fetchone()
+        return {"requests": requests, "prompt_tokens": prompt, "completion_tokens": completion,
+                "embedding_tokens": embedding, "total_tokens": total}
+
+    def record_and_totals(self, usage: RequestUsage) -> Dict[str, Any]:
+        """Store the request and return the running totals of its session and user."""
+        self.record(usage)
+        with self._lock:
+            return {
+                "session": self._totals("session_id", usage.session_id) if usage.session_id else None,
+                "user": self._totals("user_id", usage.user_id) if usage.user_id else None,
+            }
+
+    def top(self, group_by: str = "user", since: float = 86400.0, limit: int = 20) -> List[Dict[str, Any]]:
+        """Heaviest users / sessions / queries / requests over the last ``since`` seconds."""
+        column = _GROUP_COLUMNS.get(group_by)
+        if column is None:
+            raise ValueError(f"group_by must be one of {sorted(_GROUP_COLUMNS)}")
+        with self._lock:
+            cursor = self._connection().execute(
+                f"SELECT {column}, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(embedding_tokens), "
+                f"SUM(total_tokens), MAX(largest_prompt), AVG(prompt_tokens), AVG(duration_ms) "
+                f"FROM usage WHERE created >= ? GROUP BY {column} ORDER BY SUM(total_tokens) DESC LIMIT ?",
+                (time.time() - since, limit))
+            rows = cursor.fetchall()
+        return [{
+            group_by: key, "requests": requests, "prompt_tokens": prompt, "completion_tokens": completion,
+            "embedding_tokens": embedding, "total_tokens": total, "largest_prompt": largest,
+            "avg_prompt_tokens": round(avg_prompt or 0, 1), "avg_duration_ms": round(avg_duration or 0, 1),
+        } for key, requests, prompt, completion, embedding, total, largest, avg_prompt, avg_duration in rows]
+
+
+_usage_store: Optional[UsageStore] = None
+
+
+def get_usage_store() -> UsageStore:
+    """獲取全局token用量資料庫"""
+    global _usage_store
+    if _usage_store is None:
+        _usage_store = UsageStore(config.USAGE_DB_PATH)
+    return _usage_store
@@ -0,0 +1,153 @@
+"""
+查詢分流
+在ReAct Agent之前以本地關鍵字分類器與規則決定回答路徑：
+- direct：問候、感謝、詢問助理本身等閒聊，單次模型呼叫，不檢索知識庫
+- rag：一般占星知識問題，以RAG檢索結果加上單次GPT4oClient串流回答
+- agent：需要出生資料、星盤、行運、合盤或搜尋的問題，走完整的ReAct工具迴圈
+"""
+
+import os
+import re
+import sys
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from .client.gpt4o_client import GPT4oClient
+from .monitoring.metrics import registry
+from .monitoring.usage import UsageCallbackHandler
+from .tools.geocode_tool import parse_local_datetime
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+from config import config
+
+
+ROUTES = ("direct", "rag", "agent")
+
+ROUTE_DECISIONS = registry.counter(
+    "astro_route_total",
+    "Query routing decisions by route and reason (birth_data, classifier, default, disabled, no_context, fallback)",
+    ("route", "reason"))
+ROUTE_LATENCY = registry.histogram(
+    "astro_route_seconds", "End-to-end streaming time per query route", ("route",))
+ROUTE_FIRST_TOKEN = registry.histogram(
+    "astro_route_first_token_seconds", "Time from request start to first answer token per query route", ("route",))
+
+# (路徑, 權重, 樣式)；分數最高的路徑勝出，沒有任何命中時使用ROUTER_DEFAULT_ROUTE
+_PATTERNS: List[Tuple[str, float, "re.Pattern[str]"]] = [
+    # 需要工具：個人星盤、行運、合盤、即時資訊
+    ("agent", 3.0, re.compile(r"我的|我是.{0,6}(座|出生)|出生|生日|幾點生|本命盤|星盤|命盤|排盤")),
+    ("agent", 3.0, re.compile(r"合盤|配對|合不合|速配|行運|流年|運勢|運程|今天|明天|今年|明年|這週|本週|這個月|下個月")),
+    ("agent", 3.0, re.compile(r"最新|新聞|搜尋|上網|查一下|網路上")),
+    ("agent", 3.0, re.compile(r"\b(my|born|birth|natal chart|chart|transit|synastry|horoscope|today|tomorrow|search)\b",
+                              re.IGNORECASE)),
+    # 閒聊：問候、感謝、助理本身
+    ("direct", 2.0, re.compile(r"^\s*(你好|您好|哈囉|嗨|安安|早安|午安|晚安|謝謝|感謝|多謝|再見|掰掰|拜拜|好的|了解|收到)")),
+    ("direct", 2.0, re.compile(r"^\s*(hi|hello|hey|thanks|thank you|good (morning|afternoon|evening|night)|bye|ok|okay)\b",
+                               re.IGNORECASE)),
+    ("direct", 2.0, re.compile(r"你是誰|你叫什麼|你會什麼|你能做什麼|你可以做什麼|怎麼使用|who are you|what can you do",
+                               re.IGNORECASE)),
+    # 占星知識
+    ("rag", 1.0, re.compile(r"星座|行星|宮位|[一二三四五六七八九十]+宮|第\d+宮|相位|合相|對分|三分|四分|六分|逆行|上升|下降點|天頂|天底|南北交")),
+    ("rag", 1.0, re.compile(r"太陽|月亮|水星|金星|火星|木星|土星|天王星|海王星|冥王星|凱龍")),
+    ("rag", 1.0, re.compile(r"牡羊|金牛|雙子|巨蟹|獅子|處女|天秤|天蠍|射手|摩羯|水瓶|雙魚")),
+    ("rag", 1.0, re.compile(r"\b(retrograde|aspects?|houses?|signs?|planets?|ascendant|zodiac|mercury|venus|mars|jupiter|"
+                            r"saturn|uranus|neptune|pluto|moon|sun)\b", re.IGNORECASE)),
+]
+# 提問語氣只在已命中占星詞彙時加分（「晚上吃什麼」不是知識問題）
+_QUESTION = re.compile(r"什麼|意思|代表|象徵|影響|差別|區別|如何|怎麼|為什麼|介紹|特質|個性|"
+                       r"\b(what|meaning|means?|why|how|difference)\b", re.IGNORECASE)
+
+# 單次回答時附加在系統提示後的說明（系統提示描述的工具此時不可用）
+FAST_PATH_NOTE = ("本次回答不使用任何工具：請直接以繁體中文回答，"
+                  "若問題需要使用者的出生資料或即時資訊，請說明需要提供哪些資料。")
+
+
+@dataclass
+class RouteDecision:
+    route: str
+    reason: str
+    scores: Dict[str, float] = field(default_factory=dict)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"route": self.route, "reason": self.reason, "scores": self.scores}
+
+
+class QueryRouter:
+    """以關鍵字權重分類查詢，並套用出生資料、長度與可用路徑等規則"""
+
+    def __init__(self, routes: Optional[List[str]] = None, default_route: str = "agent",
+                 direct_max_chars: int = 40):
+        enabled = [route for route in (routes or ROUTES) if route in ROUTES]
+        self.routes = set(enabled) | {"agent"}
+        self.default_route = default_route if default_route in self.routes else "agent"
+        self.direct_max_chars = direct_max_chars
+
+    @staticmethod
+    def scores(query: str) -> Dict[str, float]:
+        scores = {route: 0.0 for route in ROUTES}
+        for route, weight, pattern in _PATTERNS:
+            if pattern.search(query):
+                scores[route] += weight
+        if scores["rag"] and _QUESTION.search(query):
+            scores["rag"] += 1.0
+        return scores
+
+    def classify(self, query: str) -> RouteDecision:
+        text = query.strip()
+        try:
+            parse_local_datetime(text)
+        except ValueError:
+            pass
+        else:
+            # 訊息含出生日期：一定需要星盤工具
+            return RouteDecision("agent", "birth_data")
+
+        scores = self.scores(text)
+        if len(text) > self.direct_max_chars:
+            # 長訊息不會只是問候
+            scores["direct"] = 0.0
+        # 同分時選能力較完整的路徑（agent > rag > direct）：問候加知識問題應以知識問題回答
+        best = max(ROUTES, key=lambda route: (scores[route], ROUTES.index(route)))
+        if scores[best] == 0.0:
+            return RouteDecision(self.default_route, "default", scores)
+        if best not in self.routes:
+            return RouteDecision("agent", "disabled", scores)
+        return RouteDecision(best, "classifier", scores)
+
+
+class ChatModelCompletion:
+    """
+    以LangChain聊天模型提供與GPT4oClient相同的generate_streaming_response介面
+    注入模型（壓測的假模型）時，快速路徑也使用同一個模型
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    async def generate_streaming_response(self, system_prompt: str, user_input: str,
+                                          rag_context: List[Dict] = None, temperature: float = 0.7,
+                                          max_tokens: int = 4096, raise_errors: bool = False
+                                          ) -> AsyncGenerator[str, None]:
+        if rag_context:
+            context_text = GPT4oClient._format_rag_context(rag_context)
+            system_prompt = f"{system_prompt}\n\n相關背景資訊：\n{context_text}"
+        messages = [SystemMessage(content=system_prompt), HumanMessage(content=user_input)]
+        async for chunk in self.llm.astream(messages, config={"callbacks": [UsageCallbackHandler()]},
+                                            temperature=temperature, max_tokens=max_tokens):
+            content = chunk.content if isinstance(chunk.content, str) else ""
+            if content:
+                yield content
+
+
+_query_router: Optional[QueryRouter] = None
+
+
+def get_query_router() -> QueryRouter:
+    """獲取全局查詢分流器"""
+    global _query_router
+    if _query_router is None:
+        routes = [route.strip() for route in config.ROUTER_ROUTES.split(",") if route.strip()]
+        _query_router = QueryRouter(routes, config.ROUTER_DEFAULT_ROUTE, config.ROUTER_DIRECT_MAX_CHARS)
+    return _query_router
@@ -0,0 +1,212 @@
+"""
+語意回應快取
+只涉及占星知識（未使用個人化工具、訊息中沒有出生日期）的回答，以查詢的嵌入向量為鍵保存；
+相似度超過門檻的後續查詢直接重播保存的SSE幀，不必再跑ReAct迴圈。
+快取以系統提示與知識庫版本為版本，版本改變時整個清空
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .monitoring.metrics import registry
+from .tools.geocode_tool import parse_local_datetime
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+from config import config
+
+
+RESPONSE_CACHE_EVENTS = registry.counter(
+    "astro_response_cache_total",
+    "Semantic response cache lookups and writes by result (hit, miss, bypass, store, skip, expired, evicted)",
+    ("result",))
+RESPONSE_CACHE_ENTRIES = registry.gauge(
+    "astro_response_cache_entries", "Answers currently held in the semantic response cache")
+
+# 只用到這些工具的回答與使用者無關，可以快取
+CACHEABLE_TOOLS = {"search_astrology_knowledge", "search_astrology_knowledge_advanced"}
+# 重播時不保留的幀（星盤圖片屬於個人化回答，錯誤不應被快取）
+_TRANSIENT_TYPES = {"chart_ready", "error"}
+_REPLAY_CHUNK_CHARS = 200
+
+
+def cache_version(system_prompt: str, model: str, knowledge_base_version: str) -> str:
+    """系統提示、模型與知識庫版本的雜湊；任一改變都會讓既有快取失效"""
+    payload = json.dumps([system_prompt, model, knowledge_base_version], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def is_personal_query(query: str) -> bool:
+    """訊息中含出生日期時，回答取決於使用者，不查也不寫快取"""
+    try:
+        parse_local_datetime(query)
+    except ValueError:
+        return False
+    return True
+
+
+@dataclass
+class CachedResponse:
+    query: str
+    embedding: np.ndarray
+    frames: List[str]
+    created: float
+    hits: int = 0
+
+
+class ResponseRecorder:
+    """在串流過程中收集幀，判斷回答是否可快取"""
+
+    def __init__(self):
+        self.frames: List[str] = []
+        self.cacheable = True
+
+    def observe(self, frame: str) -> None:
+        if not frame.startswith("data: "):
+            return
+        try:
+            data = json.loads(frame[6:])
+        except json.JSONDecodeError:
+            return
+        kind = data.get("type")
+        if kind in ("error", "budget_exhausted"):
+            self.cacheable = False
+        elif kind == "tool_use" and data.get("tool_name") not in CACHEABLE_TOOLS:
+            self.cacheable = False
+        if kind in _TRANSIENT_TYPES:
+            return
+        # 連續的token幀合併，重播時幀數較少
+        if "chunk" in data and self.frames:
+            previous = json.loads(self.frames[-1][6:])
+            if "chunk" in previous and len(previous["chunk"]) + len(data["chunk"]) <= _REPLAY_CHUNK_CHARS:
+                previous["chunk"] += data["chunk"]
+                self.frames[-1] = f"data: {json.dumps(previous, ensure_ascii=False)}\n\n"
+                return
+        self.frames.append(frame)
+
+    @property
+    def has_answer(self) -> bool:
+        return any('"chunk"' in frame for frame in self.frames)
+
+
+class ResponseCache:
+    """以餘弦相似度查找的LRU回應快取（含TTL與版本失效）"""
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 86400.0, threshold: float = 0.95):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.threshold = threshold
+        self.version = ""
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._matrix: Optional[Tuple[List[str], np.ndarray]] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def _changed(self) -> None:
+        self._matrix = None
+        RESPONSE_CACHE_ENTRIES.set(len(self._entries))
+
+    def set_version(self, version: str) -> None:
+        """設定快取版本；與目前版本不同時清空"""
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    print(f"🧹 回應快取版本變更 {self.version} → {version}，清空 {len(self._entries)} 筆")
+                self._entries.clear()
+                self.version = version
+                self._changed()
+
+    def invalidate(self) -> int:
+        """清空快取，回傳清除的筆數"""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._changed()
+        return count
+
+    def _prune(self, now: float) -> None:
+        expired = [key for key, entry in self._entries.items() if now - entry.created > self.ttl]
+        for key in expired:
+            del self._entries[key]
+            RESPONSE_CACHE_EVENTS.inc(result="expired")
+        if expired:
+            self._changed()
+
+    def lookup(self, embedding: List[float]) -> Optional[Tuple[CachedResponse, float]]:
+        """找出最相似的快取回答；相似度未達門檻時回傳None"""
+        query = self._normalize(embedding)
+        with self._lock:
+            self._prune(time.time())
+            if not self._entries:
+                RESPONSE_CACHE_EVENTS.inc(result="miss")
+                return None
+            if self._matrix is None:
+                keys = list(self._entries)
+                self._matrix = (keys, np.stack([self._entries[key].embedding for key in keys]))
+            keys, matrix = self._matrix
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                RESPONSE_CACHE_EVENTS.inc(result="miss")
+                return None
+            entry = self._entries[keys[best]]
+            entry.hits += 1
+            self._entries.move_to_end(keys[best])
+        RESPONSE_CACHE_EVENTS.inc(result="hit")
+        return entry, similarity
+
+    def store(self, query: str, embedding: List[float], frames: List[str]) -> None:
+        key = hashlib.sha1(query.strip().encode("utf-8")).hexdigest()
+        with self._lock:
+            self._entries[key] = CachedResponse(query, self._normalize(embedding), list(frames), time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                RESPONSE_CACHE_EVENTS.inc(result="evicted")
+            self._changed()
+        RESPONSE_CACHE_EVENTS.inc(result="store")
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": config.RESPONSE_CACHE_ENABLED,
+                "version": self.version,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "threshold": self.threshold,
+                "hits": sum(entry.hits for entry in self._entries.values()),
+            }
+
+    def list(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """最近使用的快取項目（最新在前）"""
+        with self._lock:
+            entries = list(self._entries.values())[::-1][:limit]
+        return [{"query": entry.query, "hits": entry.hits, "frames": len(entry.frames),
+                 "age_seconds": round(time.time() - entry.created, 1)} for entry in entries]
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    """獲取全局語意回應快取"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(config.RESPONSE_CACHE_SIZE, config.RESPONSE_CACHE_TTL,
+                                        config.RESPONSE_CACHE_THRESHOLD)
+    return _response_cache
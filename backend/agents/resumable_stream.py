@@ -0,0 +1,185 @@
+"""
+可續傳的SSE串流
+Agent執行與HTTP連線分離：每個串流有stream_id（第一個stream事件告知客戶端），事件依序編號
+（SSE的id欄位）並保存在有上限的重播緩衝區。連線中斷後Agent繼續執行，客戶端帶stream_id與
+Last-Event-ID重新連線時從緩衝區接續；中斷超過寬限期仍未重新連線則取消執行，串流結束後緩衝區再保留一個寬限期
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from .monitoring.metrics import registry
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+from config import config
+
+
+RESUMABLE_STREAMS = registry.gauge(
+    "astro_resumable_streams", "Chat streams held in the replay registry (running or within the grace period)")
+STREAM_RESUMES = registry.counter(
+    "astro_stream_resumes_total",
+    "Reconnects with Last-Event-ID by result (resumed, gap, expired)", ("result",))
+STREAM_ORPHANED = registry.counter(
+    "astro_stream_orphaned_total", "Agent runs cancelled because no client reconnected within the grace period")
+STREAM_LAGGED = registry.counter(
+    "astro_stream_lagged_total", "Replay gaps sent to live subscribers that fell behind the replay buffer")
+STREAM_CANCELLED = registry.counter(
+    "astro_stream_cancelled_total", "Agent runs cancelled explicitly by the client (DELETE /chat/stream/<id>)")
+
+
+def parse_last_event_id(value: Any) -> int:
+    """Last-Event-ID的事件序號；沒有帶入或格式不符時為0（從頭重播）"""
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+class ResumableStream:
+    """一次Agent執行的事件緩衝區；可同時或先後被多個連線訂閱"""
+
+    def __init__(self, stream_id: str, max_frames: int, grace: float, on_expire):
+        self.stream_id = stream_id
+        self.grace = grace
+        self.created = time.time()
+        self.done = False
+        self._frames: Deque[Tuple[int, str]] = deque(maxlen=max(1, max_frames))
+        self._last_seq = 0
+        self._cond = asyncio.Condition()
+        self._subscribers = 0
+        self._task: Optional[asyncio.Task] = None
+        self._orphan_timer: Optional[asyncio.TimerHandle] = None
+        self._on_expire = on_expire
+
+    def start(self, events: AsyncIterator[str]) -> None:
+        self._task = asyncio.create_task(self._run(events))
+
+    async def _append(self, frame: str) -> None:
+        async with self._cond:
+            self._last_seq += 1
+            self._frames.append((self._last_seq, f"id: {self._last_seq}\n{frame}"))
+            self._cond.notify_all()
+
+    async def _run(self, events: AsyncIterator[str]) -> None:
+        try:
+            await self._append(f"data: {json.dumps({'type': 'stream', 'stream_id': self.stream_id}, ensure_ascii=False)}\n\n")
+            async for frame in events:
+                if frame.startswith("data: "):
+                    await self._append(frame)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            aclose = getattr(events, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            async with self._cond:
+                self.done = True
+                self._cond.notify_all()
+            self._cancel_orphan_timer()
+            # 結束後緩衝區保留一個寬限期，供仍在重新連線的客戶端讀取
+            asyncio.get_running_loop().call_later(self.grace, self._on_expire, self.stream_id)
+
+    def _cancel_orphan_timer(self) -> None:
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+            self._orphan_timer = None
+
+    def _cancel_if_orphaned(self) -> None:
+        self._orphan_timer = None
+        if self._subscribers == 0 and not self.done and self._task is not None:
+            print(f"🔌 串流 {self.stream_id} 在 {self.grace:g} 秒內沒有重新連線，取消執行")
+            STREAM_ORPHANED.inc()
+            self._task.cancel()
+
+    async def cancel(self) -> bool:
+        """取消執行（客戶端停止）；已結束時返回False"""
+        if self.done or self._task is None:
+            return False
+        STREAM_CANCELLED.inc()
+        self._task.cancel()
+        await asyncio.wait({self._task}, timeout=5)
+        return True
+
+    async def subscribe(self, after: int = 0) -> AsyncIterator[str]:
+        """
+        送出序號大於after的事件，直到串流結束
+        緩衝區已不含部分事件時（重新連線太晚，或連線讀取太慢被新事件擠出緩衝區）先送出replay_gap再跳到最舊的事件
+        """
+        self._subscribers += 1
+        self._cancel_orphan_timer()
+        try:
+            cursor = after
+            resuming = True
+            while True:
+                async with self._cond:
+                    await self._cond.wait_for(lambda: self._last_seq > cursor or self.done)
+                    oldest = self._frames[0][0] if self._frames else self._last_seq + 1
+                    missed = [cursor + 1, oldest - 1] if cursor + 1 < oldest else None
+                    pending = [frame for seq, frame in self._frames if seq > cursor]
+                    cursor = self._last_seq
+                    finished = self.done
+                if missed:
+                    if resuming:
+                        STREAM_RESUMES.inc(result="gap")
+                    else:
+                        STREAM_LAGGED.inc()
+                    gap = {"type": "replay_gap", "stream_id": self.stream_id, "missed": missed}
+                    yield f"data: {json.dumps(gap, ensure_ascii=False)}\n\n"
+                resuming = False
+                for frame in pending:
+                    yield frame
+                if finished:
+                    return
+        finally:
+            self._subscribers -= 1
+            if self._subscribers == 0 and not self.done:
+                # 客戶端中斷：Agent繼續執行，寬限期內沒有重新連線才取消
+                self._orphan_timer = asyncio.get_running_loop().call_later(self.grace, self._cancel_if_orphaned)
+
+    def info(self) -> Dict[str, Any]:
+        return {"stream_id": self.stream_id, "done": self.done, "events": self._last_seq,
+                "buffered": len(self._frames), "subscribers": self._subscribers,
+                "age_seconds": round(time.time() - self.created, 1)}
+
+
+class StreamRegistry:
+    """stream_id → ResumableStream"""
+
+    def __init__(self, max_frames: int = 2000, grace: float = 60.0):
+        self.max_frames = max_frames
+        self.grace = grace
+        self._streams: Dict[str, ResumableStream] = {}
+
+    def start(self, events: AsyncIterator[str]) -> ResumableStream:
+        stream = ResumableStream(uuid.uuid4().hex[:16], self.max_frames, self.grace, self._expire)
+        self._streams[stream.stream_id] = stream
+        RESUMABLE_STREAMS.set(len(self._streams))
+        stream.start(events)
+        return stream
+
+    def get(self, stream_id: str) -> Optional[ResumableStream]:
+        return self._streams.get(stream_id)
+
+    def _expire(self, stream_id: str) -> None:
+        self._streams.pop(stream_id, None)
+        RESUMABLE_STREAMS.set(len(self._streams))
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [stream.info() for stream in self._streams.values()]
+
+
+_stream_registry: Optional[StreamRegistry] = None
+
+
+def get_stream_registry() -> StreamRegistry:
+    """獲取全局可續傳串流登錄表"""
+    global _stream_registry
+    if _stream_registry is None:
+        _stream_registry = StreamRegistry(config.STREAM_REPLAY_BUFFER, config.STREAM_RESUME_GRACE_SECONDS)
+    return _stream_registry
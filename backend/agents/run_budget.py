@@ -0,0 +1,182 @@
+"""
+Agent執行預算
+每個請求限制模型回合數、工具呼叫數、總token數與執行時間。
+回合與工具的檢查在模型或工具開始前進行（回呼中拋出BudgetExceeded中止圖執行），
+執行時間另以串流逾時強制；預算用盡後由astream以已取得的工具結果產生盡力而為的最終回答
+"""
+
+import asyncio
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .monitoring.metrics import registry
+from .monitoring.usage import estimate_tokens, llm_usage
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+from config import config
+
+
+AGENT_RUNS = registry.counter(
+    "astro_agent_runs_total", "ReAct agent runs by outcome (completed, budget_exhausted, error)", ("outcome",))
+BUDGET_EXHAUSTED = registry.counter(
+    "astro_agent_budget_exhausted_total",
+    "Agent runs stopped by a budget (iterations, tool_calls, tokens, time)", ("budget",))
+AGENT_RUN_ITERATIONS = registry.histogram(
+    "astro_agent_run_iterations", "Model calls per agent run", buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15, 20))
+
+# 最終回答時每個工具結果保留的字數
+_OBSERVATION_CHARS = 2000
+
+# 預算用盡時附加在系統提示後的說明
+FINAL_ANSWER_NOTE = ("本次分析已達到處理上限，無法再使用任何工具。"
+                     "請根據下方已取得的資料，直接以繁體中文給出目前最完整的回答；"
+                     "資料不足的部分請簡短說明。")
+
+
+class BudgetExceeded(Exception):
+    """某項預算用盡；budget為iterations、tool_calls、tokens或time"""
+
+    def __init__(self, budget: str):
+        super().__init__(f"agent budget exhausted: {budget}")
+        self.budget = budget
+
+
+@dataclass
+class RunBudget:
+    max_iterations: int = 5
+    max_tool_calls: int = 8
+    max_tokens: int = 50000
+    max_seconds: float = 90.0
+    started: float = field(default_factory=time.monotonic)
+    iterations: int = 0
+    tool_calls: int = 0
+    tokens: int = 0
+
+    @classmethod
+    def from_config(cls) -> "RunBudget":
+        return cls(config.AGENT_MAX_ITERATIONS, config.AGENT_MAX_TOOL_CALLS,
+                   config.AGENT_TOKEN_BUDGET, config.AGENT_TIMEOUT_SECONDS)
+
+    @property
+    def deadline(self) -> float:
+        return self.started + self.max_seconds
+
+    @property
+    def limits(self) -> Dict[str, float]:
+        return {"iterations": self.max_iterations, "tool_calls": self.max_tool_calls,
+                "tokens": self.max_tokens, "time": self.max_seconds}
+
+    def usage(self) -> Dict[str, float]:
+        return {"iterations": self.iterations, "tool_calls": self.tool_calls, "tokens": self.tokens,
+                "time": round(time.monotonic() - self.started, 3)}
+
+    @property
+    def recursion_limit(self) -> int:
+        # 每回合是agent與tools兩個步驟；正常情況下回呼會先中止，這只是防止無窮迴圈的後備
+        return 2 * self.max_iterations + 3
+
+    def check_model_start(self) -> None:
+        """模型呼叫開始前：回合、token與時間"""
+        if self.iterations >= self.max_iterations:
+            raise BudgetExceeded("iterations")
+        if self.tokens >= self.max_tokens:
+            raise BudgetExceeded("tokens")
+        if time.monotonic() >= self.deadline:
+            raise BudgetExceeded("time")
+        self.iterations += 1
+
+    def check_tool_start(self) -> None:
+        """工具呼叫開始前：工具數與時間"""
+        if self.tool_calls >= self.max_tool_calls:
+            raise BudgetExceeded("tool_calls")
+        if time.monotonic() >= self.deadline:
+            raise BudgetExceeded("time")
+        self.tool_calls += 1
+
+
+class BudgetCallbackHandler(BaseCallbackHandler):
+    """
+    Per-request handler that charges model calls, tool calls and tokens to a RunBudget.
+
+    Raising from on_chat_model_start / on_tool_start stops the graph before the call is made;
+    completed tool results are kept for the best-effort final answer.
+    """
+
+    run_inline = True
+    raise_error = True
+
+    def __init__(self, budget: RunBudget):
+        self.budget = budget
+        self.observations: List[Tuple[str, str]] = []
+        self._prompt_chars: Dict[UUID, int] = {}
+        self._streamed: Dict[UUID, int] = {}
+        self._tool_names: Dict[UUID, str] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *,
+                            run_id: UUID, **kwargs: Any) -> None:
+        self.budget.check_model_start()
+        self._prompt_chars[run_id] = sum(len(str(message.content)) for batch in messages for message in batch)
+        self._streamed[run_id] = 0
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        if run_id in self._streamed:
+            self._streamed[run_id] += 1
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        prompt_chars = self._prompt_chars.pop(run_id, 0)
+        streamed = self._streamed.pop(run_id, 0)
+        reported = llm_usage(response)
+        if reported is None:
+            # 串流時模型未回報用量：以字數粗估提示（約每3字1個token）加上串流的token數
+            reported = (estimate_tokens(prompt_chars), streamed)
+        self.budget.tokens += sum(reported)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._prompt_chars.pop(run_id, None)
+        self._streamed.pop(run_id, None)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *,
+                      run_id: UUID, **kwargs: Any) -> None:
+        self.budget.check_tool_start()
+        self._tool_names[run_id] = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        content = output.content if hasattr(output, "content") else output
+        text = content if isinstance(content, str) else str(content)
+        self.observations.append((self._tool_names.pop(run_id, "tool"), text[:_OBSERVATION_CHARS]))
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._tool_names.pop(run_id, None)
+
+    def observations_text(self) -> str:
+        return "\n\n".join(f"[{name}]\n{text}" for name, text in self.observations)
+
+
+async def within_deadline(stream: AsyncIterator[str], deadline: float) -> AsyncIterator[str]:
+    """轉發串流；超過deadline（time.monotonic）時關閉串流並拋出BudgetExceeded("time")"""
+    iterator = stream.__aiter__()
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise BudgetExceeded("time")
+            try:
+                item = await asyncio.wait_for(iterator.__anext__(), timeout=remaining)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise BudgetExceeded("time") from None
+            yield item
+    finally:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception:
+                pass
@@ -0,0 +1,255 @@
+"""
+星盤圖片資產儲存
+SVG以內容雜湊命名寫入CHART_IMAGE_PATH，並預先產生gzip（與可選的brotli）壓縮版本，
+供quart_api以強ETag、immutable快取與條件式請求提供，不再依賴前端的public目錄；
+SVG在背景執行緒繪製，串流中以chart_ready事件通知前端圖片已就緒
+"""
+
+import asyncio
+import gzip
+import hashlib
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # 可選依賴：未安裝時只提供gzip
+    brotli = None
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+from config import config
+
+
+_FILENAME_PATTERN = re.compile(r"^[a-z_]+_([0-9a-f]{16})\.svg$")
+_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+_ATTRIBUTE = re.compile(r'="([^"]*)"')
+_LONG_DECIMAL = re.compile(r"(\d+\.\d)\d+")
+_TRAILING_ZERO = re.compile(r"(\d+\.\d*?)0+\b")
+# stroke-width等屬性會由<g>繼承，不能當成預設值省略；只去掉SVG2已不使用的version
+_VERSION_ATTRIBUTE = re.compile(r' version="1\.1"(?=[ />])')
+_EMPTY_ELEMENT = re.compile(r"\s*></(path|circle|line|rect|polygon|polyline|ellipse)>")
+
+
+def _compact_number(match: "re.Match") -> str:
+    number = match.group(1).rstrip("0").rstrip(".")
+    return number or "0"
+
+
+def _compact_attribute(match: "re.Match") -> str:
+    value = _LONG_DECIMAL.sub(lambda m: f"{float(m.group(0)):.1f}", match.group(1))
+    value = _TRAILING_ZERO.sub(_compact_number, value)
+    return f'="{value}"'
+
+
+def minify_svg(svg: str) -> str:
+    """
+    縮減natal產生的SVG：屬性中的座標取到小數一位（600px圖上誤差 <0.05px）、
+    去掉多餘的0並把空元素寫成自閉合標籤
+    """
+    svg = re.sub(r"<!--.*?-->", "", svg, flags=re.DOTALL)
+    svg = _ATTRIBUTE.sub(_compact_attribute, svg)
+    svg = _VERSION_ATTRIBUTE.sub("", svg)
+    svg = _EMPTY_ELEMENT.sub("/>", svg)
+    svg = svg.replace(" />", "/>")
+    return re.sub(r">\s+<", "><", svg).strip()
+
+
+def _accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    """解析Accept-Encoding為 {encoding: q}"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        fields = [field.strip() for field in part.split(";")]
+        if not fields[0]:
+            continue
+        q = 1.0
+        for field in fields[1:]:
+            if field.startswith("q="):
+                try:
+                    q = float(field[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[fields[0].lower()] = q
+    return accepted
+
+
+class ChartAssetStore:
+    """以內容雜湊命名的SVG檔案與預壓縮版本"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+
+    @property
+    def encodings(self) -> List[str]:
+        """伺服器端可提供的壓縮格式（依偏好排序）"""
+        return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+    def save_svg(self, svg: str, prefix: str = "natal") -> str:
+        """寫入SVG與壓縮版本，回傳檔名；內容相同時沿用既有檔案"""
+        content = svg.encode("utf-8")
+        digest = hashlib.sha256(content).hexdigest()[:16]
+        filename = f"{prefix}_{digest}.svg"
+        path = self.directory / filename
+        if path.exists():
+            return filename
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        variants = {"": content, ".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants[".br"] = brotli.compress(content, mode=brotli.MODE_TEXT)
+        # 壓縮版本先寫，原始檔最後以rename落地，讀到原始檔即代表所有版本都已就緒
+        for suffix, data in sorted(variants.items(), key=lambda item: item[0] == ""):
+            tmp_path = self.directory / f".{filename}{suffix}.{os.getpid()}.tmp"
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, self.directory / f"{filename}{suffix}")
+        return filename
+
+    def resolve(self, filename: str, accept_encoding: str = "") -> Optional[Tuple[Path, Optional[str], str]]:
+        """
+        依Accept-Encoding選擇要回應的檔案版本
+
+        Returns:
+            (檔案路徑, Content-Encoding或None, 強ETag)；檔名不合法或不存在時回傳None
+        """
+        match = _FILENAME_PATTERN.match(filename)
+        if not match:
+            return None
+        path = self.directory / filename
+        if not path.exists():
+            return None
+
+        digest = match.group(1)
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in self.encodings:
+            q = accepted.get(encoding, accepted.get("*", 0.0))
+            variant = path.with_name(filename + _SUFFIXES[encoding])
+            if q > 0 and variant.exists():
+                # 每個編碼版本的位元組不同，需要各自的強ETag
+                return variant, encoding, f'"{digest}-{encoding}"'
+        return path, None, f'"{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match是否命中（支援 * 與多個以逗號分隔的ETag）"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+class ChartRenderer:
+    """背景繪製SVG的執行緒池；以chart_id保存最近的Future，同一張星盤只繪製一次"""
+
+    def __init__(self, max_workers: int = 2, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._max_workers = max(1, max_workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._futures: "OrderedDict[str, Future]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, chart_id: str, fn: Callable[..., str], *args: Any) -> Future:
+        """開始繪製（fn回傳chart_url）；已在繪製中或已成功時沿用同一個Future"""
+        with self._lock:
+            future = self._futures.get(chart_id)
+            if future is not None and not (future.done() and future.exception() is not None):
+                return future
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                                    thread_name_prefix="chart-render")
+            future = self._executor.submit(fn, *args)
+            self._futures[chart_id] = future
+            while len(self._futures) > self.max_entries:
+                self._futures.popitem(last=False)
+        return future
+
+    def get(self, chart_id: str) -> Optional[Future]:
+        with self._lock:
+            return self._futures.get(chart_id)
+
+
+_render_watch: ContextVar[Optional["RenderWatch"]] = ContextVar("astro_chart_render_watch", default=None)
+
+
+class RenderWatch:
+    """一次串流請求中等待繪製的星盤；完成的項目由astream轉為chart_ready事件"""
+
+    def __init__(self):
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._token = None
+
+    def activate(self) -> "RenderWatch":
+        self._token = _render_watch.set(self)
+        return self
+
+    def close(self) -> None:
+        if self._token is None:
+            return
+        try:
+            _render_watch.reset(self._token)
+        except ValueError:
+            # 在不同的context結束（例如async generator被其他task關閉）
+            _render_watch.set(None)
+        self._token = None
+
+    def add(self, chart_id: str, future: Future) -> None:
+        with self._lock:
+            self._pending.setdefault(chart_id, future)
+
+    def ready(self) -> List[Dict[str, str]]:
+        """取出已完成的繪製，回傳 [{"chart_id", "chart_url"}]；失敗的繪製只記錄不回傳"""
+        with self._lock:
+            done = [(chart_id, future) for chart_id, future in self._pending.items() if future.done()]
+            for chart_id, _ in done:
+                del self._pending[chart_id]
+        charts = []
+        for chart_id, future in done:
+            if future.exception() is not None:
+                print(f"⚠️ 星盤圖片繪製失敗 {chart_id}: {future.exception()}")
+                continue
+            charts.append({"chart_id": chart_id, "chart_url": future.result()})
+        return charts
+
+    async def wait(self, timeout: float) -> List[Dict[str, str]]:
+        """等待尚未完成的繪製（最多timeout秒），回傳期間完成的項目"""
+        with self._lock:
+            pending = list(self._pending.values())
+        if pending and timeout > 0:
+            done, _ = await asyncio.wait([asyncio.wrap_future(future) for future in pending], timeout=timeout)
+            for wrapped in done:
+                wrapped.exception()  # 錯誤由ready()記錄，避免asyncio再警告一次
+        return self.ready()
+
+
+def watch_render(chart_id: str, future: Future) -> None:
+    """把繪製中的星盤登記到目前請求（沒有串流請求時略過）"""
+    watch = _render_watch.get()
+    if watch is not None:
+        watch.add(chart_id, future)
+
+
+_chart_asset_store: Optional[ChartAssetStore] = None
+_chart_renderer: Optional[ChartRenderer] = None
+
+
+def get_chart_asset_store() -> ChartAssetStore:
+    """獲取全局星盤圖片儲存"""
+    global _chart_asset_store
+    if _chart_asset_store is None:
+        _chart_asset_store = ChartAssetStore(config.CHART_IMAGE_PATH)
+    return _chart_asset_store
+
+
+def get_chart_renderer() -> ChartRenderer:
+    """獲取全局星盤繪製執行緒池"""
+    global _chart_renderer
+    if _chart_renderer is None:
+        _chart_renderer = ChartRenderer(config.CHART_RENDER_WORKERS, config.CHART_STORE_SIZE)
+    return _chart_renderer
@@ -0,0 +1,107 @@
+"""
+星盤預先計算
+astream收到訊息時若能辨識出生資料，就在背景執行緒先開始計算星盤；
+Agent之後呼叫natal_figure時直接取用同一個Future，不必等模型回合結束才開始計算。
+沒有預先計算時，natal_figure也在同一個執行緒池上計算（不佔用事件迴圈），相同出生資料的並行呼叫共用一個Future
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from ..monitoring.metrics import registry
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+from config import config
+
+
+PRECOMPUTE_EVENTS = registry.counter(
+    "astro_chart_precompute_total",
+    "Chart computations by outcome (submitted, computed, hit, expired)",
+    ("result",))
+
+
+class ChartPrecomputer:
+    """以出生資料為鍵保存背景計算中的星盤Future，超過TTL未使用即丟棄"""
+
+    def __init__(self, max_workers: int = 2, ttl: float = 300.0, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._max_workers = max(1, max_workers)
+        self._entries: Dict[str, Tuple[Future, float, bool]] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def key(utc_dt: str, lat: float, lon: float) -> str:
+        # 模型傳入的座標可能被四捨五入，以兩位小數（約1公里）比對
+        return f"{utc_dt.strip()[:16]}|{round(lat, 2):.2f}|{round(lon, 2):.2f}"
+
+    def _prune(self, now: float) -> None:
+        expired = [key for key, (_, created, _) in self._entries.items() if now - created > self.ttl]
+        for key in expired:
+            _, _, used = self._entries.pop(key)
+            if not used:
+                PRECOMPUTE_EVENTS.inc(result="expired")
+        while len(self._entries) > self.max_entries:
+            oldest = min(self._entries, key=lambda key: self._entries[key][1])
+            self._entries.pop(oldest)
+
+    def _submit(self, key: str, utc_dt: str, lat: float, lon: float, fn: Callable[..., Any],
+                used: bool) -> Future:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                                thread_name_prefix="chart-precompute")
+        future = self._executor.submit(fn, utc_dt, lat, lon)
+        self._entries[key] = (future, time.monotonic(), used)
+        future.add_done_callback(lambda done: self._discard_failed(key, done))
+        return future
+
+    def _discard_failed(self, key: str, future: Future) -> None:
+        # 失敗的計算不保留，下次呼叫重新計算
+        if future.cancelled() or future.exception() is not None:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] is future:
+                    del self._entries[key]
+
+    def submit(self, utc_dt: str, lat: float, lon: float, fn: Callable[..., Any]) -> bool:
+        """開始背景計算；同一份出生資料已在計算中時不重複提交"""
+        key = self.key(utc_dt, lat, lon)
+        with self._lock:
+            self._prune(time.monotonic())
+            if key in self._entries:
+                return False
+            self._submit(key, utc_dt, lat, lon, fn, used=False)
+        PRECOMPUTE_EVENTS.inc(result="submitted")
+        return True
+
+    def compute(self, utc_dt: str, lat: float, lon: float, fn: Callable[..., Any]) -> Future:
+        """取得這份出生資料的計算Future：已在計算（或已預先計算）時共用，否則在執行緒池上開始計算"""
+        key = self.key(utc_dt, lat, lon)
+        with self._lock:
+            self._prune(time.monotonic())
+            entry = self._entries.get(key)
+            if entry is not None:
+                future, created, _ = entry
+                self._entries[key] = (future, created, True)
+                result = "hit"
+            else:
+                future = self._submit(key, utc_dt, lat, lon, fn, used=True)
+                result = "computed"
+        PRECOMPUTE_EVENTS.inc(result=result)
+        return future
+
+
+_chart_precomputer: Optional[ChartPrecomputer] = None
+
+
+def get_chart_precomputer() -> ChartPrecomputer:
+    """獲取全局星盤預先計算器"""
+    global _chart_precomputer
+    if _chart_precomputer is None:
+        _chart_precomputer = ChartPrecomputer(config.CHART_PRECOMPUTE_WORKERS, config.CHART_PRECOMPUTE_TTL)
+    return _chart_precomputer
@@ -0,0 +1,185 @@
+"""
+星盤資料摘要與儲存
+將natal.Data轉為完整的結構化資料（提供給前端）與精簡摘要（提供給LLM），
+完整資料以chart_id為鍵保存在記憶體LRU與CHART_CACHE_PATH中
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from natal import Data
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+from config import config
+
+
+SUMMARY_SCHEMA_VERSION = 1
+
+
+def chart_id_for(utc_dt: str, lat: float, lon: float, house_sys: str = "P") -> str:
+    """由出生資料產生穩定的星盤ID（相同輸入得到相同ID）"""
+    key = f"{utc_dt}|{lat:.4f}|{lon:.4f}|{house_sys}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _position(body: Any) -> Dict[str, Any]:
+    return {
+        "degree": round(body.degree, 4),
+        "sign": body.sign.name,
+        "sign_degree": round(body.degree % 30, 2),
+        "dms": body.signed_dms,
+    }
+
+
+def chart_to_dict(chart_id: str, data: Data, utc_dt: str, lat: float, lon: float) -> Dict[str, Any]:
+    """完整的結構化星盤資料"""
+    planets = []
+    for body in data.planets + data.extras:
+        planets.append({
+            "name": body.name,
+            "symbol": body.symbol,
+            **_position(body),
+            "house": data.house_of(body),
+            "retrograde": bool(body.retro),
+            "speed": round(body.speed, 4),
+        })
+
+    houses = []
+    for house in data.houses:
+        houses.append({
+            "house": house.value,
+            **_position(house),
+            "ruler": house.ruler,
+            "ruler_house": house.ruler_house,
+        })
+
+    aspects = []
+    for aspect in data.aspects:
+        aspects.append({
+            "body1": aspect.body1.name,
+            "body2": aspect.body2.name,
+            "aspect": aspect.aspect_member.name,
+            "orb": round(aspect.orb, 2),
+            "applying": bool(aspect.applying),
+        })
+
+    return {
+        "chart_id": chart_id,
+        "utc_dt": utc_dt,
+        "lat": lat,
+        "lon": lon,
+        "house_sys": str(data.house_sys),
+        "planets": planets,
+        "vertices": [{"name": vertex.name, **_position(vertex)} for vertex in data.vertices],
+        "houses": houses,
+        "aspects": aspects,
+    }
+
+
+def summarize_chart(chart: Dict[str, Any], max_aspects: Optional[int] = None) -> Dict[str, Any]:
+    """
+    精簡摘要：固定欄位，每個位置壓成一個短字串，相位依容許度排序並截斷
+
+    例：{"planets": {"sun": "capricorn 27.65 h6"}, "aspects": ["sun conjunction mercury 1.56"]}
+    逆行標記為 R，入相位標記為 a。
+    """
+    max_aspects = config.NATAL_SUMMARY_MAX_ASPECTS if max_aspects is None else max_aspects
+
+    def short(position: Dict[str, Any]) -> str:
+        return f"{position['sign']} {position['sign_degree']:.2f}"
+
+    vertices = {vertex["name"]: vertex for vertex in chart["vertices"]}
+    aspects = sorted(chart["aspects"], key=lambda aspect: aspect["orb"])
+    summary = {
+        "v": SUMMARY_SCHEMA_VERSION,
+        "chart_id": chart["chart_id"],
+        "data_url": f"/charts/{chart['chart_id']}/data",
+        "asc": short(vertices["asc"]) if "asc" in vertices else None,
+        "mc": short(vertices["mc"]) if "mc" in vertices else None,
+        "planets": {
+            planet["name"]: f"{short(planet)} h{planet['house']}" + (" R" if planet["retrograde"] else "")
+            for planet in chart["planets"]
+        },
+        "houses": [short(house) for house in chart["houses"]],
+        "aspects": [
+            f"{aspect['body1']} {aspect['aspect']} {aspect['body2']} {aspect['orb']:.2f}"
+            + (" a" if aspect["applying"] else "")
+            for aspect in aspects[:max_aspects]
+        ],
+        "aspects_omitted": max(len(aspects) - max_aspects, 0),
+    }
+    if chart.get("chart_url"):
+        summary["chart_url"] = chart["chart_url"]
+    return summary
+
+
+class ChartStore:
+    """以chart_id保存完整星盤資料：記憶體LRU加上磁碟JSON"""
+
+    def __init__(self, directory: str, max_entries: int = 256):
+        self.directory = Path(directory)
+        self.max_entries = max(1, max_entries)
+        self._charts: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, chart_id: str) -> Path:
+        return self.directory / f"{chart_id}.json"
+
+    def put(self, chart: Dict[str, Any]) -> None:
+        chart_id = chart["chart_id"]
+        with self._lock:
+            self._charts[chart_id] = chart
+            self._charts.move_to_end(chart_id)
+            while len(self._charts) > self.max_entries:
+                self._charts.popitem(last=False)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(self._path(chart_id), "w", encoding="utf-8") as f:
+                json.dump(chart, f, ensure_ascii=False)
+        except OSError as e:
+            print(f"⚠️ 星盤資料寫入失敗: {e}")
+
+    def update(self, chart_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        """更新已存在星盤的欄位（如背景繪製完成後的chart_url），回傳更新後的資料"""
+        chart = self.get(chart_id)
+        if chart is None:
+            return None
+        chart = {**chart, **fields}
+        self.put(chart)
+        return chart
+
+    def get(self, chart_id: str) -> Optional[Dict[str, Any]]:
+        if not chart_id.isalnum():
+            return None
+        with self._lock:
+            chart = self._charts.get(chart_id)
+            if chart is not None:
+                self._charts.move_to_end(chart_id)
+                return chart
+        path = self._path(chart_id)
+        if not path.exists():
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            chart = json.load(f)
+        with self._lock:
+            self._charts[chart_id] = chart
+            while len(self._charts) > self.max_entries:
+                self._charts.popitem(last=False)
+        return chart
+
+
+_chart_store: Optional[ChartStore] = None
+
+
+def get_chart_store() -> ChartStore:
+    """獲取全局星盤資料儲存"""
+    global _chart_store
+    if _chart_store is None:
+        _chart_store = ChartStore(config.CHART_CACHE_PATH, config.CHART_STORE_SIZE)
+    return _chart_store
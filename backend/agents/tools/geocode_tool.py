@@ -0,0 +1,231 @@
+"""
+離線出生地與時區解析工具
+以內嵌地名表（中英文別名的前綴樹）找出出生地座標，再以zoneinfo的歷史時區資料
+把當地出生時間轉為UTC，省去網路搜尋與額外的LLM推理回合
+"""
+
+import csv
+import json
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from langchain_core.tools import tool
+
+
+GAZETTEER_PATH = Path(__file__).parent / "data" / "gazetteer.csv"
+
+_PUNCTUATION = re.compile(r"[\s,，、。.'’\-()（）]+")
+_TERMINAL = "\0"
+
+
+@dataclass(frozen=True)
+class Place:
+    name: str
+    lat: float
+    lon: float
+    tz: str
+    country: str
+
+
+def normalize(text: str) -> str:
+    """小寫、臺→台、標點與空白統一為單一空白"""
+    text = text.lower().replace("臺", "台")
+    return _PUNCTUATION.sub(" ", text).strip()
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isascii() and char.isalnum()
+
+
+class Gazetteer:
+    """地名前綴樹：支援在整句輸入中找出最長的地名，以及前綴補全"""
+
+    def __init__(self, places: List[Place], aliases: List[Tuple[str, int]]):
+        self.places = places
+        self._root: Dict = {}
+        for alias, index in aliases:
+            node = self._root
+            for char in normalize(alias):
+                node = node.setdefault(char, {})
+            node.setdefault(_TERMINAL, set()).add(index)
+
+    @classmethod
+    def load(cls, path: Path = GAZETTEER_PATH) -> "Gazetteer":
+        places, aliases = [], []
+        with open(path, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                index = len(places)
+                places.append(Place(row["name"], float(row["lat"]), float(row["lon"]), row["tz"], row["country"]))
+                aliases.append((row["name"], index))
+                aliases.extend((alias, index) for alias in row["aliases"].split("|") if alias)
+        return cls(places, aliases)
+
+    def _longest_at(self, text: str, start: int) -> Tuple[int, Optional[set]]:
+        node, best_end, best = self._root, start, None
+        for position in range(start, len(text)):
+            node = node.get(text[position])
+            if node is None:
+                break
+            end = position + 1
+            # 英文地名需要完整的單字邊界，避免 "la" 命中 "lake"
+            if _TERMINAL in node and not (_is_word_char(text[end - 1]) and end < len(text) and _is_word_char(text[end])):
+                best_end, best = end, node[_TERMINAL]
+        return best_end - start, best
+
+    def find(self, query: str) -> Optional[Place]:
+        """找出輸入中最長的地名（如 "我在台北市大安區出生" → 台北）"""
+        text = normalize(query)
+        best_length, best = 0, None
+        for start in range(len(text)):
+            if start and _is_word_char(text[start]) and _is_word_char(text[start - 1]):
+                continue
+            length, indices = self._longest_at(text, start)
+            if indices and length > best_length:
+                best_length, best = length, indices
+        return self.places[min(best)] if best else None
+
+    def complete(self, prefix: str, limit: int = 5) -> List[str]:
+        """前綴補全，找不到地名時提供建議"""
+        node = self._root
+        for char in normalize(prefix)[:2]:
+            node = node.get(char)
+            if node is None:
+                return []
+        found, stack = [], [node]
+        while stack and len(found) < limit * 4:
+            current = stack.pop()
+            found.extend(current.get(_TERMINAL, ()))
+            stack.extend(child for key, child in current.items() if key != _TERMINAL)
+        names = []
+        for index in sorted(set(found)):
+            if self.places[index].name not in names:
+                names.append(self.places[index].name)
+        return names[:limit]
+
+
+_DATE = re.compile(r"(\d{4})\s*[年/\-.]\s*(\d{1,2})\s*[月/\-.]\s*(\d{1,2})\s*[日號号]?")
+_TIME = re.compile(
+    r"(凌晨|半夜|清晨|早上|上午|中午|下午|傍晚|晚上|夜裡|夜里)?\s*(\d{1,2})\s*(?:[:：點点時时]\s*(\d{1,2}|半)?\s*分?)?\s*(am|pm|a\.m\.|p\.m\.)?",
+    re.IGNORECASE,
+)
+_PM_PERIODS = {"下午", "傍晚", "晚上"}
+_AM_PERIODS = {"凌晨", "半夜", "清晨", "早上", "上午"}
+_NIGHT_PERIODS = {"晚上", "夜裡", "夜里"}
+
+
+def parse_local_datetime(text: str) -> Tuple[datetime, bool]:
+    """
+    解析當地出生時間
+
+    支援 "2000-01-18 19:00"、"2000/1/18 7:30pm"、"2000年1月18日下午7點半" 等格式。
+
+    Returns:
+        (當地時間, 是否為推定時間)；只有日期時以中午12:00推定
+    """
+    date_match = _DATE.search(text)
+    if not date_match:
+        raise ValueError(f"無法解析日期：{text}")
+    year, month, day = (int(value) for value in date_match.groups())
+
+    rest = text[date_match.end():]
+    hour, minute, assumed = 12, 0, True
+    next_day = False
+    for match in _TIME.finditer(rest):
+        period, hour_text, minute_text, meridiem = match.groups()
+        has_separator = match.group(0).strip() != hour_text
+        if not (period or meridiem or has_separator):
+            continue
+        hour = int(hour_text)
+        minute = 30 if minute_text == "半" else int(minute_text or 0)
+        meridiem = (meridiem or "").lower().replace(".", "")
+        if period in _NIGHT_PERIODS and hour == 12:
+            # 晚上12點是當天結束的午夜，即隔天00:00
+            hour, next_day = 0, True
+        elif (period in _PM_PERIODS or meridiem == "pm") and hour < 12:
+            hour += 12
+        elif period in _NIGHT_PERIODS and 6 <= hour < 12:
+            # 夜裡11點為23:00，夜裡2點則是凌晨
+            hour += 12
+        elif period == "中午" and hour < 11:
+            hour += 12
+        elif (period in _AM_PERIODS or meridiem == "am") and hour == 12:
+            hour = 0
+        assumed = False
+        break
+
+    local_dt = datetime(year, month, day, hour, minute)
+    return (local_dt + timedelta(days=1) if next_day else local_dt), assumed
+
+
+@lru_cache(maxsize=None)
+def _zone(name: str) -> ZoneInfo:
+    return ZoneInfo(name)
+
+
+def local_to_utc(local_dt: datetime, tz_name: str) -> Tuple[datetime, timedelta]:
+    """以歷史時區規則（含當年的日光節約時間）把當地時間轉為UTC"""
+    aware = local_dt.replace(tzinfo=_zone(tz_name))
+    return aware.astimezone(timezone.utc).replace(tzinfo=None), aware.utcoffset()
+
+
+def _format_offset(offset: timedelta) -> str:
+    minutes = int(offset.total_seconds() // 60)
+    sign = "+" if minutes >= 0 else "-"
+    return f"{sign}{abs(minutes) // 60:02d}:{abs(minutes) % 60:02d}"
+
+
+_gazetteer: Optional[Gazetteer] = None
+
+
+def get_gazetteer() -> Gazetteer:
+    """獲取全局地名表（首次使用時載入）"""
+    global _gazetteer
+    if _gazetteer is None:
+        _gazetteer = Gazetteer.load()
+    return _gazetteer
+
+
+@tool("resolve_birth_data")
+def resolve_birth_data(place: str, local_datetime: str) -> str:
+    """
+    Convert a birth place and local birth time into the UTC time and coordinates needed by
+    natal_figure, natal_transits and synastry, without any web search.
+
+    Args:
+        place (str): Birth city in Chinese or English (e.g., "台北", "高雄市", "New York")
+        local_datetime (str): Local birth date and time as written by the user
+                              (e.g., "2000-01-18 19:00", "2000年1月18日下午7點")
+
+    Returns:
+        str: JSON with "utc_dt" ("YYYY-MM-DD HH:MM"), "lat", "lon", "place", "timezone" and
+             "utc_offset" (historical, including daylight saving time). "time_assumed" is true
+             when no time was given and 12:00 was used. When the place is unknown, returns
+             "error" and "suggestions".
+    """
+    gazetteer = get_gazetteer()
+    match = gazetteer.find(place)
+    if match is None:
+        return json.dumps({"error": f"unknown place: {place}", "suggestions": gazetteer.complete(place)},
+                          ensure_ascii=False)
+    try:
+        local_dt, assumed = parse_local_datetime(local_datetime)
+    except ValueError as e:
+        return json.dumps({"error": str(e)}, ensure_ascii=False)
+
+    utc_dt, offset = local_to_utc(local_dt, match.tz)
+    result = {
+        "utc_dt": utc_dt.strftime("%Y-%m-%d %H:%M"),
+        "lat": match.lat,
+        "lon": match.lon,
+        "place": match.name,
+        "timezone": match.tz,
+        "utc_offset": _format_offset(offset),
+    }
+    if assumed:
+        result["time_assumed"] = True
+    return json.dumps(result, ensure_ascii=False, separators=(",", ":"))
@@ -1,27 +1,33 @@
-import os
-from pathlib import Path
+import asyncio
+import json
 from langchain_core.tools import tool
 import time
+from concurrent.futures import Future
+from typing import Optional
 from natal import Data, Chart
 
+from .chart_assets import get_chart_asset_store, get_chart_renderer, minify_svg, watch_render
+from .chart_precompute import get_chart_precomputer
+from .chart_summary import chart_id_for, chart_to_dict, get_chart_store, summarize_chart
+from .geocode_tool import get_gazetteer, local_to_utc, parse_local_datetime
 
-@tool("natal_figure")
-def natal_figure(utc_dt: str, lat: float, lon: float) -> Data:
-    """
-    Generate a natal chart using provided birth data.
 
-    Args:
-        utc_dt (str): Birth date and time in UTC format (e.g., "1980-04-20 06:30")
-        lat (float): Latitude of birth location (e.g., 25.0531 for Taipei)
-        lon (float): Longitude of birth location (e.g., 121.526 for Taipei)
+def _render_svg(chart_id: str, natal_data: Data) -> str:
+    """Render and save the minified SVG in the background, then record its URL in the chart store."""
+    # Create the natal chart with specified width
+    chart = Chart(natal_data, width=600)
 
-    The function generates the chart, saves it as an SVG image in the /charts directory,
-    and returns the Data object containing all astrological information.
+    # Save the chart under a content-hashed name; quart_api serves it from /charts/<filename>
+    chart_filename = get_chart_asset_store().save_svg(minify_svg(chart.svg))
+    chart_url = f"/charts/{chart_filename}"
+    get_chart_store().update(chart_id, chart_url=chart_url, chart_status="ready")
 
-    Returns:
-        Data: The natal chart data object containing planets, houses, aspects, and other
-              astrological information for the provided birth chart.
-    """
+    print(f"✅ Natal chart saved successfully: {chart_filename}")
+    return chart_url
+
+
+def render_natal_chart(utc_dt: str, lat: float, lon: float) -> str:
+    """Compute the chart data, start rendering the SVG in the background and return the compact summary JSON."""
     try:
         # Create chart data object with MiMi's birth information
         natal_data = Data(
@@ -31,33 +37,80 @@ def natal_figure(utc_dt: str, lat: float, lon: float) -> Data:
             lon=lon,  # Longitude for Taipei, Taiwan
         )
         
-        # Create the natal chart with specified width
-        chart = Chart(natal_data, width=600)
-        
-        # Ensure charts directory exists
-        # Get the project root directory (go up from backend/agents/tools to project root)
-        project_root = Path(__file__).parent.parent.parent.parent
-        charts_dir = project_root / "frontend" / "public" / "charts"
-        charts_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Generate SVG content
-        svg_content = chart.svg
-        
-        # Save the chart as an SVG file
-        chart_filename = f"123_natal_chart.svg"
-        chart_path = charts_dir / chart_filename
-        
-        
-        with open(chart_path, 'w', encoding='utf-8') as f:
-            f.write(svg_content)
-        
-        print(f"✅ Natal chart saved successfully: {chart_path}")
         print(f"📊 Chart contains {len(natal_data.planets)} planets, {len(natal_data.houses)} houses, and {len(natal_data.aspects)} aspects")
-        output_path = os.path.join(charts_dir, chart_filename)
-        # Return the Data object for further use
-        return output_path
+        
+        # Full structured data goes to the chart store for the frontend, the LLM gets the summary
+        chart_id = chart_id_for(utc_dt, lat, lon, str(natal_data.house_sys))
+        chart_data = get_chart_store().get(chart_id)
+        if chart_data is None:
+            chart_data = chart_to_dict(chart_id, natal_data, utc_dt, lat, lon)
+            chart_data["chart_status"] = "rendering"
+            get_chart_store().put(chart_data)
+        if not chart_data.get("chart_url"):
+            # The SVG is only needed by the browser, so the tool returns before it is drawn
+            get_chart_renderer().submit(chart_id, _render_svg, chart_id, natal_data)
+        return json.dumps(summarize_chart(chart_data), ensure_ascii=False, separators=(",", ":"))
         
     except Exception as e:
         error_msg = f"❌ Error generating natal chart: {str(e)}"
         print(error_msg)
         raise Exception(error_msg)
+
+
+def _watch_chart_image(summary: str) -> None:
+    """Register the chart's SVG render with the current request so astream can emit chart_ready."""
+    chart = json.loads(summary)
+    future = get_chart_renderer().get(chart["chart_id"])
+    if future is None and chart.get("chart_url"):
+        # Rendered by an earlier request and no longer tracked by the renderer
+        future = Future()
+        future.set_result(chart["chart_url"])
+    if future is not None:
+        watch_render(chart["chart_id"], future)
+
+
+@tool("natal_figure")
+async def natal_figure(utc_dt: str, lat: float, lon: float) -> str:
+    """
+    Generate a natal chart using provided birth data.
+
+    Args:
+        utc_dt (str): Birth date and time in UTC format (e.g., "1980-04-20 06:30")
+        lat (float): Latitude of birth location (e.g., 25.0531 for Taipei)
+        lon (float): Longitude of birth location (e.g., 121.526 for Taipei)
+
+    The function computes the chart and returns a compact JSON summary right away; the chart
+    image is drawn in the background and delivered to the user's screen automatically.
+
+    Returns:
+        str: JSON summary with "asc", "mc", "planets" (name -> "sign degree hHOUSE", "R" when
+             retrograde), "houses" (cusps 1-12 as "sign degree"), "aspects" (tightest first,
+             "body1 aspect body2 orb", "a" when applying), "chart_id" and "chart_url" (only
+             when the image already exists).
+    """
+    # Reuse the chart astream started speculatively for this birth data, otherwise compute it on
+    # the shared chart executor so the event loop stays free for concurrent tool calls
+    future = get_chart_precomputer().compute(utc_dt, lat, lon, render_natal_chart)
+    summary = await asyncio.wrap_future(future)
+    _watch_chart_image(summary)
+    return summary
+
+
+def precompute_from_message(message: str) -> Optional[str]:
+    """
+    Start computing the chart in the background when the message contains a full birth date,
+    birth time and a known place. Returns the UTC birth time used, or None.
+    """
+    place = get_gazetteer().find(message)
+    if place is None:
+        return None
+    try:
+        local_dt, time_assumed = parse_local_datetime(message)
+    except ValueError:
+        return None
+    if time_assumed:
+        # Without a birth time the model may ask first or pick another default
+        return None
+    utc_dt = local_to_utc(local_dt, place.tz)[0].strftime("%Y-%m-%d %H:%M")
+    get_chart_precomputer().submit(utc_dt, place.lat, place.lon, render_natal_chart)
+    return utc_dt
@@ -3,6 +3,7 @@ RAG工具包裝器 - 將Pinecone RAG功能包裝為LangChain工具
 基於開發計劃中的規格實現占星學知識庫搜尋功能
 """
 
+import asyncio
 import json
 from typing import List, Dict, Optional
 from langchain_core.tools import tool
@@ -17,12 +18,13 @@ class AstrologyRAGTool:
         self.client = PineconeClient()
         self.similarity_threshold = 0.7  # 相似度閾值
     
-    def format_results(self, results: List[Dict]) -> str:
+    def format_results(self, results: List[Dict], similarity_threshold: Optional[float] = None) -> str:
         """
         格式化RAG搜尋結果為可讀文本
         
         Args:
             results: Pinecone搜尋結果列表
+            similarity_threshold: 相似度閾值（預設使用實例設定）
             
         Returns:
             str: 格式化的文本結果
@@ -30,14 +32,16 @@ class AstrologyRAGTool:
         if not results:
             return "未找到相關的占星學知識。"
         
+        threshold = self.similarity_threshold if similarity_threshold is None else similarity_threshold
+        
         # 過濾低相似度結果
         filtered_results = [
             result for result in results 
-            if result.get("score", 0) >= self.similarity_threshold
+            if result.get("score", 0) >= threshold
         ]
         
         if not filtered_results:
-            return f"未找到相似度超過{self.similarity_threshold}的相關知識。"
+            return f"未找到相似度超過{threshold}的相關知識。"
         
         formatted_text = "🔍 相關占星學知識：\n\n"
         
@@ -61,7 +65,7 @@ _rag_tool_instance = AstrologyRAGTool()
 
 
 @tool("search_astrology_knowledge")
-def search_astrology_knowledge(query: str, top_k: int = 5) -> str:
+async def search_astrology_knowledge(query: str, top_k: int = 5) -> str:
     """
     搜尋占星學知識庫
     
@@ -81,8 +85,8 @@ def search_astrology_knowledge(query: str, top_k: int = 5) -> str:
         - search_astrology_knowledge("第七宮代表什麼")
     """
     try:
-        # 使用Pinecone客戶端搜尋
-        results = _rag_tool_instance.client.search_rag_context(
+        # 使用Pinecone客戶端的非同步搜尋，同一步驟的多個工具呼叫可並行
+        results = await _rag_tool_instance.client.search_rag_context_async(
             user_query=query,
             index_name="astrology-text",
             namespace="hierarchy_chunking_strategy",
@@ -97,7 +101,7 @@ def search_astrology_knowledge(query: str, top_k: int = 5) -> str:
 
 
 @tool("search_astrology_knowledge_advanced")
-def search_astrology_knowledge_advanced(
+async def search_astrology_knowledge_advanced(
     query: str, 
     top_k: int = 5,
     similarity_threshold: float = 0.7
@@ -116,25 +120,16 @@ def search_astrology_knowledge_advanced(
         str: 格式化的占星學知識內容
     """
     try:
-        # 臨時調整相似度閾值
-        original_threshold = _rag_tool_instance.similarity_threshold
-        _rag_tool_instance.similarity_threshold = similarity_threshold
-        
         # 搜尋知識
-        results = _rag_tool_instance.client.search_rag_context(
+        results = await _rag_tool_instance.client.search_rag_context_async(
             user_query=query,
             index_name="astrology-text",
             namespace="hierarchy_chunking_strategy",
             top_k=top_k
         )
         
-        # 格式化結果
-        formatted_result = _rag_tool_instance.format_results(results)
-        
-        # 恢復原始閾值
-        _rag_tool_instance.similarity_threshold = original_threshold
-        
-        return formatted_result
+        # 以本次呼叫的閾值格式化結果（不修改共用實例，並行呼叫互不影響）
+        return _rag_tool_instance.format_results(results, similarity_threshold)
         
     except Exception as e:
         return f"進階搜尋占星學知識時發生錯誤：{str(e)}"
@@ -169,6 +164,6 @@ if __name__ == "__main__":
     
     for query in test_queries:
         print(f"\n查詢：{query}")
-        result = search_astrology_knowledge(query)
+        result = asyncio.run(search_astrology_knowledge.ainvoke({"query": query}))
         print(f"結果：{result}")
         print("-" * 50)
@@ -0,0 +1,235 @@
+"""
+合盤（Synastry）計算引擎
+每張星盤轉為固定順序的黃經向量並以chart_id快取，兩盤之間的相位以陣列運算一次算出：
+單一配對給Agent工具使用，一對多評分給批次API（數千張候選星盤）使用
+"""
+
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import swisseph as swe
+from langchain_core.tools import tool
+from natal.utils import str_to_dt
+
+from .chart_summary import chart_id_for, get_chart_store
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+from config import config
+
+
+# 向量中各點的順序（與natal的行星名稱一致）
+SYNASTRY_POINTS: List[str] = [
+    "sun", "moon", "mercury", "venus", "mars", "jupiter", "saturn", "uranus", "neptune", "pluto", "asc",
+]
+_SWE_BODIES = [swe.SUN, swe.MOON, swe.MERCURY, swe.VENUS, swe.MARS, swe.JUPITER,
+               swe.SATURN, swe.URANUS, swe.NEPTUNE, swe.PLUTO]
+
+# (相位, 角度, 容許度, 權重)：和諧相位加分，緊張相位扣分
+SYNASTRY_ASPECTS: List[Tuple[str, float, float, float]] = [
+    ("conjunction", 0.0, 8.0, 1.0),
+    ("sextile", 60.0, 4.0, 0.6),
+    ("square", 90.0, 6.0, -0.8),
+    ("trine", 120.0, 6.0, 1.0),
+    ("opposition", 180.0, 7.0, -0.5),
+]
+
+# 個人行星與上升點在合盤中較重要
+_POINT_WEIGHTS = np.array([1.5, 1.5, 1.0, 1.3, 1.3, 0.8, 0.8, 0.4, 0.4, 0.4, 1.2], dtype=np.float32)
+_PAIR_WEIGHTS = np.outer(_POINT_WEIGHTS, _POINT_WEIGHTS)
+_ANGLES = np.array([aspect[1] for aspect in SYNASTRY_ASPECTS], dtype=np.float32)
+_ORBS = np.array([aspect[2] for aspect in SYNASTRY_ASPECTS], dtype=np.float32)
+_ASPECT_WEIGHTS = np.array([aspect[3] for aspect in SYNASTRY_ASPECTS], dtype=np.float32)
+# 分數正規化：兩盤每個點對最多得到一個滿分相位
+_MAX_SCORE = float(_PAIR_WEIGHTS.sum() * _ASPECT_WEIGHTS.max())
+
+
+def compute_longitudes(utc_dt: str, lat: float, lon: float) -> np.ndarray:
+    """直接以swisseph計算SYNASTRY_POINTS的黃經（不建立完整的natal.Data）"""
+    dt = str_to_dt(utc_dt)
+    jd = swe.julday(dt.year, dt.month, dt.day, dt.hour + dt.minute / 60)
+    vector = np.empty(len(SYNASTRY_POINTS), dtype=np.float32)
+    for i, body in enumerate(_SWE_BODIES):
+        vector[i] = swe.calc_ut(jd, body)[0][0]
+    _, (asc, *_) = swe.houses(jd, lat, lon, b"P")
+    vector[-1] = asc
+    return vector
+
+
+class LongitudeCache:
+    """以chart_id快取每張星盤的黃經向量（LRU）"""
+
+    def __init__(self, max_entries: int = 20000):
+        self.max_entries = max_entries
+        self._vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _put(self, chart_id: str, vector: np.ndarray) -> np.ndarray:
+        with self._lock:
+            self._vectors[chart_id] = vector
+            while len(self._vectors) > self.max_entries:
+                self._vectors.popitem(last=False)
+        return vector
+
+    def _cached(self, chart_id: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._vectors.get(chart_id)
+            if vector is not None:
+                self._vectors.move_to_end(chart_id)
+            return vector
+
+    def for_birth(self, utc_dt: str, lat: float, lon: float) -> np.ndarray:
+        chart_id = chart_id_for(utc_dt, lat, lon)
+        vector = self._cached(chart_id)
+        if vector is None:
+            vector = self._put(chart_id, compute_longitudes(utc_dt, lat, lon))
+        return vector
+
+    def for_chart_id(self, chart_id: str) -> Optional[np.ndarray]:
+        """由natal_figure存入的完整星盤資料取得向量"""
+        vector = self._cached(chart_id)
+        if vector is not None:
+            return vector
+        chart = get_chart_store().get(chart_id)
+        if chart is None:
+            return None
+        degrees = {point["name"]: point["degree"] for point in chart["planets"] + chart["vertices"]}
+        if any(name not in degrees for name in SYNASTRY_POINTS):
+            return None
+        return self._put(chart_id, np.array([degrees[name] for name in SYNASTRY_POINTS], dtype=np.float32))
+
+    def resolve(self, spec: Dict[str, Any]) -> np.ndarray:
+        """
+        由請求中的星盤描述取得向量
+
+        支援 {"chart_id": ...}、{"utc_dt", "lat", "lon"} 或 {"longitudes": [...]}（依SYNASTRY_POINTS順序）
+        """
+        if spec.get("longitudes") is not None:
+            vector = np.asarray(spec["longitudes"], dtype=np.float32)
+            if vector.shape != (len(SYNASTRY_POINTS),):
+                raise ValueError(f"longitudes 需要 {len(SYNASTRY_POINTS)} 個值")
+            return vector % 360.0
+        if spec.get("chart_id"):
+            vector = self.for_chart_id(str(spec["chart_id"]))
+            if vector is None:
+                raise ValueError(f"找不到星盤 {spec['chart_id']}")
+            return vector
+        return self.for_birth(str(spec["utc_dt"]), float(spec["lat"]), float(spec["lon"]))
+
+
+def _separations(base: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """角距矩陣 shape (C, 點, 點)，值介於0~180"""
+    diff = np.abs(candidates[:, None, :] - base[None, :, None]) % 360.0
+    return np.minimum(diff, 360.0 - diff)
+
+
+def score_many(base: np.ndarray, candidates: np.ndarray, chunk_size: int = 2048) -> np.ndarray:
+    """
+    一對多合盤分數
+
+    每個點對、每個相位的貢獻為 權重 × max(0, 1 - |角距 - 相位角| / 容許度)，
+    加總後正規化到約 -100 ~ 100。
+    """
+    scores = np.empty(len(candidates), dtype=np.float32)
+    for start in range(0, len(candidates), chunk_size):
+        separation = _separations(base, candidates[start:start + chunk_size])
+        closeness = np.clip(1.0 - np.abs(separation[..., None] - _ANGLES) / _ORBS, 0.0, None)
+        raw = np.einsum("cija,ij,a->c", closeness, _PAIR_WEIGHTS, _ASPECT_WEIGHTS)
+        scores[start:start + chunk_size] = raw / _MAX_SCORE * 100.0
+    return scores
+
+
+def synastry_aspects(chart1: np.ndarray, chart2: np.ndarray) -> List[Dict[str, Any]]:
+    """兩盤之間在容許度內的所有相位，依容許度排序"""
+    separation = _separations(chart1, chart2[None, :])[0]
+    orbs = np.abs(separation[..., None] - _ANGLES)
+    aspects = []
+    for i, j, a in zip(*np.nonzero(orbs <= _ORBS)):
+        aspects.append({
+            "person1": SYNASTRY_POINTS[i],
+            "person2": SYNASTRY_POINTS[j],
+            "aspect": SYNASTRY_ASPECTS[a][0],
+            "orb": round(float(orbs[i, j, a]), 2),
+        })
+    aspects.sort(key=lambda aspect: aspect["orb"])
+    return aspects
+
+
+def score_candidates(base_spec: Dict[str, Any], candidate_specs: List[Dict[str, Any]],
+                     top_k: int = 50, cache: Optional[LongitudeCache] = None) -> Dict[str, Any]:
+    """
+    批次API的一對多評分：解析所有候選星盤後一次計算分數
+
+    無法解析的候選星盤列在 errors 中，不影響其他候選的評分。
+    """
+    cache = cache or get_longitude_cache()
+    base = cache.resolve(base_spec)
+
+    vectors, ids, errors = [], [], []
+    for index, spec in enumerate(candidate_specs):
+        try:
+            vectors.append(cache.resolve(spec))
+            ids.append(spec.get("id", index))
+        except KeyError as e:
+            errors.append({"index": index, "id": spec.get("id"), "error": f"缺少欄位 {e}"})
+        except (AttributeError, TypeError, ValueError) as e:
+            errors.append({"index": index, "id": spec.get("id") if isinstance(spec, dict) else None,
+                           "error": str(e)})
+
+    results = []
+    if vectors:
+        scores = score_many(base, np.stack(vectors))
+        order = np.argsort(-scores)[:max(1, top_k)]
+        results = [{"id": ids[i], "score": round(float(scores[i]), 2)} for i in order]
+    return {"count": len(vectors), "results": results, "errors": errors}
+
+
+_longitude_cache: Optional[LongitudeCache] = None
+
+
+def get_longitude_cache() -> LongitudeCache:
+    """獲取全局黃經向量快取"""
+    global _longitude_cache
+    if _longitude_cache is None:
+        _longitude_cache = LongitudeCache(config.SYNASTRY_CACHE_SIZE)
+    return _longitude_cache
+
+
+@tool("synastry")
+def synastry(utc_dt1: str, lat1: float, lon1: float, utc_dt2: str, lat2: float, lon2: float) -> str:
+    """
+    Compare two birth charts (synastry) and score their compatibility.
+
+    Args:
+        utc_dt1 (str): Person 1 birth date and time in UTC format (e.g., "1980-04-20 06:30")
+        lat1 (float): Person 1 birth latitude
+        lon1 (float): Person 1 birth longitude
+        utc_dt2 (str): Person 2 birth date and time in UTC format
+        lat2 (float): Person 2 birth latitude
+        lon2 (float): Person 2 birth longitude
+
+    Returns:
+        str: JSON with "score" (about -100 to 100, higher is more harmonious) and "aspects"
+             between the charts, tightest first, as "person1_point aspect person2_point orb".
+    """
+    try:
+        cache = get_longitude_cache()
+        chart1 = cache.for_birth(utc_dt1, lat1, lon1)
+        chart2 = cache.for_birth(utc_dt2, lat2, lon2)
+        aspects = synastry_aspects(chart1, chart2)
+        limit = config.SYNASTRY_MAX_ASPECTS
+        return json.dumps({
+            "v": 1,
+            "score": round(float(score_many(chart1, chart2[None, :])[0]), 1),
+            "aspects": [f"{a['person1']} {a['aspect']} {a['person2']} {a['orb']:.2f}" for a in aspects[:limit]],
+            "aspects_omitted": max(len(aspects) - limit, 0),
+        }, ensure_ascii=False, separators=(",", ":"))
+
+    except Exception as e:
+        error_msg = f"❌ Error calculating synastry: {str(e)}"
+        print(error_msg)
+        raise Exception(error_msg)
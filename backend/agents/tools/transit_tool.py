@@ -0,0 +1,243 @@
+"""
+行運計算工具
+以固定步長預先計算行星黃經表（依區塊快取），再以NumPy一次算出整段期間內
+所有行運行星對本命點的相位：容許度內的時間窗與精確成相時間
+"""
+
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import swisseph as swe
+from langchain_core.tools import tool
+from natal import Data
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+from config import config
+
+
+# 行運行星（swisseph編號）；月亮一天移動約13度，不列入年度行運
+TRANSIT_BODIES: List[Tuple[str, int]] = [
+    ("sun", swe.SUN), ("mercury", swe.MERCURY), ("venus", swe.VENUS), ("mars", swe.MARS),
+    ("jupiter", swe.JUPITER), ("saturn", swe.SATURN), ("uranus", swe.URANUS),
+    ("neptune", swe.NEPTUNE), ("pluto", swe.PLUTO),
+]
+
+# 有號相位角：六分、四分、三分相在兩個方向都成立
+ASPECT_ANGLES: List[Tuple[str, float]] = [
+    ("conjunction", 0.0), ("opposition", 180.0),
+    ("sextile", 60.0), ("sextile", -60.0),
+    ("square", 90.0), ("square", -90.0),
+    ("trine", 120.0), ("trine", -120.0),
+]
+
+# 較長的期間預設只看慢速行星，內行星的行運每隔幾天就有一次
+SLOW_BODIES = {"jupiter", "saturn", "uranus", "neptune", "pluto"}
+FAST_RANGE_DAYS = 60
+
+_JD_UNIX_EPOCH = 2440587.5
+_BLOCK_SAMPLES = 512
+
+
+def _jd(dt: datetime) -> float:
+    return swe.julday(dt.year, dt.month, dt.day, dt.hour + dt.minute / 60)
+
+
+def _date(jd: float) -> str:
+    return (datetime(1970, 1, 1) + timedelta(days=float(jd) - _JD_UNIX_EPOCH)).strftime("%Y-%m-%d")
+
+
+class EphemerisCache:
+    """
+    行星黃經表快取
+
+    取樣點固定對齊在 J2000 + i * step，每 _BLOCK_SAMPLES 個取樣為一個區塊，
+    區塊以LRU保存，不同請求的日期範圍可以共用已計算的區塊。
+    """
+
+    origin = 2451545.0  # J2000
+
+    def __init__(self, max_blocks: int = 64):
+        self.max_blocks = max_blocks
+        self._blocks: "OrderedDict[Tuple[float, int], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _block(self, step: float, index: int) -> np.ndarray:
+        key = (step, index)
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                return block
+
+        first = self.origin + index * _BLOCK_SAMPLES * step
+        block = np.empty((len(TRANSIT_BODIES), _BLOCK_SAMPLES), dtype=np.float64)
+        for i in range(_BLOCK_SAMPLES):
+            jd = first + i * step
+            for row, (_, body) in enumerate(TRANSIT_BODIES):
+                block[row, i] = swe.calc_ut(jd, body)[0][0]
+
+        with self._lock:
+            self._blocks[key] = block
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        return block
+
+    def table(self, start_jd: float, end_jd: float, step: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        取得 [start_jd, end_jd] 的黃經表
+
+        Returns:
+            (取樣時間 shape (N,), 黃經 shape (行星數, N))
+        """
+        first = int(np.floor((start_jd - self.origin) / step))
+        last = int(np.ceil((end_jd - self.origin) / step))
+        blocks = range(first // _BLOCK_SAMPLES, last // _BLOCK_SAMPLES + 1)
+        longitudes = np.concatenate([self._block(step, b) for b in blocks], axis=1)
+        offset = first - blocks[0] * _BLOCK_SAMPLES
+        longitudes = longitudes[:, offset:offset + last - first + 1]
+        times = self.origin + np.arange(first, last + 1) * step
+        return times, longitudes
+
+
+def find_transits(natal_points: Dict[str, float], times: np.ndarray, longitudes: np.ndarray,
+                  orb: float, bodies: Optional[List[str]] = None) -> List[Dict]:
+    """
+    一次計算所有行運相位
+
+    對每個 (行運行星, 本命點, 相位角) 計算有號角距 d(t)；|d| <= orb 的連續區段為時間窗，
+    d 變號處以線性內插求精確成相時間。
+    """
+    transit_names = [name for name, _ in TRANSIT_BODIES]
+    rows = [i for i, name in enumerate(transit_names) if bodies is None or name in bodies]
+    transit_names = [transit_names[i] for i in rows]
+    longitudes = longitudes[rows]
+
+    names = list(natal_points)
+    natal = np.array([natal_points[name] for name in names])
+    angles = np.array([angle for _, angle in ASPECT_ANGLES])
+
+    # shape (行星, 本命點, 相位角, 時間)
+    diff = longitudes[:, None, None, :] - natal[None, :, None, None] - angles[None, None, :, None]
+    diff = (diff + 180.0) % 360.0 - 180.0
+
+    # 精確成相：相鄰取樣變號，且不是 ±180 的折返
+    left, right = diff[..., :-1], diff[..., 1:]
+    crossing = (np.signbit(left) != np.signbit(right)) & (np.abs(left - right) < 90.0)
+    fraction = np.where(crossing, left / np.where(crossing, left - right, 1.0), 0.0)
+    exact_jd = times[:-1] + fraction * (times[1:] - times[:-1])
+    motion = (longitudes[:, 1:] - longitudes[:, :-1] + 180.0) % 360.0 - 180.0
+
+    exacts: Dict[Tuple[int, int, int], List[Tuple[float, bool]]] = {}
+    for p, k, a, i in zip(*np.nonzero(crossing)):
+        exacts.setdefault((p, k, a), []).append((exact_jd[p, k, a, i], bool(motion[p, i] < 0)))
+
+    # 容許度時間窗：前後補False，讓邊界上的時間窗也有起訖
+    in_orb = np.abs(diff) <= orb
+    # 快速行星可能在一個步長內跨過整個容許度，成相的取樣點一律視為在容許度內
+    in_orb[..., :-1] |= crossing
+    padded = np.pad(in_orb, [(0, 0)] * 3 + [(1, 1)])
+    edges = np.diff(padded.astype(np.int8), axis=-1)
+    starts = np.argwhere(edges == 1)
+    ends = np.argwhere(edges == -1)
+
+    events = []
+    for (p, k, a, s), (_, _, _, e) in zip(starts, ends):
+        window = (times[s], times[e - 1])
+        hits = [(jd, retro) for jd, retro in exacts.get((p, k, a), []) if window[0] <= jd <= times[min(e, len(times) - 1)]]
+        events.append({
+            "transit": transit_names[p],
+            "aspect": ASPECT_ANGLES[a][0],
+            "natal": names[k],
+            "start": window[0],
+            "end": window[1],
+            "exact": hits,
+        })
+    events.sort(key=lambda event: (event["exact"][0][0] if event["exact"] else event["start"]))
+    return events
+
+
+def _format_event(event: Dict) -> str:
+    text = f"{event['transit']} {event['aspect']} {event['natal']}"
+    if event["exact"]:
+        text += " exact " + ",".join(_date(jd) + (" R" if retro else "") for jd, retro in event["exact"])
+    return text + f" window {_date(event['start'])}..{_date(event['end'])}"
+
+
+_ephemeris_cache = EphemerisCache()
+
+
+@tool("natal_transits")
+def natal_transits(utc_dt: str, lat: float, lon: float, start_date: str = "", days: int = 365,
+                   planets: str = "") -> str:
+    """
+    Find transits of the planets (Sun to Pluto) to a natal chart over a date range.
+
+    Args:
+        utc_dt (str): Birth date and time in UTC format (e.g., "1980-04-20 06:30")
+        lat (float): Latitude of birth location (e.g., 25.0531 for Taipei)
+        lon (float): Longitude of birth location (e.g., 121.526 for Taipei)
+        start_date (str): First day of the range as "YYYY-MM-DD" (default: today)
+        days (int): Length of the range in days (default: 365, max: 3660)
+        planets (str): Comma-separated transiting planets, e.g. "saturn,pluto" (default: all
+                       planets for ranges up to 60 days, Jupiter to Pluto for longer ranges)
+
+    Use this for questions like "what transits hit my chart over the next year" instead of
+    calling natal_figure repeatedly.
+
+    Returns:
+        str: JSON with "events" sorted by date, each "transit aspect natal exact DATE[ R] window
+             START..END" (R = transiting planet retrograde at the exact hit; several exact dates
+             mean a retrograde pass), plus "events_omitted" when the list was truncated.
+             When "planets" names an unknown planet, returns "error" and "suggestions"
+             (the valid planet names).
+    """
+    try:
+        natal_data = Data(name="User", utc_dt=utc_dt, lat=lat, lon=lon)
+        natal_points = {body.name: body.degree for body in natal_data.planets}
+        natal_points.update({"asc": natal_data.asc.degree, "mc": natal_data.mc.degree})
+
+        start = datetime.strptime(start_date, "%Y-%m-%d") if start_date else datetime.now(timezone.utc)
+        days = max(1, min(int(days), 3660))
+        start_jd = _jd(start.replace(hour=0, minute=0))
+        end_jd = start_jd + days
+
+        if planets:
+            bodies = [name.strip().lower() for name in planets.split(",") if name.strip()]
+            valid = [name for name, _ in TRANSIT_BODIES]
+            unknown = [name for name in bodies if name not in valid]
+            if unknown:
+                # 拼錯的行星會被靜默略過而得到空結果，模型會誤以為沒有行運
+                return json.dumps({"error": f"unknown planets: {', '.join(unknown)}", "suggestions": valid},
+                                  ensure_ascii=False)
+        else:
+            bodies = None if days <= FAST_RANGE_DAYS else sorted(SLOW_BODIES)
+
+        step = config.TRANSIT_STEP_DAYS
+        times, longitudes = _ephemeris_cache.table(start_jd, end_jd, step)
+        events = find_transits(natal_points, times, longitudes, config.TRANSIT_ORB, bodies)
+        events = [event for event in events if event["end"] >= start_jd and event["start"] <= end_jd]
+        for event in events:
+            event["start"], event["end"] = max(event["start"], start_jd), min(event["end"], end_jd)
+            # 星曆表前後有補齊的取樣，範圍外的精確成相不回報
+            event["exact"] = [(jd, retro) for jd, retro in event["exact"] if start_jd <= jd <= end_jd]
+        events.sort(key=lambda event: (event["exact"][0][0] if event["exact"] else event["start"]))
+
+        limit = config.TRANSIT_MAX_EVENTS
+        return json.dumps({
+            "v": 1,
+            "range": [_date(start_jd), _date(end_jd)],
+            "orb": config.TRANSIT_ORB,
+            "events": [_format_event(event) for event in events[:limit]],
+            "events_omitted": max(len(events) - limit, 0),
+        }, ensure_ascii=False, separators=(",", ":"))
+
+    except Exception as e:
+        error_msg = f"❌ Error calculating transits: {str(e)}"
+        print(error_msg)
+        raise Exception(error_msg)
@@ -0,0 +1,130 @@
+"""
+Compare the agent's two streaming subscriptions on the same scripted workload.
+
+- events: ``astream_events(version="v1")`` — every chain/prompt/parser/tool event is created and
+  filtered in Python, only model tokens and tool start/end are forwarded
+- lean: LangGraph ``stream_mode=["messages", "updates"]`` — only model tokens and node outputs
+
+Reports raw events produced per request, SSE frames forwarded and CPU milliseconds per request.
+Tokens are streamed without delay so the numbers isolate event-handling overhead.
+
+Usage (from the backend directory):
+    python -m benchmarks.event_stream_bench --requests 50 --tool-pattern "search_astrology_knowledge;natal_figure"
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+os.environ.setdefault("AZURE_API_KEY", "offline-benchmark")
+os.environ.setdefault("EMBED_KEY", "offline-benchmark")
+os.environ.setdefault("TRACING_BACKEND", "none")
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "false")
+os.environ.setdefault("ROUTER_ENABLED", "false")
+os.environ.setdefault("USAGE_STORE_ENABLED", "false")
+
+from langchain_core.messages import HumanMessage
+
+from benchmarks.fakes import FakeEmbedder, FakeStreamingChatModel, InMemoryVectorStore, parse_tool_pattern
+
+MODES = ("events", "lean")
+
+
+async def build_agent(args: argparse.Namespace):
+    from agents.enhanced_astro_agent import EnhancedAstroAgent
+    from agents.tools import rag_tool
+
+    store = InMemoryVectorStore(embedder=FakeEmbedder(), corpus_size=args.corpus_size)
+    rag_tool._rag_tool_instance.client = store
+    llm = FakeStreamingChatModel(
+        tokens_per_second=0,
+        response_tokens=args.response_tokens,
+        tool_steps=parse_tool_pattern(args.tool_pattern),
+    )
+    agent = EnhancedAstroAgent(llm=llm, pinecone_client=store, enable_mcp=False)
+    await agent.initialize()
+    return agent
+
+
+async def count_raw_events(agent, mode: str, query: str) -> int:
+    """Number of items the underlying subscription yields for one request."""
+    inputs = {"messages": [HumanMessage(content=query)]}
+    count = 0
+    if mode == "events":
+        async for _ in agent.agent.astream_events(inputs, version="v1"):
+            count += 1
+    else:
+        async for _ in agent.agent.astream(inputs, stream_mode=["messages", "updates"]):
+            count += 1
+    return count
+
+
+async def run_mode(agent, mode: str, args: argparse.Namespace) -> Dict[str, Any]:
+    agent.stream_mode = mode
+    frames: List[int] = []
+    # 預熱
+    async for _ in agent.astream(args.query, include_rag=False):
+        pass
+
+    cpu_start = time.process_time()
+    for _ in range(args.requests):
+        count = 0
+        async for _ in agent.astream(args.query, include_rag=False):
+            count += 1
+        frames.append(count)
+    cpu = time.process_time() - cpu_start
+
+    return {
+        "raw_events_per_request": await count_raw_events(agent, mode, args.query),
+        "sse_frames_per_request": round(sum(frames) / len(frames), 1) if frames else 0.0,
+        "cpu_ms_per_request": round(cpu / args.requests * 1000, 2) if args.requests else 0.0,
+    }
+
+
+async def run_bench(args: argparse.Namespace) -> Dict[str, Any]:
+    agent = await build_agent(args)
+    report: Dict[str, Any] = {
+        "config": {
+            "requests": args.requests,
+            "response_tokens": args.response_tokens,
+            "tool_pattern": args.tool_pattern,
+        },
+    }
+    for mode in MODES:
+        report[mode] = await run_mode(agent, mode, args)
+
+    events, lean = report["events"], report["lean"]
+    report["reduction"] = {
+        "raw_events": round(1 - lean["raw_events_per_request"] / events["raw_events_per_request"], 3)
+        if events["raw_events_per_request"] else 0.0,
+        "cpu": round(1 - lean["cpu_ms_per_request"] / events["cpu_ms_per_request"], 3)
+        if events["cpu_ms_per_request"] else 0.0,
+    }
+    return report
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare astream_events v1 with the lean stream subscription")
+    parser.add_argument("--requests", type=int, default=30, help="requests per mode")
+    parser.add_argument("--query", default="水星逆行的影響是什麼？")
+    parser.add_argument("--response-tokens", type=int, default=120)
+    parser.add_argument("--tool-pattern", default="search_astrology_knowledge",
+                        help='tool steps separated by ";" with parallel calls separated by ","')
+    parser.add_argument("--corpus-size", type=int, default=200)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    report = asyncio.run(run_bench(parse_args(argv)))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""
+Deterministic offline fakes for benchmarking the API without Azure or Pinecone.
+
+- FakeStreamingChatModel: streams tokens at a fixed rate and follows a scripted tool-call pattern
+- FakeEmbedder: hash-based embeddings with optional simulated latency
+- InMemoryVectorStore: drop-in replacement for PineconeClient backed by a synthetic corpus
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from agents.monitoring.usage import record_embedding_usage
+
+
+# 各工具的預設假參數
+DEFAULT_TOOL_ARGS: Dict[str, Dict[str, Any]] = {
+    "search_astrology_knowledge": {"query": "上升星座的意義", "top_k": 5},
+    "search_astrology_knowledge_advanced": {"query": "水星逆行的影響", "top_k": 5, "similarity_threshold": 0.5},
+    "resolve_birth_data": {"place": "台北", "local_datetime": "2000年1月18日下午7點"},
+    "natal_figure": {"utc_dt": "2000-01-18 11:00", "lat": 25.033, "lon": 121.5654},
+    "natal_transits": {"utc_dt": "2000-01-18 11:00", "lat": 25.0531, "lon": 121.526,
+                       "start_date": "2026-01-01", "days": 365},
+    "synastry": {"utc_dt1": "2000-01-18 11:00", "lat1": 25.0531, "lon1": 121.526,
+                 "utc_dt2": "1998-07-02 03:30", "lat2": 22.6273, "lon2": 120.3014},
+}
+
+_FILLER_TOKENS = ["星", "盤", "顯", "示", "您", "的", "太", "陽", "落", "在", "摩", "羯", "座", "，", "月", "亮", "。"]
+
+
+def parse_tool_pattern(pattern: str) -> List[List[str]]:
+    """
+    Parse a tool-call pattern string.
+
+    Steps are separated by ";" and parallel calls within a step by ",".
+    e.g. "search_astrology_knowledge,natal_figure;search_astrology_knowledge" → two tool steps.
+    """
+    steps = []
+    for step in (pattern or "").split(";"):
+        names = [name.strip() for name in step.split(",") if name.strip()]
+        if names:
+            steps.append(names)
+    return steps
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """
+    Chat model that emits a scripted tool-call pattern, then streams a final answer.
+
+    Each agent step (counted as AI messages after the last human message) consumes one
+    entry of ``tool_steps``; once exhausted the model answers with ``response_tokens`` tokens.
+    Without bound tools (the router's single-completion fast path) it answers right away.
+    """
+
+    tokens_per_second: float = 200.0
+    response_tokens: int = 120
+    tool_steps: List[List[str]] = []
+    first_token_delay: float = 0.0
+    tools_bound: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming-chat"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "FakeStreamingChatModel":
+        return self.model_copy(update={"tools_bound": True})
+
+    def _step_index(self, messages: List[BaseMessage]) -> int:
+        step = 0
+        for message in reversed(messages):
+            if isinstance(message, HumanMessage):
+                break
+            if isinstance(message, AIMessage):
+                step += 1
+        return step
+
+    def _plan(self, messages: List[BaseMessage]) -> AIMessage:
+        step = self._step_index(messages)
+        if self.tools_bound and step < len(self.tool_steps):
+            tool_calls = [
+                {
+                    "name": name,
+                    "args": dict(DEFAULT_TOOL_ARGS.get(name, {})),
+                    "id": f"call_{step}_{i}_{name}",
+                    "type": "tool_call",
+                }
+                for i, name in enumerate(self.tool_steps[step])
+            ]
+            return AIMessage(content="", tool_calls=tool_calls)
+        return AIMessage(content="".join(self._answer_tokens()))
+
+    def _answer_tokens(self) -> List[str]:
+        return [_FILLER_TOKENS[i % len(_FILLER_TOKENS)] for i in range(self.response_tokens)]
+
+    @property
+    def _interval(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        message = self._plan(messages)
+        time.sleep(self.first_token_delay + self._interval * max(len(message.content), 1))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        message = self._plan(messages)
+        time.sleep(self.first_token_delay)
+        for chunk in self._chunks(message):
+            time.sleep(self._interval)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        message = self._plan(messages)
+        await asyncio.sleep(self.first_token_delay)
+        for chunk in self._chunks(message):
+            await asyncio.sleep(self._interval)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    def _chunks(self, message: AIMessage) -> Iterator[ChatGenerationChunk]:
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {"name": call["name"], "args": _json(call["args"]), "id": call["id"], "index": i, "type": "tool_call_chunk"}
+                    for i, call in enumerate(message.tool_calls)
+                ],
+            ))
+            return
+        for token in self._answer_tokens():
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+def _json(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+class FakeEmbedder:
+    """Deterministic hash-based embedder."""
+
+    def __init__(self, dimension: int = 512, latency: float = 0.0):
+        self.dimension = dimension
+        self.latency = latency
+
+    def embed(self, text: str) -> List[float]:
+        values = []
+        counter = 0
+        while len(values) < self.dimension:
+            digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+            values.extend((byte - 127.5) / 127.5 for byte in digest)
+            counter += 1
+        vector = values[:self.dimension]
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+
+class InMemoryVectorStore:
+    """
+    In-memory stand-in for PineconeClient.
+
+    Implements the subset of the PineconeClient interface used by the agent and RAG tools,
+    with optional simulated embedding and query latency. Index names and namespaces are
+    accepted for interface compatibility but all records share one collection.
+    """
+
+    def __init__(self,
+                 embedder: Optional[FakeEmbedder] = None,
+                 corpus_size: int = 200,
+                 query_latency: float = 0.0):
+        self._embedder = embedder or FakeEmbedder()
+        self.query_latency = query_latency
+        self._pinecone_available = True
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._seed(corpus_size)
+
+    def _seed(self, corpus_size: int) -> None:
+        records = []
+        for i in range(corpus_size):
+            question = f"占星知識問題 {i}"
+            answer = f"這是第 {i} 條占星知識的解答，涵蓋行星、星座與宮位的基本概念。"
+            records.append({"id": f"doc-{i}", "values": self._embedder.embed(question),
+                            "metadata": {"question": question, "answer": answer}})
+        self._upsert(records)
+
+    def _upsert(self, records: List[Dict[str, Any]]) -> None:
+        for record in records:
+            self._records[record["id"]] = record
+
+    def embedder(self, query: str) -> List[float]:
+        if self._embedder.latency:
+            time.sleep(self._embedder.latency)
+        record_embedding_usage(None, [query])
+        return self._embedder.embed(query)
+
+    async def async_embedder(self, query: str) -> List[float]:
+        if self._embedder.latency:
+            await asyncio.sleep(self._embedder.latency)
+        record_embedding_usage(None, [query])
+        return self._embedder.embed(query)
+
+    async def async_embed_batch(self, texts: List[str]) -> List[List[float]]:
+        if self._embedder.latency:
+            await asyncio.sleep(self._embedder.latency)
+        record_embedding_usage(None, texts)
+        return [self._embedder.embed(text) for text in texts]
+
+    def check_existing_ids(self, index_name: str, namespace: str, ids: List[str]) -> set:
+        return {id_ for id_ in ids if id_ in self._records}
+
+    def upsert_vectors(self, index_name: str, namespace: str, embedded_data: List[Dict]) -> None:
+        records = []
+        for data in embedded_data:
+            vector = self.embedder(data["value"]) if isinstance(data.get("value"), str) else data.get("values", [])
+            records.append({"id": data["id"], "values": vector, "metadata": data["metadata"]})
+        self._upsert(records)
+
+    def upsert_batch(self, index_name: str, namespace: str, vectors: List[Dict]) -> None:
+        self._upsert(vectors)
+
+    def delete_batch(self, index_name: str, namespace: str, ids: List[str]) -> None:
+        for id_ in ids:
+            self._records.pop(id_, None)
+
+    def _search(self, vector: List[float], top_k: int) -> List[Dict]:
+        scored = []
+        for record in self._records.values():
+            score = sum(a * b for a, b in zip(vector, record["values"]))
+            scored.append({"id": record["id"], "score": score, "metadata": record["metadata"]})
+        scored.sort(key=lambda match: match["score"], reverse=True)
+        return scored[:top_k]
+
+    def query_vectors(self, query: str, index_name: str = None, namespace: str = None,
+                      metadata_filter: dict = None, top_k: int = None,
+                      vector: Optional[List[float]] = None) -> List[Dict]:
+        if vector is None:
+            vector = self.embedder(query) if query else [0.0] * self._embedder.dimension
+        if self.query_latency:
+            time.sleep(self.query_latency)
+        return self._search(vector, top_k or 5)
+
+    async def query_vectors_async(self, query: str, index_name: str = None, namespace: str = None,
+                                  metadata_filter: dict = None, top_k: int = None,
+                                  vector: Optional[List[float]] = None) -> List[Dict]:
+        if vector is None:
+            vector = await self.async_embedder(query) if query else [0.0] * self._embedder.dimension
+        if self.query_latency:
+            await asyncio.sleep(self.query_latency)
+        return self._search(vector, top_k or 5)
+
+    @staticmethod
+    def _format(matches: List[Dict]) -> List[Dict]:
+        return [{
+            "score": match.get("score", 0.0),
+            "question": match["metadata"].get("question", ""),
+            "answer": match["metadata"].get("answer", ""),
+            "metadata": match["metadata"],
+        } for match in matches]
+
+    def search_rag_context(self, user_query: str, index_name: str = None,
+                           namespace: str = None, top_k: int = None,
+                           vector: Optional[List[float]] = None) -> List[Dict]:
+        return self._format(self.query_vectors(user_query, index_name, namespace, top_k=top_k, vector=vector))
+
+    async def search_rag_context_async(self, user_query: str, index_name: str = None,
+                                       namespace: str = None, top_k: int = None,
+                                       vector: Optional[List[float]] = None) -> List[Dict]:
+        return self._format(await self.query_vectors_async(user_query, index_name, namespace,
+                                                           top_k=top_k, vector=vector))
@@ -0,0 +1,309 @@
+"""
+Offline load test for /chat/stream.
+
+Boots quart_api.app in-process with deterministic fakes (no Azure, no Pinecone), drives N
+concurrent SSE clients and reports throughput, time-to-first-byte, inter-token latency and
+process CPU/memory. With --baseline it acts as a CI regression gate (non-zero exit on failure).
+
+Usage (from the backend directory):
+    python -m benchmarks.load_test --clients 20 --requests 5 --tool-pattern search_astrology_knowledge
+    python -m benchmarks.load_test --cassette ./cassettes --time-scale 1.0
+    python -m benchmarks.load_test --write-baseline bench_baseline.json
+    python -m benchmarks.load_test --baseline bench_baseline.json --tolerance 0.25
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# 壓測不需要真實金鑰，但客戶端建構時要求非空值
+os.environ.setdefault("AZURE_API_KEY", "offline-benchmark")
+os.environ.setdefault("EMBED_KEY", "offline-benchmark")
+os.environ.setdefault("TRACING_BACKEND", "none")
+# 重複的查詢會命中語意回應快取，壓測預設關閉（以 --response-cache 開啟）
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "false")
+# 查詢分流會讓知識問題跳過工具迴圈，壓測預設關閉（以 --router 開啟）
+os.environ.setdefault("ROUTER_ENABLED", "false")
+# token用量照常寫入SQLite（屬於請求路徑的成本），但不寫進開發環境的資料庫
+os.environ.setdefault("USAGE_DB_PATH", os.path.join(tempfile.gettempdir(), "astro_load_test_usage.sqlite3"))
+
+from benchmarks.fakes import FakeEmbedder, FakeStreamingChatModel, InMemoryVectorStore, parse_tool_pattern
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+async def build_app(args: argparse.Namespace):
+    """Create the Quart app with a fake-backed agent injected."""
+    import quart_api
+    from agents.enhanced_astro_agent import EnhancedAstroAgent
+    from agents.tools import rag_tool
+    from config import config
+
+    config.RESPONSE_CACHE_ENABLED = args.response_cache
+    config.ROUTER_ENABLED = args.router
+
+    if args.cassette:
+        return await _build_replay_app(args, quart_api, EnhancedAstroAgent, rag_tool)
+
+    store = InMemoryVectorStore(
+        embedder=FakeEmbedder(latency=args.embed_latency_ms / 1000.0),
+        corpus_size=args.corpus_size,
+        query_latency=args.query_latency_ms / 1000.0,
+    )
+    llm = FakeStreamingChatModel(
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        tool_steps=parse_tool_pattern(args.tool_pattern),
+        first_token_delay=args.first_token_delay_ms / 1000.0,
+    )
+    rag_tool._rag_tool_instance.client = store
+
+    agent = EnhancedAstroAgent(llm=llm, pinecone_client=store, enable_mcp=False)
+    await agent.initialize()
+    quart_api.agent_instance = agent
+    return quart_api.app
+
+
+async def _build_replay_app(args: argparse.Namespace, quart_api, agent_cls, rag_tool):
+    """Create the app on top of recorded cassettes instead of synthetic fakes."""
+    from agents.monitoring.cassettes import (
+        CassetteChatModel,
+        CassetteLibrary,
+        ReplayVectorClient,
+        build_replay_tools,
+    )
+    from agents.tools.natal_tool import natal_figure
+    from agents.tools.transit_tool import natal_transits
+    from agents.tools.synastry_tool import synastry
+    from agents.tools.geocode_tool import resolve_birth_data
+
+    library = CassetteLibrary.load(args.cassette)
+    store = ReplayVectorClient(library, time_scale=args.time_scale)
+    rag_tool._rag_tool_instance.client = store
+    local_tools = [t.name for t in rag_tool.get_rag_tools()] + [
+        resolve_birth_data.name, natal_figure.name, natal_transits.name, synastry.name]
+
+    agent = agent_cls(
+        llm=CassetteChatModel(library=library, time_scale=args.time_scale),
+        pinecone_client=store,
+        enable_mcp=False,
+        extra_tools=build_replay_tools(library, exclude=local_tools, time_scale=args.time_scale),
+    )
+    await agent.initialize()
+    quart_api.agent_instance = agent
+    # 重播時輪流使用錄製過的查詢
+    args.queries = library.queries
+    return quart_api.app
+
+
+async def run_client(client, client_id: int, args: argparse.Namespace, results: List[Dict[str, Any]]) -> None:
+    """One SSE client issuing requests sequentially."""
+    queries = getattr(args, "queries", None) or [args.query]
+    for i in range(args.requests):
+        body = json.dumps({
+            "query": queries[(client_id + i) % len(queries)],
+            "user_id": f"bench-{client_id}",
+            "session_id": f"bench-{client_id}-{i}",
+            "include_rag": not args.no_rag,
+            "router": args.router,
+        }).encode("utf-8")
+        result = {"ttfb": None, "ttft": None, "inter_token": [], "bytes": 0, "events": 0, "tokens": 0, "error": None}
+        started = time.perf_counter()
+        last_token_at = None
+        buffer = ""
+        try:
+            async with client.request("/chat/stream", method="POST",
+                                      headers={"Content-Type": "application/json"}) as connection:
+                await connection.send(body)
+                await connection.send_complete()
+                while True:
+                    data = await asyncio.wait_for(connection.receive(), timeout=args.timeout)
+                    if not data:
+                        break
+                    now = time.perf_counter()
+                    if result["ttfb"] is None:
+                        result["ttfb"] = now - started
+                    result["bytes"] += len(data)
+                    buffer += data.decode("utf-8")
+                    while "\n\n" in buffer:
+                        frame, buffer = buffer.split("\n\n", 1)
+                        result["events"] += 1
+                        # 可續傳串流的幀前面有 "id: <序號>" 行
+                        data_line = next((line for line in frame.split("\n") if line.startswith("data: ")), None)
+                        if data_line is None:
+                            continue
+                        payload = json.loads(data_line[6:])
+                        if payload.get("type") == "error":
+                            result["error"] = payload.get("message")
+                        if payload.get("chunk"):
+                            result["tokens"] += 1
+                            if result["ttft"] is None:
+                                result["ttft"] = now - started
+                            if last_token_at is not None:
+                                result["inter_token"].append(now - last_token_at)
+                            last_token_at = now
+                if connection.status_code != 200:
+                    result["error"] = f"HTTP {connection.status_code}"
+        except Exception as e:
+            result["error"] = repr(e)
+        result["latency"] = time.perf_counter() - started
+        results.append(result)
+
+
+async def run_load(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run the load test and return a summary report."""
+    app = await build_app(args)
+    results: List[Dict[str, Any]] = []
+
+    async with app.test_app() as test_app:
+        client = test_app.test_client()
+        # 預熱：讓工具、圖與JSON編碼路徑先跑過一次
+        await run_client(client, -1, argparse.Namespace(**{**vars(args), "requests": 1}), [])
+
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        await asyncio.gather(*(run_client(client, c, args, results) for c in range(args.clients)))
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+    ok = [r for r in results if not r["error"]]
+    ttfb = [r["ttfb"] for r in ok if r["ttfb"] is not None]
+    ttft = [r["ttft"] for r in ok if r["ttft"] is not None]
+    itl = [gap for r in ok for gap in r["inter_token"]]
+    latency = [r["latency"] for r in ok]
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ms = lambda seconds: round(seconds * 1000, 2)
+
+    return {
+        "config": {
+            "clients": args.clients,
+            "requests_per_client": args.requests,
+            "tokens_per_second": args.tokens_per_second,
+            "response_tokens": args.response_tokens,
+            "tool_pattern": args.tool_pattern,
+            "cassette": args.cassette,
+            "include_rag": not args.no_rag,
+            "router": args.router,
+        },
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_samples": [r["error"] for r in results if r["error"]][:3],
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 3) if wall else 0.0,
+        "tokens_per_second": round(sum(r["tokens"] for r in ok) / wall, 1) if wall else 0.0,
+        "events_per_request": round(statistics.mean(r["events"] for r in ok), 1) if ok else 0.0,
+        "bytes_per_request": round(statistics.mean(r["bytes"] for r in ok), 1) if ok else 0.0,
+        "ttfb_ms": {"p50": ms(percentile(ttfb, 50)), "p99": ms(percentile(ttfb, 99))},
+        "ttft_ms": {"p50": ms(percentile(ttft, 50)), "p99": ms(percentile(ttft, 99))},
+        "inter_token_ms": {"p50": ms(percentile(itl, 50)), "p99": ms(percentile(itl, 99))},
+        "latency_ms": {"p50": ms(percentile(latency, 50)), "p99": ms(percentile(latency, 99))},
+        "cpu_seconds": round(cpu, 3),
+        "cpu_utilization": round(cpu / wall, 3) if wall else 0.0,
+        "cpu_ms_per_request": ms(cpu / len(ok)) if ok else 0.0,
+        "max_rss_mb": round(max_rss_kb / 1024, 1),
+    }
+
+
+# 回歸檢查：(指標路徑, 越大越好)
+GATED_METRICS = [
+    ("throughput_rps", True),
+    ("ttfb_ms.p99", False),
+    ("inter_token_ms.p99", False),
+    ("cpu_ms_per_request", False),
+]
+
+
+def _lookup(report: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = report
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def check_regressions(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Compare a report against a baseline; return human-readable failures."""
+    failures = []
+    if report["errors"]:
+        failures.append(f"{report['errors']} request(s) failed: {report['error_samples']}")
+    for path, higher_is_better in GATED_METRICS:
+        current, reference = _lookup(report, path), _lookup(baseline, path)
+        if current is None or not reference:
+            continue
+        if higher_is_better and current < reference * (1 - tolerance):
+            failures.append(f"{path} regressed: {current} < {reference} (-{tolerance:.0%} allowed)")
+        if not higher_is_better and current > reference * (1 + tolerance):
+            failures.append(f"{path} regressed: {current} > {reference} (+{tolerance:.0%} allowed)")
+    return failures
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline /chat/stream load test")
+    parser.add_argument("--clients", type=int, default=10, help="concurrent SSE clients")
+    parser.add_argument("--requests", type=int, default=5, help="requests per client")
+    parser.add_argument("--query", default="水星逆行的影響是什麼？")
+    parser.add_argument("--no-rag", action="store_true", help="send include_rag=false")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--response-tokens", type=int, default=120)
+    parser.add_argument("--first-token-delay-ms", type=float, default=0.0)
+    parser.add_argument("--tool-pattern", default="search_astrology_knowledge",
+                        help='tool steps separated by ";" with parallel calls separated by ","')
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--query-latency-ms", type=float, default=0.0)
+    parser.add_argument("--corpus-size", type=int, default=200)
+    parser.add_argument("--response-cache", action="store_true",
+                        help="enable the semantic response cache (repeated queries become cache hits)")
+    parser.add_argument("--router", action="store_true",
+                        help="enable query routing (greetings and knowledge questions skip the tool loop)")
+    parser.add_argument("--cassette", help="replay recorded cassettes from this directory instead of fakes")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="multiplier for recorded timing in replay mode (0 = no delays)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-read timeout in seconds")
+    parser.add_argument("--json", dest="json_out", help="write the report to this file")
+    parser.add_argument("--baseline", help="baseline report to gate against")
+    parser.add_argument("--write-baseline", help="write the report as a new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run_load(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    for path in (args.json_out, args.write_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    failures = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            failures = check_regressions(report, json.load(f), args.tolerance)
+    elif report["errors"]:
+        failures = [f"{report['errors']} request(s) failed: {report['error_samples']}"]
+
+    for failure in failures:
+        print(f"❌ {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Bulk-load astrology texts into the Pinecone knowledge base.
+
+Reads .txt/.md files (chunked by paragraph, Markdown headings become the "question" metadata)
+and .jsonl files (one {"question", "answer"} record per line), then embeds and uploads them
+through IngestionPipeline. Progress is checkpointed; re-running the same command resumes.
+With --sync, a content-hash manifest limits the run to new or changed chunks and deletes
+chunks that disappeared from the sources (see ingestion/sync.py).
+
+Usage (from the backend directory):
+    python -m ingestion.ingest ./books/horoscope.txt ./faq.jsonl
+    python -m ingestion.ingest ./books --namespace books --concurrency 16
+    python -m ingestion.ingest ./books --fake   # offline dry run with the in-memory store
+    python -m ingestion.ingest ./books ./faq.jsonl --sync   # routine corpus updates
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+from config import config
+
+from ingestion.pipeline import Checkpoint, IngestionPipeline, iter_chunks
+from ingestion.sync import SyncManifest, SyncPipeline
+
+
+def build_client(args: argparse.Namespace):
+    if args.fake:
+        from benchmarks.fakes import FakeEmbedder, InMemoryVectorStore
+        return InMemoryVectorStore(embedder=FakeEmbedder(latency=args.fake_latency_ms / 1000.0), corpus_size=0)
+    from agents.client.pinecone_client import PineconeClient
+    client = PineconeClient()
+    if not client._pinecone_available:
+        raise SystemExit("❌ Pinecone未設定（PINECONE_API_KEY），無法匯入")
+    return client
+
+
+def default_state_path(index_name: str, namespace: str, suffix: str) -> str:
+    return str(Path(config.INGEST_STATE_PATH) / f"{index_name}__{namespace}.{suffix}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Bulk-load texts into the Pinecone knowledge base")
+    parser.add_argument("paths", nargs="+", help="source files or directories (.txt, .md, .jsonl)")
+    parser.add_argument("--index", default=config.PINECONE_INDEX_NAME)
+    parser.add_argument("--namespace", default=config.PINECONE_NAMESPACE)
+    parser.add_argument("--chunk-chars", type=int, default=config.INGEST_CHUNK_CHARS)
+    parser.add_argument("--overlap", type=int, default=config.INGEST_CHUNK_OVERLAP)
+    parser.add_argument("--source-root", help="directory chunk IDs are keyed relative to (default: current directory)")
+    parser.add_argument("--embed-batch", type=int, default=config.INGEST_EMBED_BATCH_SIZE,
+                        help="texts per embedding request")
+    parser.add_argument("--upsert-batch", type=int, default=config.INGEST_UPSERT_BATCH_SIZE,
+                        help="maximum vectors per upsert request")
+    parser.add_argument("--max-bytes", type=int, default=config.INGEST_MAX_REQUEST_BYTES,
+                        help="maximum estimated upsert request size")
+    parser.add_argument("--concurrency", type=int, default=config.INGEST_MAX_CONCURRENCY,
+                        help="maximum concurrent requests per service (adapted on 429)")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: INGEST_STATE_PATH/<index>__<namespace>.checkpoint.jsonl)")
+    parser.add_argument("--restart", action="store_true", help="ignore and replace an existing checkpoint")
+    parser.add_argument("--sync", action="store_true",
+                        help="incremental sync: the sources are the whole corpus, upload only changes")
+    parser.add_argument("--manifest", help="sync manifest (default: INGEST_STATE_PATH/<index>__<namespace>.manifest.json)")
+    parser.add_argument("--no-delete", action="store_true", help="with --sync, keep chunks missing from the sources")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="seconds between progress lines")
+    parser.add_argument("--fake", action="store_true", help="use the offline in-memory store (no Azure, no Pinecone)")
+    parser.add_argument("--fake-latency-ms", type=float, default=0.0, help="simulated embedding latency with --fake")
+    parser.add_argument("--json", dest="json_out", help="write the report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    options = dict(
+        embed_batch_size=args.embed_batch,
+        upsert_batch_size=args.upsert_batch,
+        max_request_bytes=args.max_bytes,
+        max_concurrency=args.concurrency,
+        report_interval=args.report_interval,
+    )
+
+    if args.sync:
+        manifest = SyncManifest(args.manifest or default_state_path(args.index, args.namespace, "manifest.json"))
+        print(f"🔄 增量同步：清單中有 {len(manifest.entries)} 筆（{manifest.path}）")
+        pipeline = SyncPipeline(build_client(args), args.index, args.namespace, manifest,
+                                delete_orphans=not args.no_delete, **options)
+    else:
+        checkpoint_path = args.checkpoint or default_state_path(args.index, args.namespace, "checkpoint.jsonl")
+        if args.restart and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        checkpoint = Checkpoint(checkpoint_path)
+        if checkpoint.done:
+            print(f"↩️ 從檢查點續傳：已完成 {len(checkpoint.done)} 筆（{checkpoint_path}）")
+        pipeline = IngestionPipeline(build_client(args), args.index, args.namespace,
+                                     checkpoint=checkpoint, **options)
+
+    report = asyncio.run(pipeline.run(iter_chunks(args.paths, args.chunk_chars, args.overlap, args.source_root)))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
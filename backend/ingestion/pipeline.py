@@ -0,0 +1,449 @@
+"""
+Streaming ingestion pipeline for the astrology knowledge base.
+
+Source documents are read lazily, split into chunks and pushed through bounded queues:
+
+- embedding: chunks are embedded in batched requests (one request per INGEST_EMBED_BATCH_SIZE texts)
+- upsert: vectors are uploaded in batches bounded by vector count and estimated request size
+- concurrency: embedding and upsert requests each have an AIMD limiter that halves on 429
+  responses (honouring Retry-After) and grows by one after a window of successes
+- checkpoints: IDs of uploaded chunks are appended to a JSONL file, so an interrupted run
+  resumes where it stopped
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Set
+
+from agents.client.pinecone_client import iter_upsert_batches
+
+
+SOURCE_SUFFIXES = {".txt", ".md", ".jsonl"}
+
+_SENTENCE_END = re.compile(r"(?<=[。！？!?；;])|(?<=\.)\s")
+_HEADING = re.compile(r"^#{1,6}\s+(.+)$")
+# 段落錨點：雜湊值符合的段落之後一定切開（平均每3段一個），修改內容只影響所在的段落群組
+_ANCHOR_EVERY = 3
+
+
+@dataclass
+class Chunk:
+    id: str
+    text: str
+    metadata: Dict[str, Any]
+
+
+def _split_long(paragraph: str, max_chars: int) -> List[str]:
+    """Split an oversized paragraph on sentence boundaries, hard-cutting sentences that are still too long."""
+    pieces, current = [], ""
+    for sentence in filter(None, _SENTENCE_END.split(paragraph)):
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if len(current) + len(sentence) > max_chars:
+            pieces.append(current)
+            current = ""
+        current += sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _is_anchor(paragraph: str) -> bool:
+    return hashlib.sha1(paragraph.encode("utf-8")).digest()[0] % _ANCHOR_EVERY == 0
+
+
+def chunk_text(text: str, max_chars: int = 800, overlap: int = 100) -> List[str]:
+    """
+    Pack paragraphs into chunks of at most ``max_chars`` characters.
+
+    Boundaries are anchored to content: a chunk always ends after an anchor paragraph (picked
+    by its hash), and paragraphs between anchors are packed greedily. Editing a paragraph
+    therefore only re-cuts its own group instead of shifting every later boundary.
+    Each chunk after the first starts with up to ``overlap`` trailing characters of the previous
+    one so that sentences cut at a boundary keep their context; the overlap is trimmed so that
+    it never pushes a chunk past ``max_chars``.
+    """
+    paragraphs = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if paragraph:
+            paragraphs.extend(_split_long(paragraph, max_chars) if len(paragraph) > max_chars else [paragraph])
+
+    chunks, current, fresh = [], "", False
+    for paragraph in paragraphs:
+        if fresh and len(current) + len(paragraph) + 1 > max_chars:
+            chunks.append(current)
+            current, fresh = current[-overlap:] if overlap > 0 else "", False
+        if not fresh and current and len(current) + len(paragraph) + 1 > max_chars:
+            # 只剩重疊文字時縮短重疊，讓重疊加上段落仍在上限內
+            room = max_chars - len(paragraph) - 1
+            current = current[-room:] if room > 0 else ""
+        current = f"{current}\n{paragraph}" if current else paragraph
+        fresh = True
+        if _is_anchor(paragraph):
+            chunks.append(current)
+            current, fresh = current[-overlap:] if overlap > 0 else "", False
+    if fresh:
+        chunks.append(current)
+    return chunks
+
+
+def source_name(path: Path, root: Path) -> str:
+    """Normalized POSIX path of a source relative to the source root (absolute when outside it)."""
+    resolved = path.resolve()
+    try:
+        return resolved.relative_to(root.resolve()).as_posix()
+    except ValueError:
+        return resolved.as_posix()
+
+
+def _source_key(name: str) -> str:
+    # Pinecone IDs must be ASCII; file names may be Chinese
+    return hashlib.sha1(name.encode("utf-8")).hexdigest()[:10]
+
+
+def _content_id(key: str, text: str, seen: Dict[str, int]) -> str:
+    """
+    Chunk ID from the source key and the chunk's own text, so unchanged chunks keep their IDs
+    when earlier parts of the file change; repeated texts within one source get a suffix.
+    """
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+    count = seen.get(digest, 0)
+    seen[digest] = count + 1
+    return f"{key}-{digest}" if count == 0 else f"{key}-{digest}-{count}"
+
+
+def iter_source_paths(paths: Iterable[str]) -> Iterator[Path]:
+    """Expand files and directories (recursively) into supported source files, in stable order."""
+    for raw in paths:
+        path = Path(raw)
+        if path.is_dir():
+            yield from sorted(p for p in path.rglob("*") if p.suffix.lower() in SOURCE_SUFFIXES)
+        elif path.suffix.lower() in SOURCE_SUFFIXES:
+            yield path
+        else:
+            print(f"⚠️ 略過不支援的來源: {path}")
+
+
+def _iter_jsonl_chunks(path: Path, key: str) -> Iterator[Chunk]:
+    """One chunk per JSONL record with "question" and "answer" (optional "id" and "metadata")."""
+    seen: Dict[str, int] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            question, answer = record.get("question", ""), record.get("answer", "")
+            metadata = {**record.get("metadata", {}), "question": question, "answer": answer, "source": path.name}
+            text = f"{question}\n{answer}".strip()
+            yield Chunk(str(record.get("id") or _content_id(key, text, seen)), text, metadata)
+
+
+def _iter_text_chunks(path: Path, key: str, max_chars: int, overlap: int) -> Iterator[Chunk]:
+    """Chunks of a plain text or Markdown file; the nearest heading becomes the "question" metadata."""
+    sections, heading, lines = [], path.stem, []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            match = _HEADING.match(line.strip())
+            if match:
+                sections.append((heading, "".join(lines)))
+                heading, lines = match.group(1).strip(), []
+            else:
+                lines.append(line)
+    sections.append((heading, "".join(lines)))
+
+    seen: Dict[str, int] = {}
+    for heading, body in sections:
+        for text in chunk_text(body, max_chars, overlap):
+            # 不含切塊序號：序號會隨前段內容變動，使同步把未修改的切塊也視為變更
+            metadata = {"question": heading, "answer": text, "source": path.name}
+            yield Chunk(_content_id(key, f"{heading}\n{text}", seen), f"{heading}\n{text}", metadata)
+
+
+def iter_chunks(paths: Iterable[str], max_chars: int = 800, overlap: int = 100,
+                source_root: Optional[str] = None) -> Iterator[Chunk]:
+    """
+    Stream chunks from all source files without loading the whole corpus.
+
+    Chunk IDs are keyed by each file's path relative to ``source_root`` (default: the current
+    directory), so "./books/a.md", "books//a.md" and its absolute path map to the same IDs.
+    """
+    root = Path(source_root) if source_root else Path.cwd()
+    for path in iter_source_paths(paths):
+        key = _source_key(source_name(path, root))
+        if path.suffix.lower() == ".jsonl":
+            yield from _iter_jsonl_chunks(path, key)
+        else:
+            yield from _iter_text_chunks(path, key, max_chars, overlap)
+
+
+class Checkpoint:
+    """Append-only JSONL log of uploaded chunk IDs (one line per upsert batch)."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = Path(path) if path else None
+        self.done: Set[str] = set()
+        if self.path is not None and self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self.done.update(json.loads(line)["ids"])
+                    except (json.JSONDecodeError, KeyError):
+                        # 中斷時寫到一半的最後一行
+                        continue
+
+    def record(self, ids: List[str]) -> None:
+        self.done.update(ids)
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"ids": ids, "t": round(time.time(), 3)}) + "\n")
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """Whether an embedding or Pinecone error is an HTTP 429."""
+    for attr in ("status_code", "status", "code"):
+        if getattr(error, attr, None) == 429:
+            return True
+    return "429" in str(error) or "rate limit" in str(error).lower()
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Retry-After header value in seconds, if the error carries a response."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or getattr(error, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one upstream service.
+
+    The limit grows by one after ``limit`` consecutive successes and halves on a rate-limit
+    response; all callers also pause until the Retry-After delay has passed.
+    """
+
+    def __init__(self, name: str, initial: int, maximum: int, minimum: int = 1):
+        self.name = name
+        self.limit = max(minimum, min(initial, maximum))
+        self.maximum = maximum
+        self.minimum = minimum
+        self.throttled = 0
+        self._active = 0
+        self._successes = 0
+        self._resume_at = 0.0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+        try:
+            delay = self._resume_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield
+        finally:
+            async with self._condition:
+                self._active -= 1
+                self._condition.notify_all()
+
+    def success(self) -> None:
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.maximum:
+            self.limit += 1
+            self._successes = 0
+
+    def rate_limited(self, delay: float) -> bool:
+        """Back off after a 429; returns False when already backing off from the same burst."""
+        self.throttled += 1
+        self._successes = 0
+        now = time.monotonic()
+        backing_off = now < self._resume_at
+        self._resume_at = max(self._resume_at, now + delay)
+        if backing_off:
+            # 同一波限流中的其他請求不再重複減半
+            return False
+        self.limit = max(self.minimum, self.limit // 2)
+        return True
+
+
+@dataclass
+class IngestionStats:
+    started: float = field(default_factory=time.perf_counter)
+    chunks_read: int = 0
+    skipped: int = 0
+    embedded: int = 0
+    upserted: int = 0
+    embed_requests: int = 0
+    upsert_requests: int = 0
+    retries: int = 0
+    failed: int = 0
+    deleted: int = 0
+    errors: List[str] = field(default_factory=list)
+
+    def snapshot(self, embed_limiter: AdaptiveLimiter, upsert_limiter: AdaptiveLimiter) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "chunks_read": self.chunks_read,
+            "skipped": self.skipped,
+            "embedded": self.embedded,
+            "upserted": self.upserted,
+            "failed": self.failed,
+            "deleted": self.deleted,
+            "chunks_per_second": round(self.upserted / elapsed, 1) if elapsed > 0 else 0.0,
+            "embed_requests": self.embed_requests,
+            "upsert_requests": self.upsert_requests,
+            "retries": self.retries,
+            "rate_limited": {"embed": embed_limiter.throttled, "upsert": upsert_limiter.throttled},
+            "concurrency": {"embed": embed_limiter.limit, "upsert": upsert_limiter.limit},
+            "error_samples": self.errors[:5],
+        }
+
+
+class IngestionPipeline:
+    """
+    Embed and upsert a stream of chunks into a Pinecone index.
+
+    ``client`` needs ``async_embed_batch(texts)`` and ``upsert_batch(index_name, namespace, vectors)``
+    (PineconeClient, or InMemoryVectorStore for offline runs).
+    """
+
+    def __init__(self,
+                 client,
+                 index_name: str,
+                 namespace: str,
+                 checkpoint: Optional[Checkpoint] = None,
+                 embed_batch_size: int = 96,
+                 upsert_batch_size: int = 100,
+                 max_request_bytes: int = 2 * 1024 * 1024,
+                 max_concurrency: int = 8,
+                 max_retries: int = 6,
+                 report_interval: float = 10.0):
+        self.client = client
+        self.index_name = index_name
+        self.namespace = namespace
+        self.checkpoint = checkpoint or Checkpoint(None)
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.upsert_batch_size = max(1, upsert_batch_size)
+        self.max_request_bytes = max_request_bytes
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.report_interval = report_interval
+        self.embed_limiter = AdaptiveLimiter("embed", max(1, self.max_concurrency // 2), self.max_concurrency)
+        self.upsert_limiter = AdaptiveLimiter("upsert", max(1, self.max_concurrency // 2), self.max_concurrency)
+        self.stats = IngestionStats()
+
+    async def _call(self, limiter: AdaptiveLimiter, fn, *args):
+        """Run one upstream request under the limiter, retrying rate limits and transient errors with backoff."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with limiter.slot():
+                    result = await fn(*args)
+                limiter.success()
+                return result
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                self.stats.retries += 1
+                delay = min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+                if is_rate_limited(e):
+                    if limiter.rate_limited(retry_after(e) or delay):
+                        print(f"⏳ {limiter.name} 限流，並行數降為 {limiter.limit}")
+                else:
+                    await asyncio.sleep(delay)
+
+    async def _embed(self, chunks: List[Chunk]) -> List[Dict[str, Any]]:
+        embeddings = await self._call(self.embed_limiter, self.client.async_embed_batch,
+                                      [chunk.text for chunk in chunks])
+        self.stats.embed_requests += 1
+        self.stats.embedded += len(chunks)
+        return [{"id": chunk.id, "values": values, "metadata": chunk.metadata}
+                for chunk, values in zip(chunks, embeddings)]
+
+    async def _upsert(self, vectors: List[Dict[str, Any]]) -> None:
+        # Pinecone客戶端是同步的，在執行緒中上傳
+        await self._call(self.upsert_limiter, asyncio.to_thread, self.client.upsert_batch,
+                         self.index_name, self.namespace, vectors)
+        self.stats.upsert_requests += 1
+        self.stats.upserted += len(vectors)
+
+    async def _process(self, chunks: List[Chunk]) -> None:
+        try:
+            vectors = await self._embed(chunks)
+            for batch in iter_upsert_batches(vectors, self.upsert_batch_size, self.max_request_bytes):
+                await self._upsert(batch)
+                self.uploaded(batch)
+        except Exception as e:
+            self.stats.failed += len(chunks)
+            self.stats.errors.append(f"{type(e).__name__}: {e}")
+            print(f"❌ 批次匯入失敗（{len(chunks)} 筆，下次執行時重試）: {e}")
+
+    def uploaded(self, vectors: List[Dict[str, Any]]) -> None:
+        """Record a successfully uploaded batch."""
+        self.checkpoint.record([vector["id"] for vector in vectors])
+
+    def pending(self, chunk: Chunk) -> bool:
+        """Whether a chunk still needs to be embedded and uploaded."""
+        return chunk.id not in self.checkpoint.done
+
+    async def _produce(self, chunks: Iterable[Chunk], queue: asyncio.Queue) -> None:
+        batch = []
+        for chunk in chunks:
+            self.stats.chunks_read += 1
+            if not self.pending(chunk):
+                self.stats.skipped += 1
+                continue
+            batch.append(chunk)
+            if len(batch) >= self.embed_batch_size:
+                await queue.put(batch)
+                batch = []
+        if batch:
+            await queue.put(batch)
+        for _ in range(self.max_concurrency):
+            await queue.put(None)
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            await self._process(batch)
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(self.report_interval)
+            report = self.stats.snapshot(self.embed_limiter, self.upsert_limiter)
+            print(f"📥 已上傳 {report['upserted']} 筆（{report['chunks_per_second']}/s），"
+                  f"略過 {report['skipped']}，失敗 {report['failed']}，"
+                  f"並行 embed={report['concurrency']['embed']} upsert={report['concurrency']['upsert']}")
+
+    async def run(self, chunks: Iterable[Chunk]) -> Dict[str, Any]:
+        """Ingest all chunks and return the throughput report."""
+        # 佇列有上限：讀取來源的速度受嵌入與上傳的速度牽制
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_concurrency * 2)
+        reporter = asyncio.create_task(self._report())
+        try:
+            workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.max_concurrency)]
+            await asyncio.gather(self._produce(chunks, queue), *workers)
+        finally:
+            reporter.cancel()
+        return self.stats.snapshot(self.embed_limiter, self.upsert_limiter)
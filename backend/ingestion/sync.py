@@ -0,0 +1,132 @@
+"""
+Incremental knowledge-base sync driven by a local content-hash manifest.
+
+The manifest maps chunk ID → content hash, embedding model and dimension for one
+index/namespace. A sync run treats the given sources as the complete corpus:
+
+- chunks whose hash, model and dimension match the manifest are skipped (no embedding cost)
+- new or changed chunks are embedded and upserted through IngestionPipeline
+- manifest IDs that no longer appear in the sources are deleted from the index in batches
+
+Changing EMBEDDING_MODEL or EMBEDDING_DIMENSION invalidates every entry, so the next sync
+re-embeds the whole corpus.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from agents.client.pinecone_client import EMBEDDING_DIMENSION, EMBEDDING_MODEL
+from ingestion.pipeline import Chunk, IngestionPipeline
+
+
+# Pinecone的delete每次最多1000個ID
+DELETE_BATCH_SIZE = 1000
+
+
+def content_hash(chunk: Chunk) -> str:
+    """Hash of everything that ends up in the index for a chunk (embedded text and metadata)."""
+    payload = json.dumps({"text": chunk.text, "metadata": chunk.metadata}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+class SyncManifest:
+    """Chunk ID → {"hash", "model", "dim", "source"} saved as one JSON file."""
+
+    def __init__(self, path: str, model: str = EMBEDDING_MODEL, dimension: int = EMBEDDING_DIMENSION):
+        self.path = Path(path)
+        self.model = model
+        self.dimension = dimension
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("chunks", {})
+
+    def unchanged(self, chunk_id: str, digest: str) -> bool:
+        entry = self.entries.get(chunk_id)
+        return (entry is not None and entry["hash"] == digest
+                and entry.get("model") == self.model and entry.get("dim") == self.dimension)
+
+    def set(self, chunk_id: str, digest: str, source: str) -> None:
+        self.entries[chunk_id] = {"hash": digest, "model": self.model, "dim": self.dimension, "source": source}
+
+    def remove(self, chunk_ids: Iterable[str]) -> None:
+        for chunk_id in chunk_ids:
+            self.entries.pop(chunk_id, None)
+
+    def save(self) -> None:
+        """Write atomically so an interrupted run never leaves a truncated manifest."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"v": 1, "updated": round(time.time(), 3), "chunks": self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+class SyncPipeline(IngestionPipeline):
+    """IngestionPipeline that only uploads new or changed chunks and deletes orphaned ones."""
+
+    def __init__(self, client, index_name: str, namespace: str, manifest: SyncManifest,
+                 delete_orphans: bool = True, save_interval: float = 5.0, **kwargs):
+        super().__init__(client, index_name, namespace, **kwargs)
+        self.manifest = manifest
+        self.delete_orphans = delete_orphans
+        self.save_interval = save_interval
+        self._seen: Set[str] = set()
+        self._pending: Dict[str, Tuple[str, str]] = {}
+        self._saved_at = time.monotonic()
+
+    def pending(self, chunk: Chunk) -> bool:
+        self._seen.add(chunk.id)
+        digest = content_hash(chunk)
+        if self.manifest.unchanged(chunk.id, digest):
+            return False
+        self._pending[chunk.id] = (digest, str(chunk.metadata.get("source", "")))
+        return True
+
+    def uploaded(self, vectors: List[Dict[str, Any]]) -> None:
+        for vector in vectors:
+            entry = self._pending.pop(vector["id"], None)
+            if entry is not None:
+                self.manifest.set(vector["id"], *entry)
+        # 定期寫入，中斷後重跑只需處理尚未記錄的批次
+        if time.monotonic() - self._saved_at > self.save_interval:
+            self.manifest.save()
+            self._saved_at = time.monotonic()
+
+    def orphans(self) -> List[str]:
+        return sorted(set(self.manifest.entries) - self._seen)
+
+    async def _delete(self, ids: List[str]) -> None:
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            batch = ids[start:start + DELETE_BATCH_SIZE]
+            try:
+                await self._call(self.upsert_limiter, asyncio.to_thread, self.client.delete_batch,
+                                 self.index_name, self.namespace, batch)
+            except Exception as e:
+                self.stats.errors.append(f"{type(e).__name__}: {e}")
+                print(f"❌ 刪除失敗（{len(batch)} 筆，下次同步時重試）: {e}")
+                continue
+            self.manifest.remove(batch)
+            self.stats.deleted += len(batch)
+
+    async def run(self, chunks: Iterable[Chunk]) -> Dict[str, Any]:
+        try:
+            report = await super().run(chunks)
+            orphans = self.orphans()
+            if orphans and not self._seen:
+                # 來源路徑寫錯時不應清空整個索引
+                print(f"⚠️ 沒有讀到任何來源切塊，略過刪除 {len(orphans)} 筆")
+            elif orphans and self.delete_orphans:
+                print(f"🧹 刪除已不存在的切塊 {len(orphans)} 筆")
+                await self._delete(orphans)
+                report = self.stats.snapshot(self.embed_limiter, self.upsert_limiter)
+            report["orphans"] = len(orphans)
+            report["manifest_size"] = len(self.manifest.entries)
+            return report
+        finally:
+            self.manifest.save()
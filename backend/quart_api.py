@@ -4,6 +4,7 @@ Quart API - 簡化版占星助手 API
 """
 
 import asyncio
+import hmac
 import json
 import time
 import traceback
@@ -14,13 +15,38 @@ from typing import Dict, List, Optional, Any
 
 # Add current directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-from quart import Quart, request, Response
+from quart import Quart, request, Response, websocket
 from quart_cors import cors
 import uvicorn
 
 # Local imports
 from agents.enhanced_astro_agent import get_enhanced_agent, initialize_agent
+from agents.monitoring.metrics import (
+    ACTIVE_STREAMS,
+    REQUEST_LATENCY,
+    SSE_BYTES,
+    SSE_FRAMES,
+    SSE_STREAM_BYTES,
+    WS_CONNECTIONS,
+    WS_CONTROL_DROPPED,
+    WS_MESSAGES,
+    WS_SEND_WAIT,
+    render_metrics,
+    start_server_timing,
+)
+from agents.monitoring.tracing import get_tracing_backend
+from agents.monitoring.profiler import get_profiler_manager
+from agents.monitoring.loop_monitor import get_loop_monitor
+from agents.monitoring.usage import get_usage_store
+from agents.job_queue import JobQueueFull, get_job_queue
+from agents.response_cache import get_response_cache
+from agents.resumable_stream import STREAM_RESUMES, get_stream_registry, parse_last_event_id
+from agents.tools.chart_assets import etag_matches, get_chart_asset_store
+from agents.tools.chart_summary import get_chart_store
+from agents.tools.synastry_tool import score_candidates
+from config import config
 
 
 # Global variables
@@ -28,7 +54,7 @@ agent_instance = None
 app = Quart(__name__)
 
 # Add CORS support
-app = cors(app, allow_origin="*")
+app = cors(app, allow_origin="*", expose_headers=["Server-Timing", "X-Profile-Id", "X-Profile-Status", "Location"])
 
 
 @app.before_serving
@@ -37,12 +63,37 @@ async def startup():
     global agent_instance
     print("🚀 正在啟動Quart API服務...")
     
+    if config.LOOP_MONITOR_ENABLED:
+        get_loop_monitor().start()
+        print("✅ 事件迴圈延遲監控已啟動")
+    
+    if agent_instance is not None:
+        # 已預先注入Agent（例如壓測工具），不重新初始化
+        print("✅ 使用預先注入的Agent")
+        _start_job_workers()
+        return
+    
     try:
         agent_instance = await initialize_agent()
         print("✅ Enhanced Astro Agent 初始化成功")
     except Exception as e:
         print(f"❌ Agent初始化失敗: {e}")
         agent_instance = None
+    _start_job_workers()
+
+
+def _start_job_workers():
+    """Agent可用時啟動背景工作的worker"""
+    if agent_instance is not None:
+        get_job_queue().start(_agent_events, _summarize_events)
+        print(f"✅ 背景工作worker已啟動 ({config.JOB_WORKERS} 個)")
+
+
+@app.after_serving
+async def shutdown():
+    """服務關閉時清理背景監控與背景工作"""
+    await get_job_queue().stop()
+    await get_loop_monitor().stop()
 
 
 @app.route("/health", methods=["GET"])
@@ -73,10 +124,15 @@ async def get_agent_status():
     try:
         agent_info = agent_instance.get_agent_info()
         status = "ready" if agent_info.get("agent_initialized", False) else "initializing"
-        
+        # 有依賴的斷路器開啟時仍可回答，但RAG或MCP工具以備援執行
+        if status == "ready" and any(breaker["state"] != "closed" and breaker["state"] != "disabled"
+                                     for breaker in agent_info.get("circuit_breakers", {}).values()):
+            status = "degraded"
+
         return {
             "status": status,
             "agent_info": agent_info,
+            "jobs": get_job_queue().info(),
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -87,9 +143,254 @@ async def get_agent_status():
         }
 
 
+@app.route("/charts/<chart_id>/data", methods=["GET"])
+async def get_chart_data(chart_id: str):
+    """獲取natal_figure產生的完整星盤資料（行星、宮位、相位與容許度）"""
+    chart = get_chart_store().get(chart_id)
+    if chart is None:
+        return {"error": "找不到星盤資料"}, 404
+    return chart
+
+
+@app.route("/charts/<filename>", methods=["GET"])
+async def get_chart_image(filename: str):
+    """提供以內容雜湊命名的星盤SVG（強ETag、immutable快取、預壓縮版本）"""
+    asset = get_chart_asset_store().resolve(filename, request.headers.get("Accept-Encoding", ""))
+    if asset is None:
+        return {"error": "找不到星盤圖片"}, 404
+    
+    path, encoding, etag = asset
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Vary": "Accept-Encoding",
+    }
+    if etag_matches(request.headers.get("If-None-Match", ""), etag):
+        return Response(b"", status=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    body = await asyncio.to_thread(path.read_bytes)
+    return Response(body, mimetype="image/svg+xml", headers=headers)
+
+
+@app.route("/synastry/score", methods=["POST"])
+async def synastry_score():
+    """一對多合盤評分（base 對 candidates 中的每張星盤，回傳分數最高的 top_k 筆）"""
+    data = await request.get_json()
+    if not isinstance(data, dict) or not data.get("base") or not isinstance(data.get("candidates"), list):
+        return {"error": "需要 base 與 candidates"}, 400
+    if not isinstance(data["base"], dict):
+        return {"error": "base 必須是星盤物件"}, 400
+    
+    candidates = data["candidates"]
+    if len(candidates) > config.SYNASTRY_MAX_CANDIDATES:
+        return {"error": f"candidates 最多 {config.SYNASTRY_MAX_CANDIDATES} 筆"}, 400
+    invalid = [index for index, candidate in enumerate(candidates) if not isinstance(candidate, dict)]
+    if invalid:
+        return {"error": "candidates 必須是星盤物件的陣列", "invalid_indexes": invalid[:20]}, 400
+    
+    try:
+        top_k = int(data.get("top_k", 50))
+        result = await asyncio.to_thread(score_candidates, data["base"], candidates, top_k)
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        return {"error": f"base 星盤無效：{e}"}, 400
+    return result
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    """Prometheus 指標端點"""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+def _debug_disabled():
+    """除錯端點關閉時返回404回應、設定DEBUG_TOKEN但標頭不符時返回403回應，否則返回None"""
+    if not config.DEBUG_ENDPOINTS_ENABLED:
+        return {"error": "除錯端點未啟用"}, 404
+    if config.DEBUG_TOKEN and not hmac.compare_digest(request.headers.get("X-Debug-Token", "").encode(),
+                                                      config.DEBUG_TOKEN.encode()):
+        return {"error": "除錯端點需要有效的 X-Debug-Token"}, 403
+    return None
+
+
+@app.route("/debug/traces", methods=["GET"])
+async def list_traces():
+    """列出最近的追蹤紀錄（最新在前）"""
+    if disabled := _debug_disabled():
+        return disabled
+    
+    backend = get_tracing_backend()
+    store = getattr(backend, "store", None)
+    if store is None:
+        return {"tracing": backend.info(), "traces": []}
+    
+    limit = request.args.get("limit", default=50, type=int)
+    min_duration_ms = request.args.get("min_duration_ms", default=0.0, type=float)
+    return {
+        "tracing": backend.info(),
+        "traces": store.list(limit=limit, min_duration_ms=min_duration_ms)
+    }
+
+
+@app.route("/debug/traces/<trace_id>", methods=["GET"])
+async def get_trace(trace_id: str):
+    """獲取單一追蹤的完整span時間軸"""
+    if disabled := _debug_disabled():
+        return disabled
+    
+    store = getattr(get_tracing_backend(), "store", None)
+    trace = store.get(trace_id) if store is not None else None
+    if trace is None:
+        return {"error": "找不到追蹤紀錄"}, 404
+    return trace
+
+
+@app.route("/debug/profiles/<profile_id>", methods=["GET"])
+async def get_profile(profile_id: str):
+    """獲取單次請求的剖析結果（?format=folded 取得火焰圖格式）"""
+    if disabled := _debug_disabled():
+        return disabled
+    
+    fmt = request.args.get("format", "json")
+    content = get_profiler_manager().load(profile_id, fmt)
+    if content is None:
+        return {"error": "找不到剖析紀錄"}, 404
+    mimetype = "text/plain" if fmt == "folded" else "application/json"
+    return Response(content, mimetype=mimetype)
+
+
+@app.route("/debug/loop", methods=["GET"])
+async def loop_status():
+    """事件迴圈延遲統計與阻塞來源排行"""
+    if disabled := _debug_disabled():
+        return disabled
+    return get_loop_monitor().snapshot()
+
+
+@app.route("/debug/response-cache", methods=["GET"])
+async def response_cache_status():
+    """語意回應快取狀態與最近使用的項目"""
+    if disabled := _debug_disabled():
+        return disabled
+    cache = get_response_cache()
+    limit = request.args.get("limit", default=50, type=int)
+    return {"cache": cache.info(), "entries": cache.list(limit=limit)}
+
+
+@app.route("/debug/response-cache", methods=["DELETE"])
+async def invalidate_response_cache():
+    """清空語意回應快取（例如知識庫更新後）"""
+    if disabled := _debug_disabled():
+        return disabled
+    return {"invalidated": get_response_cache().invalidate()}
+
+
+@app.route("/debug/usage", methods=["GET"])
+async def usage_report():
+    """token用量排行（?group_by=user|session|query|request&since_hours=24&limit=20）"""
+    if disabled := _debug_disabled():
+        return disabled
+    if not config.USAGE_STORE_ENABLED:
+        return {"error": "token用量資料庫未啟用"}, 404
+    
+    group_by = request.args.get("group_by", "user")
+    since_hours = request.args.get("since_hours", default=24.0, type=float)
+    limit = request.args.get("limit", default=20, type=int)
+    try:
+        rows = await asyncio.to_thread(get_usage_store().top, group_by, since_hours * 3600, limit)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return {"group_by": group_by, "since_hours": since_hours, "usage": rows}
+
+
+def _reserve_profile(endpoint: str):
+    """
+    依請求標頭/參數決定是否剖析
+    
+    Returns:
+        tuple: (RequestProfile或None, 要附加的回應標頭)
+    """
+    manager = get_profiler_manager()
+    if not manager.requested(request.headers, request.args):
+        return None, {}
+    profile = manager.reserve(endpoint)
+    if profile is None:
+        return None, {"X-Profile-Status": "busy"}
+    return profile, {"X-Profile-Id": profile.profile_id, "X-Profile-Status": "profiled"}
+
+
+async def _metered_sse(events, endpoint: str):
+    """統計SSE串流的位元組數、幀數與活躍串流數"""
+    started = time.perf_counter()
+    total_bytes = 0
+    ACTIVE_STREAMS.inc(endpoint=endpoint)
+    try:
+        async for frame in events:
+            size = len(frame.encode("utf-8"))
+            total_bytes += size
+            SSE_BYTES.inc(size, endpoint=endpoint)
+            SSE_FRAMES.inc(endpoint=endpoint)
+            yield frame
+    finally:
+        ACTIVE_STREAMS.dec(endpoint=endpoint)
+        SSE_STREAM_BYTES.observe(total_bytes, endpoint=endpoint)
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+
+
+async def _agent_events(query: str, include_rag: bool, session_id: Optional[str], user_id: Optional[str]):
+    """Agent事件管線（SSE與WebSocket共用）：轉發astream的SSE幀，未預期的錯誤轉為error幀"""
+    try:
+        async for frame in agent_instance.astream(query, include_rag=include_rag,
+                                                  session_id=session_id, user_id=user_id):
+            yield frame
+    except Exception as e:
+        print(f"❌ 流式聊天處理失敗: {e}")
+        print(traceback.format_exc())
+        yield f"data: {json.dumps({'type': 'error', 'message': f'生成回應時發生錯誤: {str(e)}'}, ensure_ascii=False)}\n\n"
+
+
+async def _chat_events(query: str, include_rag: bool, session_id: Optional[str], user_id: Optional[str],
+                       resume_from=None):
+    """
+    SSE串流的事件來源：啟用續傳時Agent在背景執行並寫入重播緩衝區，連線只訂閱緩衝區；
+    resume_from為(ResumableStream, 最後收到的序號)時從該串流接續，不重新執行Agent
+    """
+    if resume_from is not None:
+        stream, after = resume_from
+        print(f"🔁 串流 {stream.stream_id} 從事件 {after} 之後接續")
+        async for frame in stream.subscribe(after):
+            yield frame
+        return
+    if not config.STREAM_RESUME_ENABLED:
+        async for frame in _agent_events(query, include_rag, session_id, user_id):
+            yield frame
+        return
+    stream = get_stream_registry().start(_agent_events(query, include_rag, session_id, user_id))
+    async for frame in stream.subscribe():
+        yield frame
+
+
+def _resume_target(stream_id: Optional[str], last_event_id: Any):
+    """找出可接續的串流，返回(ResumableStream, 最後收到的序號)；沒有帶入stream_id時返回None，已過期時返回False"""
+    if not stream_id or not config.STREAM_RESUME_ENABLED:
+        return None
+    after = parse_last_event_id(last_event_id)
+    stream = get_stream_registry().get(stream_id)
+    if stream is None:
+        STREAM_RESUMES.inc(result="expired")
+        return False
+    STREAM_RESUMES.inc(result="resumed")
+    return stream, after
+
+
 @app.route("/chat/stream", methods=["POST"])
 async def chat_stream():
-    """流式聊天端點 - 支持 Server-Sent Events (SSE)"""
+    """
+    流式聊天端點 - 支持 Server-Sent Events (SSE)
+    
+    重新連線時帶入stream_id（請求欄位或X-Stream-Id標頭）與Last-Event-ID標頭（或last_event_id欄位），
+    從重播緩衝區接續原本的執行；串流已過期時若有query則重新執行，否則返回410
+    """
     global agent_instance
     
     if agent_instance is None:
@@ -102,18 +403,26 @@ async def chat_stream():
         user_id = data.get("user_id", "anonymous")
         session_id = data.get("session_id", f"session_{int(time.time())}")
         include_rag = data.get("include_rag", True)
+        resume_from = _resume_target(data.get("stream_id") or request.headers.get("X-Stream-Id"),
+                                     request.headers.get("Last-Event-ID") or data.get("last_event_id"))
         
-        if not query:
+        if not resume_from and not query:
+            if resume_from is False:
+                return {"error": "串流已過期，請重新發送查詢"}, 410
             return {"error": "查詢內容不能為空"}, 400
         
+        profile, profile_headers = _reserve_profile("/chat/stream")
+        
         async def generate():
             """SSE事件生成器"""
             last_heartbeat = time.time()
             heartbeat_interval = 30  # 30秒心跳間隔
             
+            if profile is not None:
+                profile.start()
             try:
                 # 調用agent的流式處理方法
-                async for response in agent_instance.astream(query, include_rag=include_rag):
+                async for response in _chat_events(query, include_rag, session_id, user_id, resume_from or None):
                     yield response
                     
                     # 檢查是否需要發送心跳
@@ -121,16 +430,21 @@ async def chat_stream():
                     if current_time - last_heartbeat > heartbeat_interval:
                         yield ": heartbeat\n\n"  # SSE格式的註釋行
                         last_heartbeat = current_time
-            except Exception as e:
-                print(f"❌ 流式聊天處理失敗: {e}")
-                print(traceback.format_exc())
-                # 發送錯誤事件
-                yield f"data: {json.dumps({'type': 'error', 'message': f'生成回應時發生錯誤: {str(e)}'}, ensure_ascii=False)}\n\n"
+            finally:
+                if profile is not None:
+                    profile.stop()
         
-        return Response(
-            generate(),
-            mimetype='text/event-stream',
-        )
+        try:
+            return Response(
+                _metered_sse(generate(), "/chat/stream"),
+                mimetype='text/event-stream',
+                headers=profile_headers,
+            )
+        except BaseException:
+            # 回應建立失敗時產生器不會執行，由這裡釋放剖析名額
+            if profile is not None:
+                profile.stop()
+            raise
         
     except Exception as e:
         print(f"❌ 請求處理失敗: {e}")
@@ -138,6 +452,220 @@ async def chat_stream():
         return {"error": f"請求處理失敗: {str(e)}"}, 500
 
 
+@app.route("/chat/stream/<stream_id>", methods=["GET"])
+async def resume_chat_stream(stream_id: str):
+    """以GET接續可續傳串流（供EventSource使用，Last-Event-ID標頭或?last_event_id=序號）"""
+    resume_from = _resume_target(stream_id, request.headers.get("Last-Event-ID") or request.args.get("last_event_id"))
+    if not resume_from:
+        return {"error": "找不到串流或串流已過期"}, 410
+    return Response(
+        _metered_sse(_chat_events("", True, None, None, resume_from), "/chat/stream"),
+        mimetype='text/event-stream',
+    )
+
+
+@app.route("/chat/stream/<stream_id>", methods=["DELETE"])
+async def cancel_chat_stream(stream_id: str):
+    """取消可續傳串流的Agent執行；Agent與連線分離，客戶端停止時需呼叫此端點，否則執行到寬限期結束"""
+    stream = get_stream_registry().get(stream_id)
+    if stream is None:
+        return {"error": "找不到串流或串流已過期"}, 404
+    return {"stream_id": stream_id, "cancelled": await stream.cancel()}
+
+
+def _parse_sse_frame(frame: str) -> Optional[Dict[str, Any]]:
+    """SSE幀的JSON內容；心跳等註釋行返回None"""
+    if not frame.startswith("data: "):
+        return None
+    try:
+        return json.loads(frame[6:])
+    except json.JSONDecodeError:
+        return None
+
+
+def _summarize_events(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """把Agent事件彙整為/chat回應的欄位（/chat與背景工作共用）"""
+    full_response = ""
+    rag_context = []
+    tools_used = []
+    charts = []
+    route = "agent"
+    budget_exhausted = None
+    usage = None
+    
+    for chunk_data in events:
+        if chunk_data.get("type") == "rag_context":
+            rag_context = chunk_data.get("context", [])
+        elif chunk_data.get("chunk"):
+            full_response += chunk_data.get("chunk", "")
+        elif chunk_data.get("type") == "tool_use":
+            tool_name = chunk_data.get("tool_name", "")
+            if tool_name and tool_name not in tools_used:
+                tools_used.append(tool_name)
+        elif chunk_data.get("type") == "chart_ready":
+            charts.append({"chart_id": chunk_data["chart_id"], "chart_url": chunk_data["chart_url"]})
+        elif chunk_data.get("type") == "route":
+            route = chunk_data.get("route", route)
+        elif chunk_data.get("type") == "budget_exhausted":
+            budget_exhausted = chunk_data.get("budget")
+        elif chunk_data.get("type") == "usage":
+            usage = {key: chunk_data.get(key) for key in ("request", "session", "user")}
+        elif chunk_data.get("content"):
+            full_response += chunk_data.get("content", "")
+    
+    return {
+        "response": full_response.strip(),
+        "rag_context": rag_context,
+        "tools_used": tools_used,
+        "charts": charts,
+        "route": route,
+        "budget_exhausted": budget_exhausted,
+        "usage": usage,
+    }
+
+
+async def _ws_put(queue: asyncio.Queue, message: Dict[str, Any]) -> None:
+    """放入連線的待送佇列；佇列滿時等待（暫停產生事件的串流）"""
+    if not queue.full():
+        queue.put_nowait(message)
+        return
+    waited = time.perf_counter()
+    await queue.put(message)
+    WS_SEND_WAIT.observe(time.perf_counter() - waited)
+
+
+def _ws_put_nowait(queue: asyncio.Queue, message: Dict[str, Any]) -> bool:
+    """放入待送佇列但不等待；佇列滿時丟棄並返回False（控制訊息不可阻塞接收迴圈）"""
+    try:
+        queue.put_nowait(message)
+    except asyncio.QueueFull:
+        return False
+    return True
+
+
+async def _ws_sender(queue: asyncio.Queue) -> None:
+    """連線上唯一的寫入者：依序送出所有串流的訊息"""
+    while True:
+        message = await queue.get()
+        await websocket.send(json.dumps(message, ensure_ascii=False))
+        WS_MESSAGES.inc(direction="out")
+
+
+async def _ws_stream(queue: asyncio.Queue, stream_id: str, query: str, include_rag: bool,
+                     session_id: Optional[str], user_id: Optional[str]) -> None:
+    """在WebSocket連線上執行一個Agent串流，事件以stream_id標記"""
+    started = time.perf_counter()
+    status = "completed"
+    events = _agent_events(query, include_rag, session_id, user_id)
+    ACTIVE_STREAMS.inc(endpoint="/ws/chat")
+    try:
+        async for frame in events:
+            event = _parse_sse_frame(frame)
+            if event is None:
+                continue
+            if event.get("type") == "error":
+                status = "error"
+            await _ws_put(queue, {"stream_id": stream_id, "event": event})
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    finally:
+        # 在同一個task中關閉astream，確保其清理（用量紀錄、追蹤）執行
+        await events.aclose()
+        ACTIVE_STREAMS.dec(endpoint="/ws/chat")
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint="/ws/chat")
+        end = {"stream_id": stream_id, "type": "end", "status": status}
+        if status == "cancelled":
+            # 取消或連線關閉時不等待佇列
+            _ws_put_nowait(queue, end)
+        else:
+            await _ws_put(queue, end)
+
+
+@app.websocket("/ws/chat")
+async def chat_ws():
+    """
+    多工WebSocket聊天端點：一條連線同時執行多個Agent串流（事件與/chat/stream相同）
+    
+    客戶端訊息：
+    - {"type": "start", "stream_id": "a1", "query": "...", "session_id": "...", "user_id": "...", "include_rag": true}
+    - {"type": "cancel", "stream_id": "a1"}
+    - {"type": "ping"}
+    
+    伺服器訊息：{"stream_id": "a1", "event": {...}}、串流結束時
+    {"stream_id": "a1", "type": "end", "status": "completed|cancelled|error"}；
+    無效的訊息回應 {"type": "error", "stream_id": ..., "message": ...}
+    """
+    await websocket.accept()
+    if agent_instance is None:
+        await websocket.send(json.dumps({"type": "error", "message": "Agent未初始化"}, ensure_ascii=False))
+        await websocket.close(1011)
+        return
+    
+    # 所有串流共用一個有上限的待送佇列：客戶端讀取太慢時各串流暫停，而不是在記憶體中堆積
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, config.WS_SEND_QUEUE_SIZE))
+    streams: Dict[str, asyncio.Task] = {}
+    sender = asyncio.create_task(_ws_sender(queue))
+    WS_CONNECTIONS.inc()
+    
+    def reply(message: Dict[str, Any]) -> None:
+        # 控制回覆不等待佇列：否則讀取慢的客戶端會讓接收迴圈停住，之後的cancel也要等佇列清空
+        if not _ws_put_nowait(queue, message):
+            WS_CONTROL_DROPPED.inc()
+    
+    def reject(message: str, stream_id: Optional[str] = None) -> None:
+        reply({"type": "error", "stream_id": stream_id, "message": message})
+    
+    try:
+        while True:
+            raw = await websocket.receive()
+            WS_MESSAGES.inc(direction="in")
+            try:
+                message = json.loads(raw)
+            except (TypeError, json.JSONDecodeError):
+                reject("訊息必須是JSON")
+                continue
+            if not isinstance(message, dict):
+                reject("訊息必須是JSON物件")
+                continue
+            
+            kind = message.get("type")
+            stream_id = message.get("stream_id")
+            if kind == "start":
+                query = message.get("query", "")
+                if not stream_id or stream_id in streams:
+                    reject("stream_id缺少或已在使用中", stream_id)
+                elif not query:
+                    reject("查詢內容不能為空", stream_id)
+                elif len(streams) >= config.WS_MAX_STREAMS:
+                    reject(f"同一連線最多同時執行 {config.WS_MAX_STREAMS} 個串流", stream_id)
+                else:
+                    task = asyncio.create_task(_ws_stream(
+                        queue, stream_id, query, message.get("include_rag", True),
+                        message.get("session_id"), message.get("user_id", "anonymous"),
+                    ))
+                    streams[stream_id] = task
+                    task.add_done_callback(lambda _task, sid=stream_id: streams.pop(sid, None))
+            elif kind == "cancel":
+                task = streams.get(stream_id)
+                if task is None:
+                    reject("找不到執行中的串流", stream_id)
+                else:
+                    task.cancel()
+            elif kind == "ping":
+                reply({"type": "pong"})
+            else:
+                reject(f"未知的訊息類型: {kind}", stream_id)
+    finally:
+        # 連線關閉：取消仍在執行的串流
+        pending = list(streams.values())
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        sender.cancel()
+        WS_CONNECTIONS.dec()
+
+
 @app.route("/chat", methods=["POST"])
 async def chat():
     """同步聊天端點"""
@@ -146,47 +674,41 @@ async def chat():
     if agent_instance is None:
         return {"error": "Agent未初始化"}, 500
     
+    timing = start_server_timing()
     try:
         data = await request.get_json()
         query = data.get("query", "")
         include_rag = data.get("include_rag", True)
         session_id = data.get("session_id")
+        user_id = data.get("user_id", "anonymous")
         
         if not query:
             return {"error": "查詢內容不能為空"}, 400
         
         # 收集流式回應
-        full_response = ""
-        rag_context = []
-        tools_used = []
+        events = []
         
-        async for chunk in agent_instance.astream(query, include_rag=include_rag):
-            if chunk.startswith("data: "):
-                try:
-                    chunk_data = json.loads(chunk[6:])
-                    
-                    if chunk_data.get("type") == "rag_context":
-                        rag_context = chunk_data.get("context", [])
-                    elif chunk_data.get("chunk"):
-                        full_response += chunk_data.get("chunk", "")
-                    elif chunk_data.get("type") == "tool_use":
-                        tool_name = chunk_data.get("tool_name", "")
-                        if tool_name and tool_name not in tools_used:
-                            tools_used.append(tool_name)
-                    elif chunk_data.get("content"):
-                        full_response += chunk_data.get("content", "")
-                        
-                except json.JSONDecodeError:
-                    pass
+        profile, profile_headers = _reserve_profile("/chat")
+        if profile is not None:
+            profile.start()
+        try:
+            async for chunk in agent_instance.astream(query, include_rag=include_rag,
+                                                      session_id=session_id, user_id=user_id):
+                chunk_data = _parse_sse_frame(chunk)
+                if chunk_data is not None:
+                    events.append(chunk_data)
+        finally:
+            if profile is not None:
+                profile.stop()
         
+        REQUEST_LATENCY.observe(time.perf_counter() - timing.started, endpoint="/chat")
         return {
-            "response": full_response.strip(),
-            "rag_context": rag_context,
-            "tools_used": tools_used,
+            **_summarize_events(events),
             "success": True,
             "timestamp": datetime.now().isoformat(),
-            "session_id": session_id
-        }
+            "session_id": session_id,
+            "profile_id": profile.profile_id if profile is not None else None
+        }, 200, {"Server-Timing": timing.header(), "Timing-Allow-Origin": "*", **profile_headers}
         
     except Exception as e:
         print(f"❌ 聊天處理失敗: {e}")
@@ -194,6 +716,85 @@ async def chat():
         return {"error": f"處理查詢時發生錯誤：{str(e)}"}, 500
 
 
+@app.route("/jobs", methods=["POST"])
+async def submit_job():
+    """提交背景工作：立即返回job_id，之後以GET /jobs/<job_id> 輪詢或 /jobs/<job_id>/events 訂閱"""
+    if agent_instance is None:
+        return {"error": "Agent未初始化"}, 500
+    
+    data = await request.get_json()
+    if not isinstance(data, dict):
+        return {"error": "請求內容必須是JSON物件"}, 400
+    query = data.get("query", "")
+    if not query or not isinstance(query, str):
+        return {"error": "查詢內容不能為空"}, 400
+    
+    queue = get_job_queue()
+    try:
+        job = queue.submit(
+            query,
+            data.get("priority", "normal"),
+            include_rag=data.get("include_rag", True),
+            session_id=data.get("session_id"),
+            user_id=data.get("user_id", "anonymous"),
+        )
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except JobQueueFull as e:
+        return {"error": str(e)}, 429, {"Retry-After": "30"}
+    
+    return {**job.info(), "position": queue.position(job)}, 202, {"Location": f"/jobs/{job.job_id}"}
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+async def get_job(job_id: str):
+    """
+    背景工作狀態；結束後附上與/chat相同的彙整結果
+    ?events_after=N 同時返回序號大於N的事件（輪詢增量）
+    """
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        return {"error": "找不到工作或結果已過期"}, 404
+    
+    result = {**job.info(), "position": queue.position(job)}
+    if job.done:
+        result["result"] = job.result
+    events_after = request.args.get("events_after", type=int)
+    if events_after is not None:
+        result["events"] = [{"seq": seq, "event": event} for seq, event in job.events_after(events_after)]
+    return result
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+async def job_events(job_id: str):
+    """以SSE訂閱背景工作的事件（Last-Event-ID標頭或?last_event_id=序號 接續），工作結束時送出job_end"""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return {"error": "找不到工作或結果已過期"}, 404
+    after = parse_last_event_id(request.headers.get("Last-Event-ID") or request.args.get("last_event_id"))
+    
+    async def generate():
+        async for seq, event in job.subscribe(after):
+            yield f"id: {seq}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        # 工作結束後不再保留事件，job_end附上彙整結果，讓錯過部分事件的訂閱者也能取得完整回應
+        end = {'type': 'job_end', 'job_id': job.job_id, 'status': job.status, 'result': job.result}
+        yield f"data: {json.dumps(end, ensure_ascii=False)}\n\n"
+    
+    return Response(_metered_sse(generate(), "/jobs/events"), mimetype='text/event-stream')
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+async def cancel_job(job_id: str):
+    """取消等待中或執行中的背景工作"""
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        return {"error": "找不到工作或結果已過期"}, 404
+    cancelled = await queue.cancel(job)
+    return {"job_id": job_id, "cancelled": cancelled, "status": job.status}
+
+
 @app.errorhandler(Exception)
 async def handle_exception(error):
     """全局異常處理器"""
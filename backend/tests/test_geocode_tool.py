@@ -0,0 +1,27 @@
+from datetime import datetime
+
+import pytest
+
+from agents.tools.geocode_tool import parse_local_datetime
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("2000-01-18 19:00", datetime(2000, 1, 18, 19, 0)),
+    ("2000/1/18 7:30pm", datetime(2000, 1, 18, 19, 30)),
+    ("2000年1月18日下午7點半", datetime(2000, 1, 18, 19, 30)),
+    ("2000年1月18日中午12點", datetime(2000, 1, 18, 12, 0)),
+    ("2000年1月18日凌晨12點", datetime(2000, 1, 18, 0, 0)),
+    ("2000年1月18日夜裡11點", datetime(2000, 1, 18, 23, 0)),
+    ("2000年1月18日夜裡2點", datetime(2000, 1, 18, 2, 0)),
+])
+def test_parse_local_datetime(text, expected):
+    assert parse_local_datetime(text) == (expected, False)
+
+
+@pytest.mark.parametrize("text", ["2000年1月31日晚上12點", "2000年1月31日夜裡12點"])
+def test_midnight_at_night_is_next_day(text):
+    assert parse_local_datetime(text) == (datetime(2000, 2, 1, 0, 0), False)
+
+
+def test_date_only_assumes_noon():
+    assert parse_local_datetime("2000-01-18") == (datetime(2000, 1, 18, 12, 0), True)
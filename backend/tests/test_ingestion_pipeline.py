@@ -0,0 +1,33 @@
+import random
+
+import pytest
+
+from ingestion.pipeline import chunk_text
+
+
+def _paragraphs(seed: int, count: int = 40) -> str:
+    rng = random.Random(seed)
+    return "\n\n".join("水星逆行。" * rng.randint(1, 180) for _ in range(count))
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("max_chars, overlap", [(800, 100), (300, 250), (200, 0)])
+def test_chunks_respect_max_chars(seed, max_chars, overlap):
+    chunks = chunk_text(_paragraphs(seed), max_chars, overlap)
+    assert chunks
+    assert all(len(chunk) <= max_chars for chunk in chunks)
+
+
+def test_overlap_carries_previous_tail():
+    text = "\n\n".join(f"第{i}段。" + "內容" * 100 for i in range(10))
+    chunks = chunk_text(text, max_chars=800, overlap=100)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk.startswith(previous[-10:])
+
+
+def test_edit_only_recuts_nearby_chunks():
+    paragraphs = [f"段落{i}：" + "星" * (50 + i * 7 % 90) for i in range(60)]
+    before = chunk_text("\n\n".join(paragraphs), max_chars=400, overlap=0)
+    paragraphs[30] += "修改"
+    after = chunk_text("\n\n".join(paragraphs), max_chars=400, overlap=0)
+    assert len(set(before) ^ set(after)) <= 6
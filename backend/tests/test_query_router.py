@@ -0,0 +1,31 @@
+import pytest
+
+from agents.query_router import QueryRouter
+
+
+@pytest.fixture
+def router():
+    return QueryRouter()
+
+
+@pytest.mark.parametrize("query, route", [
+    ("你好", "direct"),
+    ("thanks!", "direct"),
+    ("水星逆行是什麼意思？", "rag"),
+    ("ok, what does Mercury retrograde mean?", "rag"),
+    ("你好，水星逆行代表什麼？", "rag"),
+    ("幫我看我的本命盤", "agent"),
+    ("2000年1月18日下午7點在台北出生", "agent"),
+])
+def test_classify(router, query, route):
+    assert router.classify(query).route == route
+
+
+def test_tie_prefers_richer_route(router):
+    decision = router.classify("ok, what does Mercury retrograde mean?")
+    assert decision.scores["direct"] == decision.scores["rag"]
+    assert decision.reason == "classifier"
+
+
+def test_disabled_route_falls_back_to_agent():
+    assert QueryRouter(routes=["direct", "agent"]).classify("水星逆行是什麼意思？").route == "agent"
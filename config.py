@@ -45,6 +45,30 @@ class Config:
     ASTROLOGER_CONFIG_PATH: str = os.getenv("ASTROLOGER_CONFIG_PATH", "astrology_mcp.json")
     ENABLE_RAG_FALLBACK: bool = os.getenv("ENABLE_RAG_FALLBACK", "true").lower() == "true"
     MIN_CONTEXT_CHUNKS: int = int(os.getenv("MIN_CONTEXT_CHUNKS", "1"))
+    # 知識庫版本：重新匯入或同步知識庫後更新，讓語意回應快取失效
+    KNOWLEDGE_BASE_VERSION: str = os.getenv("KNOWLEDGE_BASE_VERSION", "")
+    
+    # 語意回應快取：只快取未使用個人化工具的知識型回答
+    RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+    RESPONSE_CACHE_TTL: float = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+    RESPONSE_CACHE_THRESHOLD: float = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+
+    # 查詢分流：閒聊直接回答（direct）、知識問題以RAG加單次模型呼叫回答（rag），其餘交給ReAct Agent（agent）
+    ROUTER_ENABLED: bool = os.getenv("ROUTER_ENABLED", "true").lower() == "true"
+    ROUTER_ROUTES: str = os.getenv("ROUTER_ROUTES", "direct,rag,agent")
+    ROUTER_DEFAULT_ROUTE: str = os.getenv("ROUTER_DEFAULT_ROUTE", "agent").lower()
+    ROUTER_DIRECT_MAX_CHARS: int = int(os.getenv("ROUTER_DIRECT_MAX_CHARS", "40"))
+    ROUTER_FAST_MAX_TOKENS: int = int(os.getenv("ROUTER_FAST_MAX_TOKENS", "1024"))
+
+    # 知識庫匯入（backend/ingestion）：切塊長度、嵌入與upsert批次大小、請求大小上限與最大並行數
+    INGEST_CHUNK_CHARS: int = int(os.getenv("INGEST_CHUNK_CHARS", "800"))
+    INGEST_CHUNK_OVERLAP: int = int(os.getenv("INGEST_CHUNK_OVERLAP", "100"))
+    INGEST_EMBED_BATCH_SIZE: int = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "96"))
+    INGEST_UPSERT_BATCH_SIZE: int = int(os.getenv("INGEST_UPSERT_BATCH_SIZE", "100"))
+    INGEST_MAX_REQUEST_BYTES: int = int(os.getenv("INGEST_MAX_REQUEST_BYTES", str(2 * 1024 * 1024)))
+    INGEST_MAX_CONCURRENCY: int = int(os.getenv("INGEST_MAX_CONCURRENCY", "8"))
+    INGEST_STATE_PATH: str = os.getenv("INGEST_STATE_PATH", "./ingest_state")
     
     # Application Configuration
     RESPONSE_TIMEOUT: int = 3600  # 1 hour
@@ -59,6 +83,24 @@ class Config:
     API_DEBUG: bool = os.getenv("API_DEBUG", "False").lower() == "true"
     API_WORKERS: int = int(os.getenv("API_WORKERS", "1"))
     
+    # WebSocket 多工聊天 (/ws/chat)：每條連線同時執行的串流數與待送訊息佇列長度（佇列滿時暫停產生事件）
+    WS_MAX_STREAMS: int = int(os.getenv("WS_MAX_STREAMS", "8"))
+    WS_SEND_QUEUE_SIZE: int = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+    
+    # 可續傳SSE串流：Agent執行與連線分離，中斷後以Last-Event-ID從重播緩衝區（每個串流最多保留的事件數）接續；
+    # 中斷超過寬限秒數未重新連線則取消執行，串流結束後緩衝區同樣保留寬限秒數
+    STREAM_RESUME_ENABLED: bool = os.getenv("STREAM_RESUME_ENABLED", "true").lower() == "true"
+    STREAM_REPLAY_BUFFER: int = int(os.getenv("STREAM_REPLAY_BUFFER", "2000"))
+    STREAM_RESUME_GRACE_SECONDS: float = float(os.getenv("STREAM_RESUME_GRACE_SECONDS", "60"))
+    
+    # 背景工作 (/jobs)：同時執行的Agent worker數、等待中工作上限、完成結果保留秒數與筆數、
+    # 執行中每個工作保留供接續的事件數（結束後只保留彙整結果）
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_QUEUE_MAX: int = int(os.getenv("JOB_QUEUE_MAX", "100"))
+    JOB_RESULT_TTL: float = float(os.getenv("JOB_RESULT_TTL", "3600"))
+    JOB_MAX_RETAINED: int = int(os.getenv("JOB_MAX_RETAINED", "500"))
+    JOB_MAX_EVENTS: int = int(os.getenv("JOB_MAX_EVENTS", "1000"))
+    
     # CORS 配置
     CORS_ORIGINS: List[str] = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://localhost:5173").split(",")
     CORS_METHODS: List[str] = ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
@@ -73,14 +115,87 @@ class Config:
     CHART_CACHE_PATH: str = os.getenv("CHART_CACHE_PATH", "./chart/cache")
     CHART_FORMAT: str = os.getenv("CHART_FORMAT", "svg")
     CHART_SERVICE_URL: str = os.getenv("CHART_SERVICE_URL", "http://localhost:3001")
+    CHART_STORE_SIZE: int = int(os.getenv("CHART_STORE_SIZE", "256"))
+    # 星盤摘要中保留的相位數（依容許度排序）
+    NATAL_SUMMARY_MAX_ASPECTS: int = int(os.getenv("NATAL_SUMMARY_MAX_ASPECTS", "12"))
+    # 從訊息辨識出生資料後預先在背景計算星盤
+    CHART_PRECOMPUTE_ENABLED: bool = os.getenv("CHART_PRECOMPUTE_ENABLED", "true").lower() == "true"
+    CHART_PRECOMPUTE_WORKERS: int = int(os.getenv("CHART_PRECOMPUTE_WORKERS", "2"))
+    CHART_PRECOMPUTE_TTL: float = float(os.getenv("CHART_PRECOMPUTE_TTL", "300"))
+    # SVG在背景執行緒繪製；串流結束後最多再等待CHART_RENDER_WAIT秒送出chart_ready事件
+    CHART_RENDER_WORKERS: int = int(os.getenv("CHART_RENDER_WORKERS", "2"))
+    CHART_RENDER_WAIT: float = float(os.getenv("CHART_RENDER_WAIT", "10"))
+    # 行運計算：取樣步長（天）、容許度（度）與回傳事件上限
+    TRANSIT_STEP_DAYS: float = float(os.getenv("TRANSIT_STEP_DAYS", "1.0"))
+    TRANSIT_ORB: float = float(os.getenv("TRANSIT_ORB", "1.0"))
+    TRANSIT_MAX_EVENTS: int = int(os.getenv("TRANSIT_MAX_EVENTS", "40"))
+    # 合盤計算：黃經向量快取數、工具回傳相位上限與批次評分候選上限
+    SYNASTRY_CACHE_SIZE: int = int(os.getenv("SYNASTRY_CACHE_SIZE", "20000"))
+    SYNASTRY_MAX_ASPECTS: int = int(os.getenv("SYNASTRY_MAX_ASPECTS", "15"))
+    SYNASTRY_MAX_CANDIDATES: int = int(os.getenv("SYNASTRY_MAX_CANDIDATES", "10000"))
     
     # ReAct Agent 配置
     AGENT_TEMPERATURE: float = float(os.getenv("AGENT_TEMPERATURE", "0.7"))
     AGENT_MAX_ITERATIONS: int = int(os.getenv("AGENT_MAX_ITERATIONS", "5"))
     AGENT_MAX_TOKENS: int = int(os.getenv("AGENT_MAX_TOKENS", "4096"))
+    # 每個請求的預算：工具呼叫數、總token數（提示加輸出）與執行秒數；用盡時以已取得的資料產生最終回答
+    AGENT_MAX_TOOL_CALLS: int = int(os.getenv("AGENT_MAX_TOOL_CALLS", "8"))
+    AGENT_TOKEN_BUDGET: int = int(os.getenv("AGENT_TOKEN_BUDGET", "60000"))
+    AGENT_TIMEOUT_SECONDS: float = float(os.getenv("AGENT_TIMEOUT_SECONDS", "90"))
+    AGENT_FINAL_ANSWER_TOKENS: int = int(os.getenv("AGENT_FINAL_ANSWER_TOKENS", "800"))
+    AGENT_FINAL_ANSWER_SECONDS: float = float(os.getenv("AGENT_FINAL_ANSWER_SECONDS", "30"))
+    # 同一步驟的多個工具呼叫並行執行，最多同時執行的數量
+    AGENT_MAX_PARALLEL_TOOLS: int = int(os.getenv("AGENT_MAX_PARALLEL_TOOLS", "4"))
+    # 串流模式：lean（LangGraph messages/updates）或 events（astream_events v1）
+    AGENT_STREAM_MODE: str = os.getenv("AGENT_STREAM_MODE", "lean").lower()
     
     # 搜尋工具配置
     SEARCH_API_KEY: str = os.getenv("SEARCH_API_KEY", "")
+
+    # 追蹤配置 (local | langsmith | none)
+    TRACING_BACKEND: str = os.getenv("TRACING_BACKEND", "local").lower()
+    TRACING_PROJECT: str = os.getenv("TRACING_PROJECT", "test")
+    TRACE_SAMPLE_RATE: float = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+    TRACE_BUFFER_SIZE: int = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+    TRACE_MIN_DURATION_MS: float = float(os.getenv("TRACE_MIN_DURATION_MS", "0"))
+
+    # 錄製/重播配置 (off | record | replay)
+    CASSETTE_MODE: str = os.getenv("CASSETTE_MODE", "off").lower()
+    CASSETTE_DIR: str = os.getenv("CASSETTE_DIR", "./cassettes")
+    CASSETTE_TIME_SCALE: float = float(os.getenv("CASSETTE_TIME_SCALE", "1.0"))
+
+    # 單次請求剖析配置（以 X-Profile: 1 標頭或 ?profile=1 觸發）
+    PROFILING_ENABLED: bool = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    PROFILING_TOKEN: str = os.getenv("PROFILING_TOKEN", "")
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", "./profiles")
+    PROFILE_MAX_CONCURRENT: int = int(os.getenv("PROFILE_MAX_CONCURRENT", "2"))
+    PROFILE_SAMPLE_INTERVAL_MS: float = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+
+    # Token用量統計：每個請求的模型與嵌入token數，依session與使用者累計並保存在本地SQLite
+    USAGE_STORE_ENABLED: bool = os.getenv("USAGE_STORE_ENABLED", "true").lower() == "true"
+    USAGE_DB_PATH: str = os.getenv("USAGE_DB_PATH", "./usage/usage.sqlite3")
+
+    # 依賴服務斷路器（嵌入、Pinecone、MCP工具）：統計視窗秒數內至少達最少呼叫數、且失敗或慢呼叫比例達門檻時開啟，
+    # 開啟期間立即失敗並改用備援（最近的RAG結果或略過RAG），冷卻秒數後以單一探測呼叫決定是否關閉
+    BREAKER_ENABLED: bool = os.getenv("BREAKER_ENABLED", "true").lower() == "true"
+    BREAKER_WINDOW_SECONDS: float = float(os.getenv("BREAKER_WINDOW_SECONDS", "30"))
+    BREAKER_MIN_CALLS: int = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+    BREAKER_FAILURE_RATE: float = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+    BREAKER_SLOW_CALL_SECONDS: float = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "3"))
+    BREAKER_OPEN_SECONDS: float = float(os.getenv("BREAKER_OPEN_SECONDS", "15"))
+    # 依賴呼叫的逾時秒數（逾時計為失敗）
+    EMBEDDING_TIMEOUT_SECONDS: float = float(os.getenv("EMBEDDING_TIMEOUT_SECONDS", "5"))
+    PINECONE_TIMEOUT_SECONDS: float = float(os.getenv("PINECONE_TIMEOUT_SECONDS", "5"))
+    MCP_TOOL_TIMEOUT_SECONDS: float = float(os.getenv("MCP_TOOL_TIMEOUT_SECONDS", "30"))
+
+    # 事件迴圈延遲監控
+    LOOP_MONITOR_ENABLED: bool = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+    LOOP_MONITOR_INTERVAL_MS: float = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "100"))
+    LOOP_LAG_THRESHOLD_MS: float = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100"))
+
+    # 除錯端點配置 (/debug/*)：預設關閉（會暴露查詢內容與使用者ID）；設定DEBUG_TOKEN時需以X-Debug-Token標頭帶入
+    DEBUG_ENDPOINTS_ENABLED: bool = os.getenv("DEBUG_ENDPOINTS_ENABLED", "false").lower() == "true"
+    DEBUG_TOKEN: str = os.getenv("DEBUG_TOKEN", "")
     
     @classmethod
     def validate_config(cls) -> bool:
@@ -38,6 +38,22 @@ export default function ChatPage() {
     }
   };
 
+  // 取最新一次 natal_figure 產生的星盤圖（由後端 /charts 提供）
+  const latestChartUrl = (() => {
+    for (let i = currentChat.length - 1; i >= 0; i--) {
+      const message = currentChat[i];
+      if (message.type === "tool_result" && message.tool_name === "natal_figure") {
+        try {
+          const summary = JSON.parse(message.tool_result);
+          if (summary.chart_url) return `http://localhost:8000${summary.chart_url}`;
+        } catch {
+          // 舊格式的工具結果不含 chart_url
+        }
+      }
+    }
+    return astroChart.imageUrl;
+  })();
+
   // 自動滾動到底部
   useEffect(() => {
     const container = chatContainerRef.current;
@@ -209,7 +225,7 @@ export default function ChatPage() {
         </div>
         {/* 星盤圖片 */}
         <div className="p-4">
-         <Image src={'/charts/123_natal_chart.svg'} className="w-full h-full" alt="星盤圖片" width={1980} height={1980} />
+         <Image src={latestChartUrl} className="w-full h-full" alt="星盤圖片" width={1980} height={1980} unoptimized />
         </div>
 
         {/* 星盤解釋 */}
@@ -1,6 +1,12 @@
-import { useState, useCallback } from "react";
+import { useState, useCallback, useRef } from "react";
 import { Message } from "@/types/Message";
 
+const STREAM_URL = "http://localhost:8000/chat/stream";
+// 連線中斷時以 stream_id 與 Last-Event-ID 接續後端仍在執行的串流（不重新執行 Agent）
+const MAX_RESUME_ATTEMPTS = 3;
+
+class StreamHttpError extends Error {}
+
 interface UseChatProps {
 //   userId: string | undefined;
 //   sessionId: string | null;
@@ -24,6 +30,12 @@ export const useChat = ({
   const [currentChat, setCurrentChat] = useState<Message[]>([]);
   const [isChatLoading, setIsChatLoading] = useState(false);
   const [isStreaming, setIsStreaming] = useState(false);
+  const controllerRef = useRef<AbortController | null>(null);
+  // 後端串流的 stream_id 與最後處理完的事件序號
+  const streamRef = useRef<{ streamId: string | null; lastEventId: string | null }>({
+    streamId: null,
+    lastEventId: null,
+  });
 
   const handleChat = useCallback(
     async (message: string, extraParamsInput?: Record<string, any>) => {
@@ -39,6 +51,8 @@ export const useChat = ({
     //   }
       const controller = new AbortController();
       const { signal } = controller;
+      controllerRef.current = controller;
+      streamRef.current = { streamId: null, lastEventId: null };
       const timeoutId = setTimeout(() => controller.abort(), 600000);
       try {
         setCurrentChat((prev) => [
@@ -109,206 +123,272 @@ export const useChat = ({
           });
         }
 
-        const response = await fetch('http://localhost:8000/chat/stream', {
-          method: "POST",
-          headers: {
-            "Content-Type": "application/json",
-            Accept: "text/event-stream",
-          },
-          body: JSON.stringify({
-            query: message,
-            // user_id: userId,
-            // session_id: sessionId,
-            // lang: "tw",
-            ...extraParams,
-            ...extraParamsInput,
-          }),
-          signal, // 添加signal参数
-        });
+        let buffer = "";
+        let resumeAttempts = 0;
+        while (true) {
+          try {
+            const { streamId, lastEventId } = streamRef.current;
+            const response = await fetch(STREAM_URL, {
+              method: "POST",
+              headers: {
+                "Content-Type": "application/json",
+                Accept: "text/event-stream",
+                // 重新連線時從最後收到的事件之後接續
+                ...(streamId ? { "Last-Event-ID": lastEventId || "0" } : {}),
+              },
+              body: JSON.stringify(
+                streamId
+                  ? { stream_id: streamId }
+                  : {
+                      query: message,
+                      // user_id: userId,
+                      // session_id: sessionId,
+                      // lang: "tw",
+                      ...extraParams,
+                      ...extraParamsInput,
+                    }
+              ),
+              signal, // 添加signal参数
+            });
 
-        if (!response.ok) {
-          const errorText = await response.text();
-          console.error("API Error:", {
-            status: response.status,
-            statusText: response.statusText,
-            body: errorText,
-          });
-          throw new Error(
-            `HTTP error! status: ${response.status}, message: ${errorText}`
-          );
-        }
+            if (!response.ok) {
+              const errorText = await response.text();
+              console.error("API Error:", {
+                status: response.status,
+                statusText: response.statusText,
+                body: errorText,
+              });
+              throw new StreamHttpError(
+                `HTTP error! status: ${response.status}, message: ${errorText}`
+              );
+            }
 
-        if (!response.body) {
-          throw new Error("Response body is null");
-        }
+            if (!response.body) {
+              throw new Error("Response body is null");
+            }
 
-        setIsStreaming(true);
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-        let buffer = "";
+            setIsStreaming(true);
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            buffer = "";
+            let pendingEventId: string | null = null;
 
-        while (true) {
-          const { value, done } = await reader.read();
-          if (done) break;
-          if (isStopChat) break;
+            while (true) {
+              const { value, done } = await reader.read();
+              if (done) break;
+              if (signal.aborted) break;
 
-          buffer += decoder.decode(value, { stream: true });
+              buffer += decoder.decode(value, { stream: true });
 
-          const lines = buffer.split("\n");
-          buffer = lines.pop() || "";
+              const lines = buffer.split("\n");
+              buffer = lines.pop() || "";
 
-          for (const line of lines) {
-            if (line.trim()) {
-              try {
-                const jsonStr = line.replace("data: ", "");
-                const parsedData = JSON.parse(jsonStr);
-                if (parsedData.type === "start_response") {
-                  setCurrentChat((prev) => {
-                    // 找到最后一条 human 消息的索引
-                    const lastHumanIndex = [...prev].findLastIndex(
-                      (msg) => msg.role === "human"
-                    );
+              for (const line of lines) {
+                // SSE 的 id 欄位：對應的 data 行處理完才記為已收到
+                if (line.startsWith("id: ")) {
+                  pendingEventId = line.slice(4).trim();
+                  continue;
+                }
+                // 只解析 data 行（略過心跳等註釋行）
+                if (line.startsWith("data: ")) {
+                  try {
+                    const parsedData = JSON.parse(line.slice(6));
+                    if (parsedData.type === "stream") {
+                      streamRef.current.streamId = parsedData.stream_id;
+                    }
+                    if (parsedData.type === "replay_gap") {
+                      console.warn("Stream replay gap, events missed:", parsedData.missed);
+                    }
+                    if (parsedData.type === "start_response") {
+                      setCurrentChat((prev) => {
+                        // 找到最后一条 human 消息的索引
+                        const lastHumanIndex = [...prev].findLastIndex(
+                          (msg) => msg.role === "human"
+                        );
 
-                    // 初始化 sources 数组
-                    let sources = [];
+                        // 初始化 sources 数组
+                        let sources = [];
 
-                    // 如果找到了 human 消息
-                    if (lastHumanIndex !== -1) {
-                      // 查找该 human 消息之后的消息中是否有符合条件的 tool_result 消息
-                      for (let i = lastHumanIndex + 1; i < prev.length; i++) {
-                        const msg = prev[i];
+                        // 如果找到了 human 消息
+                        if (lastHumanIndex !== -1) {
+                          // 查找该 human 消息之后的消息中是否有符合条件的 tool_result 消息
+                          for (let i = lastHumanIndex + 1; i < prev.length; i++) {
+                            const msg = prev[i];
+                            if (
+                              msg.type === "tool_result" &&
+                              msg.tool_name === "search_laws" &&
+                              msg.tool_result
+                            ) {
+                              sources = msg.tool_result as any;
+                              break;
+                            }
+                          }
+                        }
+                        return [
+                          ...prev,
+                          {
+                            role: "ai",
+                            content: "",
+                            sources: sources,
+                            prompts: [],
+                            type: "text",
+                          },
+                        ];
+                      });
+                    }
+                    if (parsedData.chunk) {
+                      setCurrentChat((prev) => {
+                        const lastMessage = prev[prev.length - 1];
                         if (
-                          msg.type === "tool_result" &&
-                          msg.tool_name === "search_laws" &&
-                          msg.tool_result
+                          lastMessage &&
+                          lastMessage.role === "ai" &&
+                          lastMessage.type === "text"
                         ) {
-                          sources = msg.tool_result as any;
-                          break;
+                          const updatedChat = [...prev];
+                          updatedChat[updatedChat.length - 1] = {
+                            role: "ai",
+                            content: lastMessage.content + parsedData.chunk,
+                            sources: lastMessage.sources,
+                            prompts: lastMessage.prompts,
+                            type: "text",
+                          };
+                          return updatedChat;
                         }
-                      }
+
+                        return [
+                          ...prev,
+                          {
+                            role: "ai",
+                            content: parsedData.chunk,
+                            type: "text",
+                          },
+                        ];
+                      });
                     }
-                    return [
-                      ...prev,
-                      {
-                        role: "ai",
-                        content: "",
-                        sources: sources,
-                        prompts: [],
-                        type: "text",
-                      },
-                    ];
-                  });
-                }
-                if (parsedData.chunk) {
-                  setCurrentChat((prev) => {
-                    const lastMessage = prev[prev.length - 1];
-                    if (
-                      lastMessage &&
-                      lastMessage.role === "ai" &&
-                      lastMessage.type === "text"
-                    ) {
-                      const updatedChat = [...prev];
-                      updatedChat[updatedChat.length - 1] = {
-                        role: "ai",
-                        content: lastMessage.content + parsedData.chunk,
-                        sources: lastMessage.sources,
-                        prompts: lastMessage.prompts,
-                        type: "text",
-                      };
-                      return updatedChat;
+                    if (parsedData.done) {
+                      setIsStreaming(false);
                     }
-
-                    return [
-                      ...prev,
-                      {
-                        role: "ai",
-                        content: parsedData.chunk,
-                        type: "text",
-                      },
-                    ];
-                  });
-                }
-                if (parsedData.done) {
-                  setIsStreaming(false);
-                }
-                if (parsedData.type === "text") {
-                  setCurrentChat((prev) => {
-                    // 直接添加新消息，不再查找和更新现有消息
-                    return [
-                      ...prev,
-                      {
-                        role: "ai",
-                        content: parsedData.content,
-                        type: "text",
-                      },
-                    ];
-                  });
-                }
-                if (parsedData.type === "tool_use") {
-                  setCurrentChat((prev) => {
-                    // 直接添加新消息，不再查找和更新现有消息
-                    return [
-                      ...prev,
-                      {
-                        role: "ai",
-                        content: parsedData.content,
-                        tool_id: parsedData.tool_id,
-                        tool_name: parsedData.tool_name,
-                        tool_args: parsedData.tool_args,
-                        type: "tool_use",
-                      },
-                    ];
-                  });
-                }
-                if (parsedData.type === "tool_result") {
-                  setCurrentChat((prev) => {
-                    // 直接添加新消息，不再查找和更新现有消息
-                    return [
-                      ...prev,
-                      {
-                        role: "ai",
-                        content: "",
-                        tool_result: parsedData.tool_result,
-                        tool_id: parsedData.tool_id,
-                        tool_name: parsedData.tool_name,
-                        type: "tool_result",
-                      },
-                    ];
-                  });
-                }
-                if (parsedData.type === "prompts") {
-                  setCurrentChat((prev) => {
-                    const lastMessage = prev[prev.length - 1];
-                    if (
-                      lastMessage &&
-                      lastMessage.role === "ai" &&
-                      lastMessage.type === "text"
-                    ) {
-                      const updatedChat = [...prev];
-                      updatedChat[updatedChat.length - 1] = {
-                        role: "ai",
-                        content: lastMessage.content,
-                        prompts: parsedData.content,
-                        type: "text",
-                      };
-                      return updatedChat;
+                    if (parsedData.type === "text") {
+                      setCurrentChat((prev) => {
+                        // 直接添加新消息，不再查找和更新现有消息
+                        return [
+                          ...prev,
+                          {
+                            role: "ai",
+                            content: parsedData.content,
+                            type: "text",
+                          },
+                        ];
+                      });
+                    }
+                    if (parsedData.type === "tool_use") {
+                      setCurrentChat((prev) => {
+                        // 直接添加新消息，不再查找和更新现有消息
+                        return [
+                          ...prev,
+                          {
+                            role: "ai",
+                            content: parsedData.content,
+                            tool_id: parsedData.tool_id,
+                            tool_name: parsedData.tool_name,
+                            tool_args: parsedData.tool_args,
+                            type: "tool_use",
+                          },
+                        ];
+                      });
                     }
+                    if (parsedData.type === "tool_result") {
+                      setCurrentChat((prev) => {
+                        // 直接添加新消息，不再查找和更新现有消息
+                        return [
+                          ...prev,
+                          {
+                            role: "ai",
+                            content: "",
+                            tool_result: parsedData.tool_result,
+                            tool_id: parsedData.tool_id,
+                            tool_name: parsedData.tool_name,
+                            type: "tool_result",
+                          },
+                        ];
+                      });
+                    }
+                    if (parsedData.type === "chart_ready") {
+                      // 背景繪製完成的星盤圖：補上對應 natal_figure 結果的 chart_url
+                      setCurrentChat((prev) =>
+                        prev.map((message) => {
+                          if (message.type !== "tool_result" || message.tool_name !== "natal_figure") {
+                            return message;
+                          }
+                          try {
+                            const summary = JSON.parse(message.tool_result);
+                            if (summary.chart_id !== parsedData.chart_id) return message;
+                            return {
+                              ...message,
+                              tool_result: JSON.stringify({ ...summary, chart_url: parsedData.chart_url }),
+                            };
+                          } catch {
+                            return message;
+                          }
+                        })
+                      );
+                    }
+                    if (parsedData.type === "prompts") {
+                      setCurrentChat((prev) => {
+                        const lastMessage = prev[prev.length - 1];
+                        if (
+                          lastMessage &&
+                          lastMessage.role === "ai" &&
+                          lastMessage.type === "text"
+                        ) {
+                          const updatedChat = [...prev];
+                          updatedChat[updatedChat.length - 1] = {
+                            role: "ai",
+                            content: lastMessage.content,
+                            prompts: parsedData.content,
+                            type: "text",
+                          };
+                          return updatedChat;
+                        }
 
-                    return [
-                      ...prev,
-                      {
-                        role: "ai",
-                        content: lastMessage.content,
-                        prompts: parsedData.content,
-                        type: "text",
-                      },
-                    ];
-                  });
+                        return [
+                          ...prev,
+                          {
+                            role: "ai",
+                            content: lastMessage.content,
+                            prompts: parsedData.content,
+                            type: "text",
+                          },
+                        ];
+                      });
+                    }
+                  } catch (e) {
+                    console.warn("Failed to parse line:", e);
+                  }
+                  if (pendingEventId !== null) {
+                    streamRef.current.lastEventId = pendingEventId;
+                    pendingEventId = null;
+                  }
                 }
-              } catch (e) {
-                console.warn("Failed to parse line:", e);
               }
             }
+            break;
+          } catch (error) {
+            // 已取消、HTTP 錯誤或尚未取得 stream_id 時無法接續
+            if (
+              signal.aborted ||
+              error instanceof StreamHttpError ||
+              !streamRef.current.streamId ||
+              resumeAttempts >= MAX_RESUME_ATTEMPTS
+            ) {
+              throw error;
+            }
+            resumeAttempts += 1;
+            console.warn(
+              `Stream interrupted, resuming ${streamRef.current.streamId} (attempt ${resumeAttempts})`,
+              error
+            );
+            await new Promise((resolve) => setTimeout(resolve, 1000 * resumeAttempts));
           }
         }
         if (buffer.trim()) {
@@ -345,6 +425,9 @@ export const useChat = ({
           }
         }
       } catch (error) {
+        if (signal.aborted) {
+          return;
+        }
         console.error("Stream error:", error);
         throw error;
       } finally {
@@ -352,17 +435,31 @@ export const useChat = ({
         setIsStreaming(false);
         clearTimeout(timeoutId);
         setIsStopChat(false);
+        controllerRef.current = null;
       }
     },
     // 添加新的依赖项
-    [isStopChat, chatContainerRef]
+    [chatContainerRef]
   );
 
+  // 停止回答：中斷連線並取消後端的執行（後端執行與連線分離，只中斷連線不會停止）
+  const stopChat = useCallback(() => {
+    setIsStopChat(true);
+    controllerRef.current?.abort();
+    const { streamId } = streamRef.current;
+    if (streamId) {
+      fetch(`${STREAM_URL}/${streamId}`, { method: "DELETE" }).catch((e) =>
+        console.warn("Failed to cancel stream:", e)
+      );
+    }
+  }, []);
+
 
   return {
     handleChat,
     isStopChat,
     setIsStopChat,
+    stopChat,
     currentChat,
     setCurrentChat,
     isChatLoading,